@@ -0,0 +1,29 @@
+"""
+Stand-in for sbatch to test the orchestration scripts without SLURM.
+
+Accepts the sbatch options the orchestrators use, prints a new job id the
+way `sbatch --parsable` does, and appends each call to FAKE_SBATCH_LOG
+(default fake_sbatch.log) as "JOB_ID ARGS...". Nothing is executed.
+
+Usage:
+    python orchestrate.py --sbatch "python ../fake_sbatch.py"
+"""
+import os
+import sys
+import fcntl
+
+state_file = os.getenv("FAKE_SBATCH_STATE", "/tmp/fake_sbatch_next_id")
+log_file = os.getenv("FAKE_SBATCH_LOG", "fake_sbatch.log")
+
+with open(state_file, "a+") as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    f.seek(0)
+    job_id = int(f.read().strip() or 1000) + 1
+    f.seek(0)
+    f.truncate()
+    f.write(str(job_id))
+
+with open(log_file, "a") as f:
+    f.write(f"{job_id} {' '.join(sys.argv[1:])}\n")
+
+print(job_id)
@@ -0,0 +1,217 @@
+"""
+Sycamore-style random circuits for random circuit sampling (RCS), written as
+OpenQASM 2.0 under the naming convention of the shipped circuits plus a
+_gen tag (circuit_n{n}_m{m}_s{seed}_e0_p{pattern}_gen.qasm), so they never
+overwrite a shipped circuit. The experiments pick them up with QUBITS,
+CYCLES, CIRCUIT_SEED and PATTERN where no shipped circuit has these
+parameters, or with GENERATED_CIRCUIT=1 (see select_circuit).
+
+The n qubits are the n qubits of the 53-qubit Sycamore grid closest to its
+centre. Each of the m cycles applies a random single-qubit gate from
+{sqrt(X), sqrt(Y), sqrt(W)} to every qubit, never the same gate twice in a
+row on a qubit, followed by fSim(theta, phi) on the couplers of one layer.
+A final layer of single-qubit gates ends the circuit. The layers follow
+Cirq's grid interaction layers: A-D are staggered, E-H aligned, and the
+pattern string is repeated over the cycles (ABCDCDAB for the m20
+circuit, EFGH for the m14 one).
+
+fSim is emitted as 4 cx: two for the XX+YY rotation and two for the
+controlled phase, exact up to global phase.
+
+Only the standard library is used, so the orchestration scripts can
+generate circuits on the login node.
+
+Usage:
+    python generate_rcs.py --qubits 20 --cycles 12 --pattern ABCDCDAB --seed 0
+"""
+import sys
+import math
+import random
+import argparse
+from pathlib import Path
+
+from shared import GLOBAL_VARS, circuit_file_name, select_circuit
+
+# (row, column) of the working qubits of Sycamore, as in the "// Qubits:" header of the shipped circuits
+SYCAMORE_QUBITS = [
+    (0, 5), (0, 6), (1, 4), (1, 5), (1, 6), (1, 7), (2, 4), (2, 5), (2, 6), (2, 7), (2, 8),
+    (3, 2), (3, 3), (3, 4), (3, 5), (3, 6), (3, 7), (3, 8), (3, 9), (4, 1), (4, 2), (4, 3),
+    (4, 4), (4, 5), (4, 6), (4, 7), (4, 8), (4, 9), (5, 0), (5, 1), (5, 2), (5, 3), (5, 4),
+    (5, 5), (5, 6), (5, 7), (5, 8), (6, 1), (6, 2), (6, 3), (6, 4), (6, 5), (6, 6), (6, 7),
+    (7, 2), (7, 3), (7, 4), (7, 5), (7, 6), (8, 3), (8, 4), (8, 5), (9, 4),
+]
+
+# Layer: (vertical, column offset, stagger)
+LAYERS = {
+    "A": (True, 0, True),
+    "B": (True, 1, True),
+    "C": (False, 1, True),
+    "D": (False, 0, True),
+    "E": (False, 0, False),
+    "F": (False, 1, False),
+    "G": (True, 0, False),
+    "H": (True, 1, False),
+}
+
+# sqrt(X), sqrt(Y) and sqrt(W) with W = (X + Y) / sqrt(2), up to global phase
+SINGLE_QUBIT_GATES = ["rx(pi*0.5)", "ry(pi*0.5)", "u3(pi*0.5, pi*-0.25, pi*0.25)"]
+
+# fSim angles of the Sycamore couplers
+FSIM_THETA = math.pi / 2
+FSIM_PHI = math.pi / 6
+
+
+############## Layout ##############
+def select_qubits(num_qubits: int) -> list:
+    """
+    Returns:
+        list: The num_qubits Sycamore qubits closest to the centre of the grid, sorted
+    """
+    if not 1 <= num_qubits <= len(SYCAMORE_QUBITS):
+        raise ValueError(f"Sycamore circuits have 1 to {len(SYCAMORE_QUBITS)} qubits, not {num_qubits}.")
+
+    row = sum(qubit[0] for qubit in SYCAMORE_QUBITS) / len(SYCAMORE_QUBITS)
+    column = sum(qubit[1] for qubit in SYCAMORE_QUBITS) / len(SYCAMORE_QUBITS)
+    by_distance = sorted(SYCAMORE_QUBITS, key=lambda qubit: ((qubit[0] - row) ** 2 + (qubit[1] - column) ** 2, qubit))
+    return sorted(by_distance[:num_qubits])
+
+
+def in_layer(a: tuple, b: tuple, layer: str) -> bool:
+    """
+    Whether the coupler between grid qubits a and b belongs to a layer.
+    """
+    vertical, column_offset, stagger = LAYERS[layer]
+    if vertical:
+        # Vertical layers are the horizontal ones of the transposed grid
+        a, b = (a[1], a[0]), (b[1], b[0])
+    a, b = sorted((a, b))
+
+    if a[0] != b[0] or b[1] != a[1] + 1:
+        return False
+    position = (a[0] % 2, (a[1] - column_offset) % 2)
+    return position == (0, 0) or position == (1, int(stagger))
+
+
+def layer_couplers(qubits: list, layer: str) -> list:
+    """
+    Returns:
+        list: [(index, index), ...] of the couplers of a layer among qubits
+    """
+    index = {qubit: i for i, qubit in enumerate(qubits)}
+    couplers = []
+    for a in qubits:
+        for b in ((a[0] + 1, a[1]), (a[0], a[1] + 1)):
+            if b in index and in_layer(a, b, layer):
+                couplers.append((index[a], index[b]))
+    return couplers
+
+
+############## Circuit ##############
+def _angle(radians: float) -> str:
+    return f"pi*{radians / math.pi!r}"
+
+
+def fsim_qasm(a: int, b: int, theta: float = FSIM_THETA, phi: float = FSIM_PHI) -> list:
+    """
+    Returns:
+        list: Statements of fSim(theta, phi) on q[a], q[b] with 4 cx
+    """
+    return [
+        # exp(-i theta/2 (XX + YY))
+        f"sdg q[{b}]", f"sx q[{b}]", f"s q[{b}]", f"s q[{a}]",
+        f"cx q[{b}],q[{a}]",
+        f"ry({_angle(-theta)}) q[{b}]", f"ry({_angle(-theta)}) q[{a}]",
+        f"cx q[{b}],q[{a}]",
+        f"sdg q[{a}]", f"sdg q[{b}]", f"sxdg q[{b}]", f"s q[{b}]",
+        # diag(1, 1, 1, exp(-i phi))
+        f"u1({_angle(-phi / 2)}) q[{a}]",
+        f"cx q[{a}],q[{b}]",
+        f"u1({_angle(phi / 2)}) q[{b}]",
+        f"cx q[{a}],q[{b}]",
+        f"u1({_angle(-phi / 2)}) q[{b}]",
+    ]
+
+
+def generate_rcs(num_qubits: int, cycles: int, seed: int, pattern: str,
+                 theta: float = FSIM_THETA, phi: float = FSIM_PHI) -> str:
+    """
+    Returns:
+        str: The OpenQASM 2.0 text of the circuit
+
+    Raises:
+        ValueError: For an unknown layer in pattern or an unsupported qubit count
+    """
+    unknown_layers = set(pattern) - set(LAYERS)
+    if not pattern or unknown_layers:
+        raise ValueError(f"Patterns are made of the layers {''.join(LAYERS)}, got {pattern!r}.")
+
+    qubits = select_qubits(num_qubits)
+    rng = random.Random(seed)
+    previous = [None] * num_qubits
+
+    def single_qubit_layer() -> list:
+        statements = []
+        for i in range(num_qubits):
+            previous[i] = rng.choice([gate for gate in range(len(SINGLE_QUBIT_GATES)) if gate != previous[i]])
+            statements.append(f"{SINGLE_QUBIT_GATES[previous[i]]} q[{i}]")
+        return statements
+
+    lines = [
+        f"// Generated by generate_rcs.py (n={num_qubits}, m={cycles}, seed={seed}, pattern={pattern})",
+        "",
+        "OPENQASM 2.0;",
+        'include "qelib1.inc";',
+        "",
+        f"// Qubits: {qubits}",
+        f"qreg q[{num_qubits}];",
+        "",
+    ]
+    for cycle in range(cycles):
+        layer = pattern[cycle % len(pattern)]
+        lines.append(f"// Cycle {cycle + 1} ({layer})")
+        statements = single_qubit_layer()
+        for a, b in layer_couplers(qubits, layer):
+            statements += fsim_qasm(a, b, theta, phi)
+        lines += [f"{statement};" for statement in statements]
+        lines.append("")
+
+    lines.append("// Final single-qubit layer")
+    lines += [f"{statement};" for statement in single_qubit_layer()]
+    return "\n".join(lines) + "\n"
+
+
+def circuit_path(num_qubits: int, cycles: int, seed: int, pattern: str, qasm_dir: str = None) -> Path:
+    return Path(qasm_dir or GLOBAL_VARS["qasm_dir"]) / circuit_file_name(num_qubits, cycles, seed, pattern, generated=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a Sycamore-style random circuit into the qasm directory")
+    parser.add_argument("--qubits", type=int, default=GLOBAL_VARS["qubits"], help="Default: QUBITS or 53")
+    parser.add_argument("--cycles", type=int, default=GLOBAL_VARS["cycles"], help="Default: CYCLES or the experiment's")
+    parser.add_argument("--seed", type=int, default=GLOBAL_VARS["circuit_seed"], help="Default: CIRCUIT_SEED or 0")
+    parser.add_argument("--pattern", default=GLOBAL_VARS["pattern"], help="Default: PATTERN or the experiment's")
+    parser.add_argument("--fsim-theta", type=float, default=FSIM_THETA, help="fSim swap angle in radians")
+    parser.add_argument("--fsim-phi", type=float, default=FSIM_PHI, help="fSim phase angle in radians")
+    parser.add_argument("--qasm-dir", default=GLOBAL_VARS["qasm_dir"])
+    parser.add_argument("--if-missing", action="store_true",
+                        help="Succeed without writing if the experiments would find a circuit (e.g. a shipped one)")
+    parser.add_argument("--force", action="store_true", help="Overwrite an existing generated circuit")
+    args = parser.parse_args()
+
+    path = circuit_path(args.qubits, args.cycles, args.seed, args.pattern, args.qasm_dir)
+    selected = select_circuit(args.qubits, args.cycles, args.seed, args.pattern, qasm_dir=args.qasm_dir)
+    if args.if_missing and selected.exists():
+        print(f"Using existing circuit {selected}")
+        sys.exit(0)
+    if path.exists() and not args.force:
+        print(f"{path} exists; pass --force to overwrite it.", file=sys.stderr)
+        sys.exit(1)
+
+    qasm = generate_rcs(args.qubits, args.cycles, args.seed, args.pattern, args.fsim_theta, args.fsim_phi)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        f.write(qasm)
+
+    statements = [line for line in qasm.splitlines() if line.endswith(";") and line.split()[0] not in ("OPENQASM", "include", "qreg")]
+    print(f"Wrote {path}: {args.qubits} qubits, {args.cycles} cycles, {len(statements)} gates "
+          f"({sum(line.startswith('cx ') for line in statements)} cx)")
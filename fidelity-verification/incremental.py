@@ -0,0 +1,173 @@
+import os
+import json
+from pathlib import Path
+from datetime import datetime
+
+from amplitudes import DEFAULT_CHUNK_LINES, SIDECAR_SUFFIX, BINARY_SUFFIX
+from amplitudes import empty_partial, merge_partials, reduce_amplitude_files
+
+CHECKPOINT_FILE = "postprocess_checkpoint.json"
+
+# A job's JSON log is complete once its outermost task has been recorded
+# (a pilot job records one "Subsequent Shots Overall" per batch inside "Pilot Overall",
+# a state preparation served from the state store records "Restore State")
+FINAL_TASK_TYPES = {"First Shot Overall", "Restore State", "Subsequent Shots Overall"}
+MEASUREMENT_TASK_TYPE = "Subsequent Shots Overall"
+
+
+############## Checkpoint ##############
+def load_checkpoint(checkpoint_path) -> dict:
+    """
+    Returns the persisted incremental state, or an empty one if the
+    checkpoint does not exist yet.
+    """
+    if not Path(checkpoint_path).exists():
+        return {"ingested_jobs": [], "partial": empty_partial(), "rows": []}
+
+    with open(checkpoint_path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint: dict, checkpoint_path):
+    """
+    Writes the checkpoint atomically (write to a temporary file, then rename),
+    so a concurrent or interrupted run never sees a half-written file.
+    """
+    checkpoint["timestamp"] = datetime.utcnow().isoformat() + "Z"
+
+    tmp_path = f"{checkpoint_path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+
+############## Ingestion ##############
+def is_complete(data: dict) -> bool:
+    """
+    True when a job's JSON log already holds its outermost task. A task whose
+    parent span is not recorded yet (e.g. a pilot batch) means the job is
+    still running; an interrupted outermost task (e.g. SIGTERM at the time
+    limit) means its amplitude files are partial.
+    """
+    tasks = data.get("tasks", [])
+    span_ids = {task.get("span_id") for task in tasks}
+
+    if any(task.get("parent_id") is not None and task["parent_id"] not in span_ids for task in tasks):
+        return False
+    return any(task["task_type"] in FINAL_TASK_TYPES and not task.get("interrupted") for task in tasks)
+
+
+def is_measurement(data: dict) -> bool:
+    return any(task["task_type"] == MEASUREMENT_TASK_TYPE for task in data.get("tasks", []))
+
+
+def job_partial(logs_dir, job_id, chunk_lines: int = DEFAULT_CHUNK_LINES) -> dict:
+    """
+    XEB partial sums of one job, from its sidecars when present and otherwise
+    by streaming its amplitude files. Pilot jobs have one sidecar and one
+    amplitude file per batch ({job_id}_b00000.xeb, ..._{job_id}_b00000.txt).
+    """
+    logs_dir = Path(logs_dir)
+
+    sidecars = sorted(logs_dir.glob(f"{job_id}{SIDECAR_SUFFIX}")) + sorted(logs_dir.glob(f"{job_id}_b*{SIDECAR_SUFFIX}"))
+    if sidecars:
+        total = empty_partial()
+        for sidecar in sidecars:
+            with open(sidecar) as f:
+                record = json.load(f)
+            merge_partials(total, {key: record[key] for key in empty_partial()})
+        return total
+
+    files = []
+    for suffix in (".txt", BINARY_SUFFIX):
+        files += sorted(logs_dir.glob(f"qr_amplitudes_circuit_*_{job_id}{suffix}"))
+        files += sorted(logs_dir.glob(f"qr_amplitudes_circuit_*_{job_id}_b*{suffix}"))
+    return reduce_amplitude_files(files, chunk_lines=chunk_lines)
+
+
+def speculated_shards(logs_dir) -> dict:
+    """
+    Returns the shard of every copy of a shard that straggler_monitor.py
+    launched speculative copies of; only the copy that claimed the shard
+    counts.
+
+    Returns:
+        dict: {job_id: shard index}
+    """
+    # Imported here, since straggler_monitor imports this module through xeb_controller
+    from straggler_monitor import read_speculative_jobs
+    from xeb_controller import read_measurement_jobs
+
+    speculative = read_speculative_jobs(logs_dir)
+    shards = {}
+    for job in read_measurement_jobs(logs_dir):
+        for job_id in speculative.get(job["index"], []):
+            shards[job_id] = shards[job["job_id"]] = job["index"]
+    return shards
+
+
+def ingest_new_jobs(logs_dir, checkpoint: dict, row_builder, chunk_lines: int = DEFAULT_CHUNK_LINES) -> list:
+    """
+    Folds every finished job that is not in the checkpoint yet into its
+    running aggregates (in place). Jobs that are still running are left for
+    a later call, and so are the copies of a speculated shard until one of
+    them has claimed it; the other copies are never ingested.
+
+    Args:
+        logs_dir: Directory holding the {job_id}.json logs and amplitude files
+        checkpoint (dict): State from load_checkpoint()
+        row_builder: Callable turning a job's JSON log into timing rows
+        chunk_lines (int): Number of lines parsed per chunk
+
+    Returns:
+        list: The job ids ingested by this call
+    """
+    from straggler_monitor import shard_winner
+
+    ingested = set(checkpoint["ingested_jobs"])
+    shards = speculated_shards(logs_dir)
+    new_jobs = []
+
+    for json_file in sorted(Path(logs_dir).glob("*.json")):
+        job_id = json_file.stem
+        if job_id in ingested or json_file.name == CHECKPOINT_FILE:
+            continue
+
+        try:
+            with open(json_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            # Possibly caught mid-write; it will be picked up next time
+            print(f"⚠️ Skipping {json_file} due to error: {e}")
+            continue
+
+        if not is_complete(data):
+            continue
+        # Shots of a copy that did not finish its shard first would be counted twice
+        if job_id in shards and shard_winner(logs_dir, shards[job_id]) != job_id:
+            continue
+
+        if is_measurement(data):
+            merge_partials(checkpoint["partial"], job_partial(logs_dir, job_id, chunk_lines))
+
+        checkpoint["rows"].extend(row_builder(data))
+        checkpoint["ingested_jobs"].append(job_id)
+        new_jobs.append(job_id)
+
+    return new_jobs
+
+
+def throughput_estimate(rows: list, shots: int) -> float:
+    """
+    Shots per second from the earliest measurement start to the latest
+    measurement end among the ingested jobs.
+    """
+    measurements = [row for row in rows if row["task_type"] == MEASUREMENT_TASK_TYPE]
+    if not measurements or shots == 0:
+        return 0.0
+
+    start = min(datetime.fromisoformat(row["start"].replace("Z", "")) for row in measurements)
+    end = max(datetime.fromisoformat(row["end"].replace("Z", "")) for row in measurements)
+    elapsed = (end - start).total_seconds()
+
+    return shots / elapsed if elapsed > 0 else 0.0
@@ -12,48 +12,164 @@ MEASUREMENT_WALL_TIME=${3:-04:00:00}      # Wall time for B jobs
 
 STATE_PREP_WALL_TIME=${4:-00:30:00}       # Wall time for state preparation (job A)
 STATE_PREP_PERFORMANCE=${5:-BalancedAccuracy}  # Performance setting (string)
+export QASM_PASSES=${QASM_PASSES:-}  # e.g. "fuse,reorder" to fuse single-qubit gates and reorder qubits before state preparation
+export MASTER_SEED=${MASTER_SEED:-}  # e.g. 1234 for reproducible per-shard sampling seeds
+# Circuit (default: the experiment's shipped circuit); missing circuits are generated with generate_rcs.py
+export QUBITS=${QUBITS:-}  # e.g. 20 for a scaling sweep over the qubit count
+export CYCLES=${CYCLES:-}  # e.g. 12 for a scaling sweep over the depth
+export CIRCUIT_SEED=${CIRCUIT_SEED:-}
+export PATTERN=${PATTERN:-}  # e.g. ABCDCDAB or EFGH
+export GENERATED_CIRCUIT=${GENERATED_CIRCUIT:-}  # 1 to run the generated circuit even where a shipped one has the same parameters
+XEB_CONTROLLER_ARGS=${XEB_CONTROLLER_ARGS:-}  # e.g. "--half-width 0.0005" to stop once f_xeb has converged
+QUEUE_BATCH_SHOTS=${QUEUE_BATCH_SHOTS:-}  # e.g. 5000 to run the B jobs as pilot workers on a shared shot queue
+SPECULATION_ARGS=${SPECULATION_ARGS:-}  # e.g. "--slow-ratio 2" to re-run straggling B jobs speculatively
+COST_MODEL=${COST_MODEL:-1}  # 0 to always request the wall times above and the job scripts' #SBATCH --mem
+
+if [[ -n "$QUEUE_BATCH_SHOTS" && -n "$SPECULATION_ARGS" ]]; then
+  echo "QUEUE_BATCH_SHOTS and SPECULATION_ARGS cannot be combined; the queue already balances the load." >&2
+  exit 1
+fi
 
 echo "=== Quantum Job Orchestration ==="
+python generate_rcs.py --if-missing || exit 1
+
+# Wall time and memory predicted from the circuit and earlier campaigns (see cost_model.py);
+# the wall times above are the fallback while there is no history to predict from
+prep_resources="--time=$STATE_PREP_WALL_TIME"
+measurement_resources="--time=$MEASUREMENT_WALL_TIME"
+if [[ "$COST_MODEL" == 1 ]]; then
+  prep_resources=$(python cost_model.py sbatch-args --stage prep \
+    --fallback-time $STATE_PREP_WALL_TIME) || prep_resources="--time=$STATE_PREP_WALL_TIME"
+  # Sized for the jobs that take an extra shot of the remainder
+  measurement_resources=$(python cost_model.py sbatch-args --stage measurement \
+    --shots $(((MEASUREMENT_TOTAL_SHOTS + MEASUREMENT_JOB_COUNT - 1) / MEASUREMENT_JOB_COUNT)) \
+    --fallback-time $MEASUREMENT_WALL_TIME) || measurement_resources="--time=$MEASUREMENT_WALL_TIME"
+fi
+
 echo "State Prep:"
-echo "  - Wall Time: $STATE_PREP_WALL_TIME"
+echo "  - Resources: $prep_resources"
 echo "  - Performance: $STATE_PREP_PERFORMANCE"
+if [[ -n "$QASM_PASSES" ]]; then
+  echo "  - QASM Passes: $QASM_PASSES"
+fi
 echo "Measurements:"
+if [[ -n "$MASTER_SEED" ]]; then
+  echo "  - Master Seed: $MASTER_SEED"
+fi
 echo "  - Job Count: $MEASUREMENT_JOB_COUNT"
 echo "  - Total Shots: $MEASUREMENT_TOTAL_SHOTS"
-echo "  - Wall Time: $MEASUREMENT_WALL_TIME"
+echo "  - Resources: $measurement_resources"
+if [[ -n "$QUEUE_BATCH_SHOTS" ]]; then
+  echo "  - Queue Batch Shots: $QUEUE_BATCH_SHOTS"
+fi
 echo ""
 
-# === Submit State Preparation ===
-jid_a=$(sbatch --parsable \
-  --time=$STATE_PREP_WALL_TIME \
-  --export=ALL,PERFORMANCE="$STATE_PREP_PERFORMANCE" \
-  run_prepare_state.sh)
+# === Submit State Preparation (skipped if the state store already holds the state) ===
+jid_a=""
+if python state_store.py restore; then
+  echo "Skipped job A (State Prep): state restored from the state store"
+elif jid_a=$(python state_store.py follow); then
+  # e.g. run_all.sh: another experiment's job A is already preparing the same state
+  echo "Skipped job A (State Prep): waiting for job $jid_a, which prepares the same state"
+else
+  jid_a=$(sbatch --parsable \
+    $prep_resources \
+    --export=ALL,PERFORMANCE="$STATE_PREP_PERFORMANCE" \
+    run_prepare_state.sh)
+  python state_store.py announce $jid_a
 
-echo "Submitted job A (State Prep): $jid_a"
+  echo "Submitted job A (State Prep): $jid_a"
+fi
 echo ""
 
 # === Submit Measurement Jobs ===
 b_job_ids=""
 shots_per_job=$((MEASUREMENT_TOTAL_SHOTS / MEASUREMENT_JOB_COUNT))
+# The first jobs take one extra shot each, so the remainder is not dropped
+shots_remainder=$((MEASUREMENT_TOTAL_SHOTS % MEASUREMENT_JOB_COUNT))
+measurement_exports="ALL"
+
+if [[ -n "$QUEUE_BATCH_SHOTS" ]]; then
+  # Every shot (including the remainder of the division) goes into the queue;
+  # the B jobs keep claiming batches until it is empty, so fast nodes take more
+  python work_queue.py populate --reset \
+    --total-shots $MEASUREMENT_TOTAL_SHOTS \
+    --batch-shots $QUEUE_BATCH_SHOTS
+  measurement_exports="ALL,MEASUREMENT_ARGS=--pilot $MEASUREMENT_ARGS"
+fi
+
+if [[ -n "$SPECULATION_ARGS" ]]; then
+  # Shard markers and copies of a previous campaign would decide this one's winners
+  rm -rf logs/shards
+  : > logs/speculative_jobs.txt
+  MEASUREMENT_ARGS="$MEASUREMENT_ARGS --speculation"
+  measurement_exports="ALL,MEASUREMENT_ARGS=$MEASUREMENT_ARGS"
+fi
+
+# Record "JOB_INDEX JOB_ID SHOTS" for each measurement job (0 shots for pilot workers)
+: > logs/measurement_jobs.txt
 
 for ((i = 0; i < MEASUREMENT_JOB_COUNT; i++)); do
+  job_shots=$((shots_per_job + (i < shots_remainder ? 1 : 0)))
+  if [[ -n "$QUEUE_BATCH_SHOTS" ]]; then
+    job_shots=""
+  fi
+
   jid_b=$(sbatch --parsable \
-    --dependency=afterok:$jid_a \
-    --time=$MEASUREMENT_WALL_TIME \
-    --export=ALL,SHOTS=$shots_per_job,JOB_INDEX=$i \
+    ${jid_a:+--dependency=afterok:$jid_a} \
+    $measurement_resources \
+    --export="$measurement_exports,SHOTS=$job_shots,JOB_INDEX=$i" \
     run_n_measurements.sh)
-  
-  echo "Submitted job B[$i]: $jid_b (Shots: $shots_per_job)"
+
+  echo "Submitted job B[$i]: $jid_b (Shots: ${job_shots:-queue})"
+  echo "$i $jid_b ${job_shots:-0}" >> logs/measurement_jobs.txt
   b_job_ids+="$jid_b:"
 done
 echo ""
 
+# === Submit XEB Early-Stopping Controller (optional) ===
+postprocess_dependency=afterok
+if [[ -n "$XEB_CONTROLLER_ARGS" ]]; then
+  jid_x=$(sbatch --parsable \
+    ${jid_a:+--dependency=afterok:$jid_a} \
+    --time=$MEASUREMENT_WALL_TIME \
+    --export=ALL,XEB_CONTROLLER_ARGS="$XEB_CONTROLLER_ARGS" \
+    run_xeb_controller.sh)
+
+  echo "Submitted XEB controller: $jid_x ($XEB_CONTROLLER_ARGS)"
+  # Cancelled measurement jobs must not block post-processing
+  postprocess_dependency=afterany
+  echo ""
+fi
+
+# === Submit Straggler Monitor (optional) ===
+jid_s=""
+if [[ -n "$SPECULATION_ARGS" ]]; then
+  # Speculative copies request what the measurement jobs do, as straggler_monitor.py's --wall-time/--mem
+  speculation_resources=${measurement_resources//--time=/--wall-time }
+  speculation_resources=${speculation_resources//--mem=/--mem }
+  jid_s=$(sbatch --parsable \
+    ${jid_a:+--dependency=afterok:$jid_a} \
+    --time=$MEASUREMENT_WALL_TIME \
+    --export=ALL,SPECULATION_ARGS="$SPECULATION_ARGS $speculation_resources",MEASUREMENT_ARGS="$MEASUREMENT_ARGS" \
+    run_straggler_monitor.sh)
+
+  echo "Submitted straggler monitor: $jid_s ($SPECULATION_ARGS)"
+  # The copy of a shard that finishes second is cancelled, which must not block post-processing
+  postprocess_dependency=afterany
+  echo ""
+fi
+
 # === Submit Post-Processing ===
 # Trim trailing colon from job list
 b_job_ids=${b_job_ids%:}
+# The monitor discards the losing copies' output and a speculative copy may be the one to finish a shard
+if [[ -n "$jid_s" ]]; then
+  b_job_ids+=":$jid_s"
+fi
 
 jid_c=$(sbatch --parsable \
-  --dependency=afterok:$b_job_ids \
+  --dependency=$postprocess_dependency:$b_job_ids \
     --time=00:10:00 \
   run_postprocess.sh)
 
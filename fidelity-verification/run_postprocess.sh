@@ -21,4 +21,5 @@ fi
 echo "Postprocessing"
 
 # Run your Python script
-python 3_postprocess.py
+# Extra flags (e.g. --stream) can be passed with --export=ALL,POSTPROCESS_ARGS="..."
+python 3_postprocess.py $POSTPROCESS_ARGS
@@ -0,0 +1,24 @@
+#!/bin/bash
+#SBATCH --job-name=straggler_monitor
+#SBATCH --output=logs/straggler_monitor_%j.out
+#SBATCH --error=logs/straggler_monitor_%j.err
+#SBATCH --mem=4G
+#SBATCH --cpus-per-task=1           # or as needed
+#SBATCH -p htc ## Partition
+#SBATCH -q public  ## QOS
+
+# === Set up your environment (only if needed-- spawning seems to inherit this) ===
+# Load mamba module if not already loaded
+if ! command -v mamba &> /dev/null; then
+    module load mamba/latest
+fi
+
+# Only activate env if it's not already active
+if [[ "$CONDA_DEFAULT_ENV" != "quantumrings_gpu_exp" ]]; then
+    source activate quantumrings_gpu_exp
+fi
+
+echo "Watching measurement shards for stragglers"
+
+# Run your Python script
+python straggler_monitor.py $SPECULATION_ARGS
@@ -1,51 +1,114 @@
 import os
 import json
 import time
+import hashlib
 from pathlib import Path
 from datetime import datetime
 import fcntl
 from platform import python_version
 
-from QuantumRingsLib import QuantumRingsProvider
-
 GLOBAL_VARS = {
     "logs_dir": "./logs/",
     "qasm_dir": "./qasm/",
     "state_dir": "./state/",
-    "job_id": os.getenv("SLURM_JOB_ID"),
+    # Array tasks are named like scancel/squeue name them (ARRAYID_TASKID)
+    "job_id": (f"{os.environ['SLURM_ARRAY_JOB_ID']}_{os.environ['SLURM_ARRAY_TASK_ID']}"
+               if os.getenv("SLURM_ARRAY_JOB_ID") else os.getenv("SLURM_JOB_ID")),
     "task_id": os.getenv("SLURM_ARRAY_TASK_ID"),
     "node": os.getenv("SLURMD_NODENAME"),
+    "state_cache_dir": os.getenv("STATE_CACHE_DIR", f"/tmp/qr_state_cache_{os.getenv('USER', 'user')}"),
+    "master_seed": int(os.environ["MASTER_SEED"]) if os.getenv("MASTER_SEED") else None,
+    # Times SLURM requeued this job (0 on its first run), which numbers the segments of a resumed job
+    "restart_count": int(os.getenv("SLURM_RESTART_COUNT") or 0),
+    # Shared by all experiments, next to the experiment directories
+    "state_store_dir": os.getenv("STATE_STORE_DIR", "../state_store/"),
+    # Optimized circuits, kept across runs and evicted least recently used first
+    "circuit_cache_dir": os.getenv("CIRCUIT_CACHE_DIR", "../circuit_cache/"),
+    "circuit_cache_max_mb": int(os.getenv("CIRCUIT_CACHE_MAX_MB", 1024)),
+    # Task timings of every campaign, the training data of cost_model.py
+    "cost_history_dir": os.getenv("COST_HISTORY_DIR", "../cost_history/"),
+    # QASM rewrites applied before OptimizeQuantumCircuit, e.g. QASM_PASSES=fuse (see 1_prepare_state.py)
+    "qasm_passes": [name for name in os.getenv("QASM_PASSES", "").split(",") if name],
+    # Performance setting passed to backend.run at state preparation (None = library default)
+    "performance": "BalancedAccuracy",
+    # Circuit of the experiment (see get_paths); circuits other than the shipped ones come from generate_rcs.py
+    "qubits": int(os.getenv("QUBITS") or 53),
+    "cycles": int(os.getenv("CYCLES") or 14),
+    "circuit_seed": int(os.getenv("CIRCUIT_SEED") or 0),
+    "pattern": os.getenv("PATTERN") or "EFGH",
+    # GENERATED_CIRCUIT=1 runs the generated circuit even if a shipped one has the same parameters
+    "generated_circuit": os.getenv("GENERATED_CIRCUIT", "0") == "1",
 }
 
+STATE_METADATA_SUFFIX = ".meta.json"
+# Ends the names of the circuits written by generate_rcs.py, so they never replace a shipped circuit
+GENERATED_CIRCUIT_TAG = "_gen"
+
+# First element of the seed keys, so shard and queue-batch streams never coincide
+SEED_DOMAIN_SHARD = 0
+SEED_DOMAIN_BATCH = 1
+
 
 ############## Helpers ##############
-def get_paths(qubits: int):
+def circuit_file_name(qubits: int, cycles: int, seed: int, pattern: str, generated: bool = False) -> str:
+    tag = GENERATED_CIRCUIT_TAG if generated else ""
+    return f"circuit_n{qubits}_m{cycles}_s{seed}_e0_p{pattern}{tag}.qasm"
+
+
+def select_circuit(qubits: int, cycles: int, seed: int, pattern: str, generated: bool = None, qasm_dir=None) -> Path:
+    """
+    Returns the path of the circuit with these parameters in the qasm
+    directory, which may not exist yet: the generated circuit if generated
+    is True, the shipped one if it is False, and by default (unless
+    GENERATED_CIRCUIT=1) the shipped one if it exists, else the generated one.
+    """
+    qasm_dir = Path(qasm_dir or GLOBAL_VARS["qasm_dir"])
+    if generated is None and GLOBAL_VARS["generated_circuit"]:
+        generated = True
+    shipped = qasm_dir / circuit_file_name(qubits, cycles, seed, pattern)
+    if generated is False or (generated is None and shipped.exists()):
+        return shipped
+    return qasm_dir / circuit_file_name(qubits, cycles, seed, pattern, generated=True)
+
+
+def get_paths(qubits: int = None, cycles: int = None, seed: int = None, pattern: str = None, generated: bool = None):
     """
     Returns the full paths for the QASM file and the corresponding log file
-    based on a qubit count. Verifies the QASM file exists.
+    based on the circuit parameters. Verifies the QASM file exists.
 
     Args:
-        qubits (int): Number of qubits (used in the QASM file name)
+        qubits (int): Number of qubits (default: GLOBAL_VARS["qubits"], i.e. QUBITS)
+        cycles (int): Number of cycles (default: GLOBAL_VARS["cycles"], i.e. CYCLES)
+        seed (int): Circuit seed (default: GLOBAL_VARS["circuit_seed"], i.e. CIRCUIT_SEED)
+        pattern (str): Coupler pattern (default: GLOBAL_VARS["pattern"], i.e. PATTERN)
+        generated (bool): Shipped or generated circuit (default: see select_circuit())
 
     Returns:
-        tuple: (qasm_file_path: Path, log_file_path: Path)
+        tuple: (qasm_file_path: Path, log_file_path: Path, state_file_path: Path)
 
     Raises:
         FileNotFoundError: If the QASM file does not exist
     """
-    qasm_file_name = f"circuit_n{qubits}_m14_s0_e0_pEFGH.qasm"
-    #qasm_file_name = f"circuit_n{qubits}_m20_s0_e0_pABCDCDAB.qasm"
-    qasm_file_path = Path(GLOBAL_VARS["qasm_dir"]) / qasm_file_name
+    qasm_file_path = select_circuit(
+        GLOBAL_VARS["qubits"] if qubits is None else qubits,
+        GLOBAL_VARS["cycles"] if cycles is None else cycles,
+        GLOBAL_VARS["circuit_seed"] if seed is None else seed,
+        pattern or GLOBAL_VARS["pattern"],
+        generated,
+    )
+    qasm_file_name = qasm_file_path.name
     log_file_path = Path(GLOBAL_VARS["logs_dir"]) / f"qr_amplitudes_{qasm_file_name[:-5]}_{GLOBAL_VARS['job_id']}.txt"
     state_file_path = Path(GLOBAL_VARS["state_dir"]) / f"qr_state_{qasm_file_name[:-5]}.bin"
 
     if not qasm_file_path.exists():
-        raise FileNotFoundError(f"QASM file {qasm_file_path} does not exist. Please check.")
+        raise FileNotFoundError(f"QASM file {qasm_file_path} does not exist. Please check, or generate it with generate_rcs.py.")
 
     return str(qasm_file_path), str(log_file_path), str(state_file_path)
 
 
 def get_provider():
+    # Imported here, so stdlib-only tools (e.g. state_store.py on the login node) can import this module
+    from QuantumRingsLib import QuantumRingsProvider
 
     # Obtain the Quantum Rings Provider
     provider = QuantumRingsProvider()
@@ -56,4 +119,130 @@ def get_provider():
     #List the account
     print(provider.active_account())
 
-    return provider
\ No newline at end of file
+    return provider
+
+
+def write_state_checksum(state_path: str) -> str:
+    """
+    Writes the SHA-256 of a state file to <state_path>.sha256, so node-local
+    copies can be verified without reading the shared file twice.
+
+    Returns:
+        str: The hex digest
+    """
+    digest = hashlib.sha256()
+    with open(state_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    with open(f"{state_path}.sha256", "w") as f:
+        f.write(digest.hexdigest() + "\n")
+
+    return digest.hexdigest()
+
+
+def write_state_metadata(state_path: str, metadata: dict):
+    """
+    Writes what the measurement jobs need to know about how the state was
+    prepared (e.g. the qubit permutation of QASM_PASSES=reorder) to
+    <state_path>.meta.json.
+    """
+    with open(f"{state_path}{STATE_METADATA_SUFFIX}", "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def read_state_metadata(state_path: str) -> dict:
+    """
+    Returns the metadata written by write_state_metadata(), also for a state
+    linked from the state store, whose metadata lies next to the stored file.
+
+    Returns:
+        dict: The metadata, empty if none was written
+    """
+    for path in (Path(f"{state_path}{STATE_METADATA_SUFFIX}"), Path(f"{Path(state_path).resolve()}{STATE_METADATA_SUFFIX}")):
+        if path.exists():
+            with open(path) as f:
+                return json.load(f)
+    return {}
+
+
+def get_local_state_path(state_path: str, cache_dir: str = None) -> str:
+    """
+    Returns the path of a node-local copy of the state file. The first job on
+    a node copies the file to local scratch under an exclusive lock and
+    verifies its checksum; later jobs on that node find a valid copy and reuse
+    it without touching the shared file system.
+
+    Args:
+        state_path (str): State file on the shared file system
+        cache_dir (str): Node-local directory, defaults to GLOBAL_VARS["state_cache_dir"]
+
+    Returns:
+        str: Path of the verified local copy
+
+    Raises:
+        ValueError: If the copy does not match the checksum written at state preparation
+    """
+    source = Path(state_path)
+    cache_dir = Path(cache_dir or GLOBAL_VARS["state_cache_dir"])
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    local_path = cache_dir / source.name
+    manifest_path = cache_dir / f"{source.name}.manifest"
+    source_stat = source.stat()
+    identity = {"source": str(source.resolve()), "size": source_stat.st_size, "mtime_ns": source_stat.st_mtime_ns}
+
+    with open(cache_dir / f"{source.name}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if local_path.exists() and manifest_path.exists():
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+                if {key: manifest.get(key) for key in identity} == identity:
+                    return str(local_path)
+
+            # Copy and hash in one pass over the shared file, then check what landed on local disk
+            tmp_path = cache_dir / f"{source.name}.tmp"
+            digest = hashlib.sha256()
+            with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+                for block in iter(lambda: src.read(1 << 20), b""):
+                    digest.update(block)
+                    dst.write(block)
+
+            local_digest = hashlib.sha256()
+            with open(tmp_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    local_digest.update(block)
+
+            checksum_path = Path(f"{state_path}.sha256")
+            expected = checksum_path.read_text().strip() if checksum_path.exists() else digest.hexdigest()
+            if local_digest.hexdigest() != expected:
+                tmp_path.unlink()
+                raise ValueError(f"Checksum mismatch for the local copy of {state_path}.")
+
+            os.replace(tmp_path, local_path)
+            with open(manifest_path, "w") as f:
+                json.dump({**identity, "sha256": expected, "copied": datetime.utcnow().isoformat() + "Z"}, f, indent=2)
+
+            return str(local_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def derive_seed(master_seed: int, *key: int) -> int:
+    """
+    Derives an independent sampler seed for one unit of work from the
+    campaign's master seed, like numpy.random.SeedSequence.spawn() does for
+    child streams: the key (e.g. domain, shard index, segment) becomes the
+    spawn key, so every shard gets a distinct, reproducible stream.
+
+    Args:
+        master_seed (int): Campaign-wide seed (MASTER_SEED)
+        *key (int): Position of the unit of work, e.g. (SEED_DOMAIN_SHARD, JOB_INDEX, segment)
+
+    Returns:
+        int: 32-bit seed for backend.run()
+    """
+    import numpy as np
+
+    return int(np.random.SeedSequence(master_seed, spawn_key=key).generate_state(1)[0])
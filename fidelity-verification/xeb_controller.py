@@ -0,0 +1,160 @@
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from statistics import NormalDist
+
+from shared import GLOBAL_VARS
+from incremental import load_checkpoint, save_checkpoint, ingest_new_jobs
+from amplitudes import DEFAULT_CHUNK_LINES, f_xeb_from_partial, f_xeb_variance_from_partial
+
+LOGS_DIR = Path(GLOBAL_VARS["logs_dir"])
+EARLY_STOP_FILE = "early_stop.json"
+CONTROLLER_CHECKPOINT_FILE = "xeb_controller_checkpoint.json"
+MEASUREMENT_JOBS_FILE = "measurement_jobs.txt"
+
+
+############## Helpers ##############
+def read_measurement_jobs(logs_dir) -> list:
+    """
+    Returns the measurement jobs recorded by the orchestration script, one
+    "JOB_INDEX JOB_ID SHOTS" line per job.
+
+    Returns:
+        list: [{"index": int, "job_id": str, "shots": int}, ...]
+    """
+    jobs_file = Path(logs_dir) / MEASUREMENT_JOBS_FILE
+    if not jobs_file.exists():
+        return []
+
+    jobs = []
+    with open(jobs_file) as f:
+        for line in f:
+            items = line.split()
+            if len(items) == 3:
+                jobs.append({"index": int(items[0]), "job_id": items[1], "shots": int(items[2])})
+    return jobs
+
+
+def read_early_stop(logs_dir) -> dict:
+    """
+    Returns the recorded stopping point, or None if the campaign was not stopped early.
+    """
+    early_stop_file = Path(logs_dir) / EARLY_STOP_FILE
+    if not early_stop_file.exists():
+        return None
+
+    with open(early_stop_file) as f:
+        return json.load(f)
+
+
+def early_stop_requested(logs_dir) -> bool:
+    return (Path(logs_dir) / EARLY_STOP_FILE).exists()
+
+
+def xeb_estimate(partial: dict) -> (float, float):
+    """
+    Returns (f_xeb, standard error) for the running aggregates.
+    """
+    return f_xeb_from_partial(partial), f_xeb_variance_from_partial(partial) ** 0.5
+
+
+def target_met(f_xeb: float, std_error: float, confidence: float, half_width: float = None,
+               relative_half_width: float = None) -> bool:
+    """
+    True when the confidence interval of f_xeb is at least as tight as the
+    requested absolute and/or relative half-width.
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    interval = z * std_error
+
+    if half_width is not None and interval > half_width:
+        return False
+    if relative_half_width is not None and interval > relative_half_width * abs(f_xeb):
+        return False
+    return True
+
+
+def cancel_jobs(job_ids: list, cancel_running: bool = False):
+    """
+    Cancels the given SLURM jobs. Unless cancel_running is set, only jobs that
+    are still pending are cancelled and running jobs are left to finish.
+    """
+    if not job_ids:
+        return
+
+    command = ["scancel"]
+    if not cancel_running:
+        command.append("--state=PENDING")
+
+    subprocess.run(command + job_ids, check=False)
+
+
+############## Controller ##############
+def run_controller(args):
+    checkpoint_path = LOGS_DIR / CONTROLLER_CHECKPOINT_FILE
+    checkpoint = load_checkpoint(checkpoint_path)
+
+    while True:
+        # The controller does not need timing rows, only the XEB aggregates
+        ingest_new_jobs(LOGS_DIR, checkpoint, row_builder=lambda data: [], chunk_lines=args.chunk_lines)
+        save_checkpoint(checkpoint, checkpoint_path)
+
+        partial = checkpoint["partial"]
+        jobs = read_measurement_jobs(LOGS_DIR)
+        remaining = [job["job_id"] for job in jobs if job["job_id"] not in checkpoint["ingested_jobs"]]
+
+        if partial["shots"] > 1:
+            f_xeb, std_error = xeb_estimate(partial)
+            print(f"[{datetime.utcnow().isoformat()}Z] shots={partial['shots']} f_xeb={f_xeb:.6f} "
+                  f"std_error={std_error:.6f} remaining_jobs={len(remaining)}", flush=True)
+
+            if partial["shots"] >= args.min_shots and target_met(f_xeb, std_error, args.confidence,
+                                                                  args.half_width, args.relative_half_width):
+                record = {
+                    "timestamp": datetime.utcnow().isoformat() + "Z",
+                    "shots": partial["shots"],
+                    "jobs_ingested": len(checkpoint["ingested_jobs"]),
+                    "f_xeb": f_xeb,
+                    "std_error": std_error,
+                    "confidence": args.confidence,
+                    "half_width": args.half_width,
+                    "relative_half_width": args.relative_half_width,
+                    "remaining_jobs": remaining,
+                    "cancelled_running": args.cancel_running,
+                }
+                with open(LOGS_DIR / EARLY_STOP_FILE, "w") as f:
+                    json.dump(record, f, indent=2)
+
+                cancel_jobs(remaining, cancel_running=args.cancel_running)
+                print(f"🛑 Target met after {partial['shots']} shots; stopped {len(remaining)} remaining jobs.", flush=True)
+                return
+
+        if jobs and not remaining:
+            print("All measurement jobs finished before the target was met.", flush=True)
+            return
+
+        time.sleep(args.poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stop the sampling campaign once the f_xeb estimate has converged")
+    parser.add_argument("--half-width", type=float, default=None,
+                        help="Absolute confidence interval half-width on f_xeb to reach")
+    parser.add_argument("--relative-half-width", type=float, default=None,
+                        help="Confidence interval half-width relative to f_xeb to reach")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--min-shots", type=int, default=0,
+                        help="Never stop before this many shots have been ingested")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between checks")
+    parser.add_argument("--cancel-running", action="store_true",
+                        help="Also cancel measurement jobs that are already running")
+    parser.add_argument("--chunk-lines", type=int, default=DEFAULT_CHUNK_LINES)
+    args = parser.parse_args()
+
+    if args.half_width is None and args.relative_half_width is None:
+        parser.error("one of --half-width or --relative-half-width is required")
+
+    run_controller(args)
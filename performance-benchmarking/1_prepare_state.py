@@ -5,16 +5,47 @@ print("Python Version:", python_version())
 from QuantumRingsLib import job_monitor
 from QuantumRingsLib import OptimizeQuantumCircuit, QuantumCircuit
  
-from shared import GLOBAL_VARS, get_paths, get_provider
+from shared import GLOBAL_VARS, STATE_METADATA_SUFFIX, get_paths, get_provider, write_state_checksum, write_state_metadata
 from job_tracker import JobTracker 
+from state_store import lookup, publish, restore
+from circuit_cache import CircuitCache
+from qasm_fusion import fuse_qasm_file
+from qubit_reorder import reorder_qasm_file
 
 import time
+from pathlib import Path
+
+unknown_passes = set(GLOBAL_VARS["qasm_passes"]) - {"fuse", "reorder"}
+if unknown_passes:
+    raise ValueError(f"Unknown QASM passes {sorted(unknown_passes)} in QASM_PASSES.")
 
 # Initialize JobTracker
 tracker = JobTracker()
 
-with tracker.task("First Shot Overall"):
-    qasm_path, log_path, state_path = get_paths(53)
+qasm_path, log_path, state_path = get_paths()
+
+# A state prepared before from the same circuit, library version and
+# performance setting (by any experiment) is reused instead of recomputed
+store_metadata = {"cache": "miss"}
+with tracker.task("State Store Lookup", metadata=store_metadata):
+    stored = lookup(qasm_path, GLOBAL_VARS["performance"])
+    if stored is not None:
+        store_metadata["cache"] = "hit"
+
+if stored is not None:
+    with tracker.task("Restore State", metadata={"key": stored["key"]}):
+        restore(stored, state_path)
+    print(f"State store hit ({stored['key'][:12]}, prepared by job {stored['job_id']} of {stored['experiment']}): "
+          f"{state_path} -> {stored['path']}", flush=True)
+    tracker.write_json()
+    sys.exit(0)
+
+# Never write through a link into the store
+Path(state_path).unlink(missing_ok=True)
+Path(f"{state_path}{STATE_METADATA_SUFFIX}").unlink(missing_ok=True)
+
+# The circuit names the job in the task timings cost_model.py learns from
+with tracker.task("First Shot Overall", metadata={"circuit": Path(qasm_path).name}):
     provider = get_provider()
 
     # Obtain the backend for GPU.
@@ -30,9 +61,48 @@ with tracker.task("First Shot Overall"):
  
     print("Circuit: ", qasm_path , "\nLog file: ", log_path, "\State file: ", state_path, flush=True)
 
-    with tracker.task("Optimization"):
-        qc = QuantumCircuit.from_qasm_file(qasm_path)
-        OptimizeQuantumCircuit(qc)
+    # Repeated runs load the optimized circuit instead of optimizing the source again
+    circuit_cache = CircuitCache()
+    optimization_metadata = {"cache": "miss"}
+    with tracker.task("Optimization", metadata=optimization_metadata):
+        optimized_path = circuit_cache.lookup(qasm_path)
+        if optimized_path is not None:
+            optimization_metadata["cache"] = "hit"
+            qc = QuantumCircuit.from_qasm_file(optimized_path)
+            state_metadata = circuit_cache.metadata(optimized_path)
+        else:
+            # QASM_PASSES in the given order, each writing state/<stem>_<passes so far>.qasm
+            source_path = qasm_path
+            state_metadata = {}
+            for index, qasm_pass in enumerate(GLOBAL_VARS["qasm_passes"]):
+                pass_path = str(Path(GLOBAL_VARS["state_dir"]) /
+                                f"{Path(qasm_path).stem}_{'_'.join(GLOBAL_VARS['qasm_passes'][:index + 1])}.qasm")
+                if qasm_pass == "fuse":
+                    # One u3 per run of single-qubit gates: fewer gates to parse, optimize and execute
+                    fusion_metadata = {}
+                    with tracker.task("Gate Fusion", metadata=fusion_metadata):
+                        fusion_metadata.update(fuse_qasm_file(source_path, pass_path))
+                    print(f"Fused single-qubit gates: {fusion_metadata['gates_before']} -> "
+                          f"{fusion_metadata['gates_after']} gates", flush=True)
+                elif qasm_pass == "reorder":
+                    # Interacting qubits next to each other; the measurements map the bitstrings back
+                    reorder_metadata = {}
+                    with tracker.task("Qubit Reordering", metadata=reorder_metadata):
+                        plan = reorder_qasm_file(source_path, pass_path)
+                        reorder_metadata.update({k: v for k, v in plan.items() if k != "permutation"})
+                    print(f"Reordered qubits: bandwidth {plan['bandwidth_before']} -> {plan['bandwidth_after']}, "
+                          f"two-qubit gate span {plan['span_before']} -> {plan['span_after']}", flush=True)
+                    # Composed with the permutation of an earlier reorder pass
+                    previous = state_metadata.get("permutation", list(range(len(plan["permutation"]))))
+                    state_metadata["permutation"] = [plan["permutation"][position] for position in previous]
+                source_path = pass_path
+            if GLOBAL_VARS["qasm_passes"]:
+                state_metadata["qasm_passes"] = GLOBAL_VARS["qasm_passes"]
+
+            qc = QuantumCircuit.from_qasm_file(source_path)
+            OptimizeQuantumCircuit(qc)
+            with tracker.task("Circuit Cache Store"):
+                circuit_cache.store(qasm_path, qc.qasm(), metadata=state_metadata)
         qc.count_ops()
             
     print("Circuit optimized. Sending for execution.", flush=True)
@@ -44,7 +114,20 @@ with tracker.task("First Shot Overall"):
         job_monitor(job, quiet=True)
         result = job.result()
 
-    with tracker.task("Write State"):
+    write_metadata = {}
+    with tracker.task("Write State", metadata=write_metadata):
         result.SaveSystemStateToDiskFile(state_path)
+        write_metadata["state_bytes"] = Path(state_path).stat().st_size
+        if state_metadata:
+            # The qubit permutation the measurements undo (see qubit_reorder.py)
+            write_state_metadata(state_path, state_metadata)
+
+# Lets the measurement jobs verify their node-local copies (2_n_measurements.py --local-state-cache)
+with tracker.task("Checksum State"):
+    write_state_checksum(state_path)
+
+with tracker.task("Publish State"):
+    manifest = publish(state_path, qasm_path, GLOBAL_VARS["performance"])
+    print(f"State published to the state store as {manifest['key'][:12]}", flush=True)
 
 tracker.write_json()
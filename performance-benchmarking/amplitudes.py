@@ -0,0 +1,882 @@
+import os
+import re
+import json
+import math
+import shutil
+import struct
+import hashlib
+from pathlib import Path
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+AMPLITUDE_PATTERN = "qr_amplitudes_circuit_*.txt"
+DEFAULT_CHUNK_LINES = 1 << 13
+
+# Binary amplitude format: a fixed header followed by (uint64 bits, complex) records
+BINARY_SUFFIX = ".bin"
+BINARY_PATTERN = "qr_amplitudes_circuit_*.bin"
+BINARY_MAGIC = b"QRAMP001"
+BINARY_JOB_ID_SIZE = 40
+BINARY_HEADER_FORMAT = f"<8sIIQ{BINARY_JOB_ID_SIZE}s"
+BINARY_HEADER_SIZE = struct.calcsize(BINARY_HEADER_FORMAT)
+BINARY_AMPLITUDE_DTYPES = ["complex64", "complex128"]
+
+# Per-job XEB partial sums, written next to {job_id}.json
+SIDECAR_SUFFIX = ".xeb"
+
+
+############## Parsing ##############
+# m / 10**k and m * 10**k are correctly rounded, i.e. equal to float() of the
+# decimal text, for an integer mantissa m < 2**53 and an exact power 10**k (k <= 22)
+_EXACT_POWERS_OF_TEN = np.array([10.0 ** k for k in range(23)])
+# Up to 15 significant digits, so the mantissa stays below 2**53
+_MAX_FRACTION_DIGITS = 14
+_MAX_EXPONENT_DIGITS = 3
+# Zero bytes after a block, so the loads of a short last line stay in bounds
+_BLOCK_PADDING = 256
+_NUMBER_LAYOUT = re.compile(rb"^-?\d\.(\d+)[eE][+-](\d+)$")
+
+
+def _load_words(aligned, positions, count: int) -> list:
+    """
+    Loads the count consecutive little-endian 8-byte words starting at every
+    position, from aligned 8-byte loads (much faster than gathering from an
+    unaligned view).
+    """
+    index = positions >> 3
+    shift = (positions & 7).astype(np.uint64) << np.uint64(3)
+    # Shifting by 64 gives 0, so aligned positions need no special case
+    back = np.uint64(64) - shift
+    low = aligned[index]
+    words = []
+    for offset in range(1, count + 1):
+        high = aligned[index + offset]
+        words.append((low >> shift) | (high << back))
+        low = high
+    return words
+
+
+def _byte_matrix(aligned, positions, width: int) -> np.ndarray:
+    """
+    Returns:
+        np.ndarray: uint8 matrix whose rows are the width bytes starting at every position
+    """
+    words = _load_words(aligned, positions, -(-width // 8))
+    return np.stack(words, axis=1).astype("<u8", copy=False).view(np.uint8)[:, :width]
+
+
+def _parse_bitstrings(buf, aligned, starts, num_qubits: int) -> (np.ndarray, np.ndarray):
+    """
+    Returns:
+        tuple: (keys: uint64 as in pack_bitstrings(), valid: the line starts
+            with num_qubits '0'/'1' characters followed by a space)
+    """
+    # Characters other than '0' and '1' wrap around to values above 1
+    bits = _byte_matrix(aligned, starts, num_qubits) - np.uint8(ord("0"))
+    valid = (bits <= 1).all(axis=1) & (buf[starts + num_qubits] == ord(" "))
+
+    packed = np.zeros((len(starts), 8), dtype=np.uint8)
+    packed[:, :-(-num_qubits // 8)] = np.packbits(bits, axis=1)
+    keys = packed.view(">u8").ravel() >> np.uint64(64 - num_qubits)
+    return keys.astype(np.uint64), valid
+
+
+def _parse_numbers(buf, aligned, positions, fraction_digits: int, exponent_digits: int) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Parses the numbers written like "%.{fraction_digits}e" at every
+    position, e.g. -1.1722877035e-03. The digits make an integer mantissa,
+    scaled by an exact power of ten, so the values equal float() of the text
+    bit for bit; numbers needing an inexact power are left to the slow path.
+
+    Returns:
+        tuple: (values: float64, valid: bool, ends: position after each number)
+    """
+    negative = buf[positions] == ord("-")
+    first = positions + negative
+    length = fraction_digits + exponent_digits + 4
+    chars = _byte_matrix(aligned, first, length)
+    # Characters other than digits wrap around to values above 9
+    digits = chars - np.uint8(ord("0"))
+
+    mantissa = digits[:, [0, *range(2, fraction_digits + 2)]]
+    exponent = digits[:, fraction_digits + 4:]
+    exponent_sign = chars[:, fraction_digits + 3]
+    valid = (mantissa <= 9).all(axis=1) & (exponent <= 9).all(axis=1)
+    valid &= chars[:, 1] == ord(".")
+    valid &= (chars[:, fraction_digits + 2] == ord("e")) | (chars[:, fraction_digits + 2] == ord("E"))
+    valid &= (exponent_sign == ord("+")) | (exponent_sign == ord("-"))
+
+    # Sums of integers below 2**53, so exact in float64
+    mantissa = mantissa @ (10.0 ** np.arange(fraction_digits, -1, -1))
+    exponent = exponent @ (10.0 ** np.arange(exponent_digits - 1, -1, -1))
+    scale = np.where(exponent_sign == ord("-"), -exponent, exponent) - fraction_digits
+    valid &= np.abs(scale) < len(_EXACT_POWERS_OF_TEN)
+    power = _EXACT_POWERS_OF_TEN[np.where(valid, np.abs(scale), 0).astype(np.intp)]
+
+    values = np.where(scale < 0, mantissa / power, mantissa * power)
+    np.negative(values, out=values, where=negative)
+    return values, valid, first + length
+
+
+def _parse_line(line: bytes, num_qubits: int):
+    """
+    Slow path of _parse_block() for the lines its vectorized parsers reject,
+    e.g. numbers in another format.
+
+    Returns:
+        tuple: (key, real, imag), or None for an invalid line
+    """
+    if not _is_valid_line(line):
+        return None
+    bitstring, real, imag = line.split()
+    real, imag = float(real), float(imag)
+    if len(bitstring) != num_qubits or not (math.isfinite(real) and math.isfinite(imag)):
+        return None
+    return int(bitstring, 2), real, imag
+
+
+def _line_layout(line: bytes):
+    """
+    Returns:
+        tuple: (num_qubits, (fraction_digits, exponent_digits) of its
+            "%.Ne" numbers, None if they are written otherwise) of a valid
+            line; None for an invalid line
+
+    Raises:
+        ValueError: If the bitstring does not fit a 64-bit key
+    """
+    if not _is_valid_line(line):
+        return None
+    bitstring, real, _ = line.split()
+    if len(bitstring) > 64:
+        raise ValueError(f"Cannot pack {len(bitstring)}-bit strings into 64-bit keys.")
+
+    layout = _NUMBER_LAYOUT.match(real)
+    if (layout is None or len(layout.group(1)) > _MAX_FRACTION_DIGITS
+            or len(layout.group(2)) > _MAX_EXPONENT_DIGITS):
+        return len(bitstring), None
+    return len(bitstring), (len(layout.group(1)), len(layout.group(2)))
+
+
+def _parse_block(buf, starts, ends, layout: tuple) -> (np.ndarray, np.ndarray, np.ndarray, int, int):
+    """
+    Parses the lines between starts and ends (their newlines) straight from
+    the bytes of buf, with numbers in the "%.Ne" layout of the first line
+    (see _line_layout()). Only the lines that do not match go through
+    _parse_line().
+
+    Args:
+        buf (np.ndarray): uint8 block, followed by _BLOCK_PADDING zero bytes
+            and a multiple of 8 bytes long
+
+    Returns:
+        tuple: (keys, real, imag, number of invalid lines dropped, number of
+            lines parsed by _parse_line())
+    """
+    num_qubits, number_layout = layout
+    aligned = buf.view("<u8")
+
+    keys, valid = _parse_bitstrings(buf, aligned, starts, num_qubits)
+    if number_layout is None:
+        valid[:] = False
+        real = np.empty(len(starts))
+        imag = np.empty(len(starts))
+    else:
+        # Both numbers in one pass; the imaginary part follows the real one and a space
+        fraction_digits, exponent_digits = number_layout
+        real_starts = starts + num_qubits + 1
+        imag_starts = real_starts + (buf[real_starts] == ord("-")) + fraction_digits + exponent_digits + 5
+        values, numbers_valid, number_ends = _parse_numbers(buf, aligned, np.concatenate([real_starts, imag_starts]),
+                                                            fraction_digits, exponent_digits)
+        real, imag = values[:len(starts)], values[len(starts):]
+        valid &= numbers_valid[:len(starts)] & numbers_valid[len(starts):]
+        valid &= (buf[imag_starts - 1] == ord(" ")) & (number_ends[len(starts):] == ends)
+
+    invalid = 0
+    slow = np.flatnonzero(~valid)
+    for line in slow:
+        parsed = _parse_line(buf[starts[line]:ends[line]].tobytes(), num_qubits)
+        if parsed is None:
+            invalid += 1
+        else:
+            keys[line], real[line], imag[line] = parsed
+            valid[line] = True
+
+    if invalid:
+        return keys[valid], real[valid], imag[valid], invalid, len(slow) - invalid
+    return keys, real, imag, 0, len(slow)
+
+
+def iter_amplitude_columns(filename, chunk_lines: int = DEFAULT_CHUNK_LINES):
+    """
+    Parses an amplitude file in fixed-size chunks, so memory stays bounded
+    by the chunk size rather than the number of shots in the file. The
+    bitstrings are packed into uint64 keys (see pack_bitstrings()) straight
+    from the bytes read, without building Python strings. Numbers written
+    like "%.Ne", as backend.run writes them, are parsed vectorized; lines
+    written otherwise go through float() one by one, which is much slower
+    and reported.
+
+    Each line holds a bitstring followed by the real and imaginary parts of
+    its amplitude. The file is taken as finished, so a last line without a
+    newline is parsed like any other (recover_amplitude_file() is the one to
+    call on the output of an interrupted job). Every line that is not a
+    bitstring of the first line's length followed by two finite numbers
+    (e.g. the torn tail of a cancelled job that another run appended to) is
+    dropped and reported.
+
+    Args:
+        filename: Path of a whitespace-separated amplitude file
+        chunk_lines (int): Number of lines parsed per chunk
+
+    Yields:
+        tuple: (keys: np.ndarray[uint64], real: np.ndarray[float64], imag: np.ndarray[float64], num_qubits: int)
+    """
+    layout = None
+    dropped = 0
+    slow_lines = 0
+    block_size = 0
+    # Until the first valid line gives the line length
+    capacity = 1 << 16
+    buf = np.zeros(capacity + _BLOCK_PADDING, dtype=np.uint8)
+    # Bytes of a partial line, carried over to the front of the next block
+    carry = 0
+
+    with open(filename, "rb", buffering=0) as f:
+        while True:
+            read = f.readinto(memoryview(buf)[carry:capacity])
+            if not read and not carry:
+                break
+            size = carry + read
+            buf[size:size + _BLOCK_PADDING] = 0
+            if not read:
+                # The last line has no newline; end it so it is parsed with the others
+                buf[size] = ord("\n")
+                size += 1
+            ends = np.flatnonzero(buf[:size] == ord("\n"))
+            if len(ends) == 0:
+                carry = size
+                if size == capacity:
+                    buf = np.concatenate([buf[:capacity], np.zeros(capacity + _BLOCK_PADDING, dtype=np.uint8)])
+                    capacity *= 2
+                continue
+            starts = np.empty_like(ends)
+            starts[0] = 0
+            starts[1:] = ends[:-1] + 1
+            cut = ends[-1] + 1
+
+            if layout is None:
+                for first in range(len(ends)):
+                    layout = _line_layout(buf[starts[first]:ends[first] + 1].tobytes())
+                    if layout is not None:
+                        # Blocks of chunk_lines lines, which stay in the CPU cache while they are parsed
+                        block_size = max(1, chunk_lines) * int(ends[first] - starts[first] + 1)
+                        break
+                    dropped += 1
+                else:
+                    first = len(ends)
+                starts, ends = starts[first:], ends[first:]
+
+            if len(starts):
+                keys, real, imag, invalid, slow = _parse_block(buf, starts, ends, layout)
+                dropped += invalid
+                slow_lines += slow
+                if len(keys):
+                    yield keys, real, imag, layout[0]
+
+            carry = size - cut
+            buf[:carry] = buf[cut:size]
+            if block_size > capacity:
+                capacity = -(-block_size // 8) * 8
+                buf = np.concatenate([buf[:carry], np.zeros(capacity - carry + _BLOCK_PADDING, dtype=np.uint8)])
+
+    if dropped:
+        print(f"⚠️ Skipped {dropped} invalid lines of {filename}")
+    if slow_lines:
+        print(f"⚠️ Parsed {slow_lines} lines of {filename} one by one with float(): their numbers are not written "
+              f"like \"%.Ne\" as on the first line, or are too small or large to be decoded exactly")
+
+
+def iter_amplitude_chunks(filename, chunk_lines: int = DEFAULT_CHUNK_LINES):
+    """
+    Like iter_amplitude_columns(), but yields the probabilities (see
+    probabilities_of()).
+
+    Yields:
+        tuple: (keys: np.ndarray[uint64], probabilities: np.ndarray[float64], num_qubits: int)
+    """
+    for keys, real, imag, num_qubits in iter_amplitude_columns(filename, chunk_lines):
+        yield keys, probabilities_of(real, imag, out=real), num_qubits
+
+
+def probabilities_of(real, imag, out=None) -> np.ndarray:
+    """
+    abs(complex(real, imag))**2 of every amplitude, as process_amplitude_file()
+    computes it: abs() is hypot() and ** is the C library's pow(), which is
+    not always correctly rounded and so can differ from np.square() in the
+    last bit.
+    """
+    probabilities = np.hypot(real, imag, out=out)
+    return np.float_power(probabilities, 2.0, out=probabilities)
+
+
+############## Binary format ##############
+def is_binary_amplitude_file(filename) -> bool:
+    return Path(filename).suffix == BINARY_SUFFIX
+
+
+def binary_record_dtype(amplitude_dtype: str = "complex64") -> np.dtype:
+    """
+    Record layout of the binary amplitude format: the packed bitstring
+    followed by its amplitude, both little-endian.
+    """
+    return np.dtype([("bits", "<u8"), ("amplitude", np.dtype(amplitude_dtype).newbyteorder("<"))])
+
+
+def write_binary_amplitudes(text_path, binary_path, job_id=None, amplitude_dtype: str = "complex64",
+                            chunk_lines: int = DEFAULT_CHUNK_LINES) -> int:
+    """
+    Converts a text amplitude file into the binary format. The file starts
+    with a BINARY_HEADER_SIZE byte header (magic, qubit count, amplitude
+    dtype, shot count and job id) followed by fixed-size records.
+
+    Args:
+        text_path: Amplitude file written by backend.run
+        binary_path: Destination of the binary file
+        job_id: Job id stored in the header
+        amplitude_dtype (str): "complex64" or "complex128"
+        chunk_lines (int): Number of lines converted per chunk
+
+    Returns:
+        int: Number of shots written
+    """
+    dtype_code = BINARY_AMPLITUDE_DTYPES.index(amplitude_dtype)
+    record_dtype = binary_record_dtype(amplitude_dtype)
+    job_id_bytes = str(job_id or "").encode()[:BINARY_JOB_ID_SIZE]
+
+    shots = 0
+    num_qubits = 0
+    with open(binary_path, "wb") as out:
+        out.write(b"\0" * BINARY_HEADER_SIZE)
+
+        for keys, real, imag, num_qubits in iter_amplitude_columns(text_path, chunk_lines):
+            records = np.empty(len(keys), dtype=record_dtype)
+            records["bits"] = keys
+            records["amplitude"].real = real
+            records["amplitude"].imag = imag
+            out.write(records.tobytes())
+            shots += len(records)
+
+        out.seek(0)
+        out.write(struct.pack(BINARY_HEADER_FORMAT, BINARY_MAGIC, num_qubits, dtype_code, shots, job_id_bytes))
+
+    return shots
+
+
+def read_binary_header(binary_path) -> dict:
+    """
+    Returns the header of a binary amplitude file as a dict.
+    """
+    with open(binary_path, "rb") as f:
+        magic, num_qubits, dtype_code, shots, job_id = struct.unpack(BINARY_HEADER_FORMAT, f.read(BINARY_HEADER_SIZE))
+
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"{binary_path} is not a binary amplitude file.")
+
+    return {
+        "num_qubits": num_qubits,
+        "amplitude_dtype": BINARY_AMPLITUDE_DTYPES[dtype_code],
+        "shots": shots,
+        "job_id": job_id.rstrip(b"\0").decode(),
+    }
+
+
+def open_binary_amplitudes(binary_path) -> (dict, np.ndarray):
+    """
+    Memory-maps the records of a binary amplitude file. Nothing is read
+    until the records are accessed.
+
+    Returns:
+        tuple: (header: dict, records: np.memmap with "bits" and "amplitude" fields)
+    """
+    header = read_binary_header(binary_path)
+    record_dtype = binary_record_dtype(header["amplitude_dtype"])
+
+    if header["shots"] == 0:
+        return header, np.empty(0, dtype=record_dtype)
+
+    records = np.memmap(binary_path, dtype=record_dtype, mode="r", offset=BINARY_HEADER_SIZE, shape=(header["shots"],))
+    return header, records
+
+
+def iter_binary_chunks(binary_path, chunk_lines: int = DEFAULT_CHUNK_LINES):
+    """
+    Yields (keys, probabilities, num_qubits) in chunks from a binary amplitude file.
+    """
+    header, records = open_binary_amplitudes(binary_path)
+
+    for start in range(0, len(records), chunk_lines):
+        chunk = records[start:start + chunk_lines]
+        amplitude = chunk["amplitude"].astype(np.complex128)
+        yield np.asarray(chunk["bits"]), probabilities_of(amplitude.real, amplitude.imag), header["num_qubits"]
+
+
+############## Streaming reduction ##############
+def empty_partial() -> dict:
+    """
+    Returns an empty set of running XEB aggregates.
+    """
+    return {"shots": 0, "prob_sum": 0.0, "prob_sq_sum": 0.0, "num_qubits": None}
+
+
+def accumulate_chunk(partial: dict, probabilities, num_qubits: int) -> dict:
+    """
+    Folds one parsed chunk into the running aggregates (in place).
+    """
+    if len(probabilities) == 0:
+        return partial
+
+    if partial["num_qubits"] is None:
+        partial["num_qubits"] = num_qubits
+
+    partial["shots"] += len(probabilities)
+    partial["prob_sum"] += float(np.sum(probabilities))
+    partial["prob_sq_sum"] += float(np.sum(np.square(probabilities)))
+    return partial
+
+
+def merge_partials(total: dict, partial: dict) -> dict:
+    """
+    Adds one set of aggregates into another (in place).
+    """
+    if partial["shots"] == 0:
+        return total
+
+    if total["num_qubits"] is None:
+        total["num_qubits"] = partial["num_qubits"]
+    elif total["num_qubits"] != partial["num_qubits"]:
+        raise ValueError(f"Cannot merge {partial['num_qubits']}-qubit and {total['num_qubits']}-qubit aggregates.")
+
+    total["shots"] += partial["shots"]
+    total["prob_sum"] += partial["prob_sum"]
+    total["prob_sq_sum"] += partial["prob_sq_sum"]
+    return total
+
+
+def reduce_amplitude_files(files, chunk_lines: int = DEFAULT_CHUNK_LINES, combined_path=None) -> dict:
+    """
+    Streams every amplitude file once, accumulating the shot count and the
+    sum of probabilities on the fly. Peak memory is bounded by chunk_lines
+    no matter how many shots the files hold.
+
+    Args:
+        files (list): Amplitude files to reduce, in order (text or binary)
+        chunk_lines (int): Number of lines parsed per chunk
+        combined_path: If given, the raw text files are also concatenated into
+            this file (streamed, never held in memory)
+
+    Returns:
+        dict: {"shots": int, "prob_sum": float, "prob_sq_sum": float, "num_qubits": int}
+    """
+    partial = empty_partial()
+
+    combined = open(combined_path, "wb") if combined_path else None
+    try:
+        for file in files:
+            if is_binary_amplitude_file(file):
+                for _, probabilities, num_qubits in iter_binary_chunks(file, chunk_lines):
+                    accumulate_chunk(partial, probabilities, num_qubits)
+                continue
+
+            for _, probabilities, num_qubits in iter_amplitude_chunks(file, chunk_lines):
+                accumulate_chunk(partial, probabilities, num_qubits)
+
+            if combined:
+                _copy_into(combined, file)
+    finally:
+        if combined:
+            combined.close()
+
+    return partial
+
+
+############## Integer-encoded bitstrings ##############
+def pack_bitstrings(bitstrings) -> np.ndarray:
+    """
+    Packs '0'/'1' bitstrings of up to 64 characters into uint64 keys. The
+    leftmost character is the most significant bit, so int(bitstring, 2)
+    gives the same value.
+
+    Args:
+        bitstrings: Sequence of equal-length bitstrings
+
+    Returns:
+        np.ndarray: uint64 keys, one per bitstring
+
+    Raises:
+        ValueError: If the bitstrings differ in length or are longer than 64 characters
+    """
+    n = len(bitstrings[0])
+    if n > 64:
+        raise ValueError(f"Cannot pack {n}-bit strings into 64-bit keys.")
+    if any(len(bitstring) != n for bitstring in bitstrings):
+        raise ValueError(f"Cannot pack bitstrings of different lengths, expected {n} characters.")
+
+    bits = np.frombuffer(np.asarray(bitstrings, dtype=f"S{n}").tobytes(), dtype=np.uint8).reshape(-1, n)
+    padded = np.zeros((len(bits), 64), dtype=np.uint8)
+    padded[:, 64 - n:] = bits - ord("0")
+    return np.packbits(padded, axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def unpack_bitstring(key, num_qubits: int) -> str:
+    """
+    Inverse of pack_bitstrings() for a single key.
+    """
+    return format(int(key), f"0{num_qubits}b")
+
+
+def count_unique(keys, probabilities) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Counts the distinct keys with np.unique. Like the dict implementation,
+    each key keeps the probability of its first occurrence and the results
+    are in first-occurrence order.
+
+    Returns:
+        tuple: (unique_keys: uint64, counts: int64, probs: float64)
+    """
+    unique_keys, first_index, counts = np.unique(keys, return_index=True, return_counts=True)
+    order = np.argsort(first_index)
+    return unique_keys[order], counts[order], probabilities[first_index[order]]
+
+
+def _shot_capacity(files, num_qubits: int) -> int:
+    """
+    Upper bound of the shots in the files: a text line holds at least the
+    bitstring, two one-character numbers, two spaces and a newline.
+    """
+    return sum(read_binary_header(file)["shots"] if is_binary_amplitude_file(file)
+               else os.path.getsize(file) // (num_qubits + 5) for file in files)
+
+
+def process_amplitude_files_packed(files, chunk_lines: int = DEFAULT_CHUNK_LINES, combined_path=None) -> (np.ndarray, np.ndarray, np.ndarray, int):
+    """
+    Fast path for process_amplitude_file(): bitstrings are packed into uint64
+    keys and probabilities kept in a float64 array (16 bytes per shot), then
+    counted with count_unique().
+
+    Both arrays are allocated once, sized from the file sizes; pages past
+    the shots actually parsed are never touched and cost no memory.
+
+    Args:
+        files (list): Amplitude files to process, in order (text or binary)
+        chunk_lines (int): Number of lines parsed per chunk
+        combined_path: If given, the raw text files are also concatenated into this file
+
+    Returns:
+        tuple: (keys, counts, probs, number of qubits)
+    """
+    keys = probs = None
+    shots = 0
+    num_qubits = None
+
+    combined = open(combined_path, "wb") if combined_path else None
+    try:
+        for file in files:
+            if is_binary_amplitude_file(file):
+                chunks = iter_binary_chunks(file, chunk_lines)
+            else:
+                chunks = iter_amplitude_chunks(file, chunk_lines)
+
+            for chunk_keys, probabilities, chunk_qubits in chunks:
+                if keys is None:
+                    num_qubits = chunk_qubits
+                    capacity = _shot_capacity(files, num_qubits)
+                    keys = np.empty(capacity, dtype=np.uint64)
+                    probs = np.empty(capacity, dtype=np.float64)
+                if shots + len(chunk_keys) > len(keys):
+                    keys = np.resize(keys, 2 * (shots + len(chunk_keys)))
+                    probs = np.resize(probs, len(keys))
+                keys[shots:shots + len(chunk_keys)] = chunk_keys
+                probs[shots:shots + len(chunk_keys)] = probabilities
+                shots += len(chunk_keys)
+
+            if combined and not is_binary_amplitude_file(file):
+                _copy_into(combined, file)
+    finally:
+        if combined:
+            combined.close()
+
+    if shots == 0:
+        raise ValueError("No shots were found in the amplitude files.")
+
+    keys, counts, probs = count_unique(keys[:shots], probs[:shots])
+    return keys, counts, probs, num_qubits
+
+
+def merge_count_tables(tables) -> (np.ndarray, np.ndarray, np.ndarray):
+    """
+    Merges (keys, counts, probs) tables given in file order. Counts of the
+    same key are summed and the probability of its first occurrence is kept,
+    so the result equals counting all the files at once.
+    """
+    keys = np.concatenate([table[0] for table in tables])
+    counts = np.concatenate([table[1] for table in tables])
+    probs = np.concatenate([table[2] for table in tables])
+
+    unique_keys, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    merged_counts = np.zeros(len(unique_keys), dtype=np.int64)
+    np.add.at(merged_counts, inverse.ravel(), counts)
+
+    order = np.argsort(first_index, kind="stable")
+    return unique_keys[order], merged_counts[order], probs[first_index[order]]
+
+
+def f_xeb_packed(counts, probs, n, block_size: int = DEFAULT_CHUNK_LINES) -> float:
+    """
+    Vectorized f_xeb() over the arrays from process_amplitude_files_packed().
+
+    The weighted sum is accumulated sequentially in first-occurrence order
+    (np.cumsum, block by block), which reproduces the dict implementation
+    bit for bit (checked by 3_postprocess.py --verify-packed).
+    """
+    avg_prob = 0.0
+    for start in range(0, len(counts), block_size):
+        weighted = counts[start:start + block_size] * probs[start:start + block_size]
+        # Carrying the running total keeps the additions in the same order
+        weighted[0] += avg_prob
+        avg_prob = np.cumsum(weighted)[-1]
+    total_samples = int(counts.sum())
+
+    return float(((2**n) * (avg_prob / total_samples)) - 1)
+
+
+def f_xeb_from_partial(partial: dict) -> float:
+    """
+    Linear cross-entropy benchmark from the running aggregates.
+
+    Summing the probability of every shot is the same as summing
+    counts[key] * probs[key] over distinct bitstrings, so this matches f_xeb().
+    """
+    if partial["shots"] == 0:
+        raise ValueError("No shots were found in the amplitude files.")
+
+    n = partial["num_qubits"]
+    return ((2**n) * (partial["prob_sum"] / partial["shots"])) - 1
+
+
+def f_xeb_variance_from_partial(partial: dict) -> float:
+    """
+    Variance of the f_xeb estimate, i.e. the sample variance of 2**n * p(x)
+    over the shots divided by the number of shots.
+    """
+    shots = partial["shots"]
+    if shots < 2:
+        raise ValueError("At least two shots are needed to estimate the f_xeb variance.")
+
+    n = partial["num_qubits"]
+    sample_variance = (partial["prob_sq_sum"] - partial["prob_sum"] ** 2 / shots) / (shots - 1)
+    return (4**n) * max(sample_variance, 0.0) / shots
+
+
+############## Per-job sidecars ##############
+def file_checksum(filename, block_size: int = 1 << 20) -> str:
+    """
+    Returns the SHA-256 hex digest of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_sidecar(amplitude_path, sidecar_path, job_id=None, chunk_lines: int = DEFAULT_CHUNK_LINES) -> dict:
+    """
+    Reduces one job's amplitude file into its XEB partial sums and writes them,
+    together with a checksum of the file, to a small JSON sidecar. The final
+    reduction can then run from the sidecars alone.
+
+    Args:
+        amplitude_path: The job's amplitude file (text or binary)
+        sidecar_path: Destination of the sidecar, next to the job's JSON log
+        job_id: Job id stored in the sidecar
+        chunk_lines (int): Number of lines parsed per chunk
+
+    Returns:
+        dict: The sidecar record
+    """
+    partial = reduce_amplitude_files([amplitude_path], chunk_lines=chunk_lines)
+
+    record = {
+        "job_id": job_id,
+        "amplitude_file": Path(amplitude_path).name,
+        "sha256": file_checksum(amplitude_path),
+        **partial,
+    }
+    # Written atomically, as the incremental postprocess may read it at any time
+    tmp_path = f"{sidecar_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp_path, sidecar_path)
+
+    return record
+
+
+def find_sidecars(logs_dir) -> list:
+    """
+    Returns the per-job sidecars in logs_dir, sorted by name.
+    """
+    return sorted(Path(logs_dir).glob(f"*{SIDECAR_SUFFIX}"))
+
+
+def reduce_sidecars(sidecar_files, verify: bool = False) -> dict:
+    """
+    Merges the partial sums of every sidecar. This is O(number of jobs) and
+    never touches the amplitude files unless verify is set, in which case each
+    file's checksum is compared with the one recorded by its job.
+    """
+    total = empty_partial()
+
+    for sidecar_file in sidecar_files:
+        with open(sidecar_file) as f:
+            record = json.load(f)
+
+        if verify:
+            amplitude_path = Path(sidecar_file).parent / record["amplitude_file"]
+            if file_checksum(amplitude_path) != record["sha256"]:
+                raise ValueError(f"Checksum mismatch for {amplitude_path} (sidecar {sidecar_file}).")
+
+        merge_partials(total, record)
+
+    return total
+
+
+############## Parallel map-reduce ##############
+def default_worker_count() -> int:
+    """
+    Number of worker processes, taken from the SLURM CPU allocation.
+    """
+    return int(os.getenv("SLURM_CPUS_PER_TASK", 1))
+
+
+def _count_file(file, chunk_lines: int):
+    try:
+        keys, counts, probs, num_qubits = process_amplitude_files_packed([file], chunk_lines=chunk_lines)
+    except ValueError:
+        return None
+    return keys, counts, probs, num_qubits
+
+
+def reduce_amplitude_files_parallel(files, workers: int, chunk_lines: int = DEFAULT_CHUNK_LINES) -> dict:
+    """
+    Parallel reduce_amplitude_files(): each file is reduced to partial sums in
+    a worker process and the parent merges them.
+    """
+    total = empty_partial()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial in executor.map(reduce_amplitude_files, [[file] for file in files], repeat(chunk_lines)):
+            merge_partials(total, partial)
+
+    return total
+
+
+def process_amplitude_files_packed_parallel(files, workers: int, chunk_lines: int = DEFAULT_CHUNK_LINES) -> (np.ndarray, np.ndarray, np.ndarray, int):
+    """
+    Parallel process_amplitude_files_packed(): each worker returns the
+    (keys, counts, probs) table of one file, and the parent merges the tables
+    in file order with merge_count_tables().
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = [result for result in executor.map(_count_file, files, repeat(chunk_lines)) if result is not None]
+
+    if not results:
+        raise ValueError("No shots were found in the amplitude files.")
+
+    keys, counts, probs = merge_count_tables([result[:3] for result in results])
+    return keys, counts, probs, results[0][3]
+
+
+############## Recovery ##############
+def _is_valid_line(line: bytes) -> bool:
+    items = line.split()
+    if len(items) != 3 or items[0].strip(b"01"):
+        return False
+    try:
+        float(items[1]), float(items[2])
+    except ValueError:
+        return False
+    return True
+
+
+def recover_amplitude_file(filename) -> int:
+    """
+    Keeps the valid, newline-terminated lines of an interrupted job's
+    amplitude file and truncates the file after the last of them, dropping
+    a torn trailing line.
+
+    Returns:
+        int: Number of shots kept
+    """
+    valid_lines = 0
+    valid_bytes = 0
+
+    with open(filename, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n") or not _is_valid_line(line):
+                break
+            valid_lines += 1
+            valid_bytes += len(line)
+
+    if valid_bytes != os.path.getsize(filename):
+        os.truncate(filename, valid_bytes)
+
+    return valid_lines
+
+
+def permute_amplitude_file(filename, positions: list):
+    """
+    Rewrites the bitstring of every line as "".join(bits[p] for p in
+    positions), e.g. to map shots sampled from a circuit with reordered
+    qubits back to the original qubits. Replaced atomically.
+    """
+    tmp_path = f"{filename}.tmp.{os.getpid()}"
+
+    with open(filename, "rb") as src, open(tmp_path, "wb") as dst:
+        for line in src:
+            bitstring, separator, rest = line.partition(b" ")
+            dst.write(bytes(bitstring[position] for position in positions) + separator + rest)
+
+    os.replace(tmp_path, filename)
+
+
+def append_amplitude_file(segment_path, filename):
+    """
+    Appends a resumed segment to the job's amplitude file and removes it.
+    """
+    with open(filename, "ab") as combined:
+        _copy_into(combined, segment_path)
+    os.remove(segment_path)
+
+
+def write_combined_file(files, combined_path):
+    """
+    Concatenates the text amplitude files into combined_path, streamed.
+    """
+    with open(combined_path, "wb") as combined:
+        for file in files:
+            _copy_into(combined, file)
+
+
+def _copy_into(combined, file):
+    with open(file, "rb") as f:
+        shutil.copyfileobj(f, combined)
+
+
+def find_amplitude_files(logs_dir, binary: bool = False) -> list:
+    """
+    Returns the per-job amplitude files in logs_dir, sorted by name.
+    """
+    return sorted(Path(logs_dir).glob(BINARY_PATTERN if binary else AMPLITUDE_PATTERN))
@@ -0,0 +1,158 @@
+import os
+import json
+import hashlib
+import argparse
+from pathlib import Path
+
+from shared import GLOBAL_VARS
+from state_store import library_version
+
+ENTRY_SUFFIX = ".qasm"
+METADATA_SUFFIX = ".meta.json"
+
+
+############## Keys ##############
+def cache_key(qasm_path: str, optimizer_version: str = None) -> str:
+    """
+    Key of an optimized circuit: the SHA-256 of the source QASM, the QASM
+    passes applied before optimization and the version of the optimizer
+    (OptimizeQuantumCircuit ships with QuantumRingsLib, so a library
+    upgrade invalidates every entry).
+    """
+    digest = hashlib.sha256()
+    with open(qasm_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    components = {
+        "source_sha256": digest.hexdigest(),
+        "qasm_passes": GLOBAL_VARS["qasm_passes"],
+        "optimizer": optimizer_version or library_version(),
+    }
+    return hashlib.sha256(json.dumps(components, sort_keys=True).encode()).hexdigest()
+
+
+############## Cache ##############
+class CircuitCache:
+    """
+    Optimized circuits on disk, one "<key>.qasm" file per source circuit.
+    An entry's modification time is its last use: lookup() touches it, and
+    eviction removes the least recently used entries first until the total
+    size fits max_bytes. Metadata of an entry (e.g. the qubit permutation of
+    a reordered circuit) is kept next to it in "<key>.meta.json".
+    """
+
+    def __init__(self, root: str = None, max_bytes: int = None):
+        self.root = Path(root or GLOBAL_VARS["circuit_cache_dir"])
+        self.max_bytes = max_bytes if max_bytes is not None else GLOBAL_VARS["circuit_cache_max_mb"] << 20
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key}{ENTRY_SUFFIX}"
+
+    def lookup(self, qasm_path: str) -> str:
+        """
+        Returns the optimized QASM of a source circuit, or None on a miss.
+        """
+        path = self.path(cache_key(qasm_path))
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return str(path)
+
+    def metadata(self, path: str) -> dict:
+        """
+        Returns:
+            dict: Metadata stored with the entry at path, empty if none
+        """
+        try:
+            with open(f"{Path(path).with_suffix('')}{METADATA_SUFFIX}") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def store(self, qasm_path: str, optimized_qasm: str, metadata: dict = None) -> str:
+        """
+        Adds the optimized QASM of a source circuit (written atomically),
+        then evicts least recently used entries beyond max_bytes.
+
+        Args:
+            qasm_path (str): Source circuit
+            optimized_qasm (str): Its optimized QASM
+            metadata (dict): Stored alongside, see metadata()
+
+        Returns:
+            str: Path of the entry
+        """
+        path = self.path(cache_key(qasm_path))
+        if metadata:
+            # Written first, so a reader that finds the entry also finds its metadata
+            tmp_path = f"{path.with_suffix('')}{METADATA_SUFFIX}.tmp.{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, f"{path.with_suffix('')}{METADATA_SUFFIX}")
+
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            f.write(optimized_qasm)
+        os.replace(tmp_path, path)
+
+        self.evict(keep=path)
+        return str(path)
+
+    def entries(self) -> list:
+        """
+        Returns:
+            list: [(path, size, last use), ...], least recently used first
+        """
+        entries = []
+        for path in self.root.glob(f"*{ENTRY_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Evicted concurrently
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep: Path = None) -> list:
+        """
+        Removes least recently used entries until the cache fits max_bytes.
+
+        Args:
+            keep (Path): Entry that is never evicted (the one just stored)
+
+        Returns:
+            list: The evicted paths
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+
+        evicted = []
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            Path(f"{path.with_suffix('')}{METADATA_SUFFIX}").unlink(missing_ok=True)
+            total -= size
+            evicted.append(path)
+        return evicted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or trim the optimized-circuit cache")
+    parser.add_argument("command", choices=["status", "evict", "clear"])
+    parser.add_argument("--cache-dir", default=GLOBAL_VARS["circuit_cache_dir"])
+    parser.add_argument("--max-mb", type=int, default=GLOBAL_VARS["circuit_cache_max_mb"])
+    args = parser.parse_args()
+
+    cache = CircuitCache(args.cache_dir, max_bytes=0 if args.command == "clear" else args.max_mb << 20)
+    if args.command == "status":
+        entries = cache.entries()
+        print(f"{len(entries)} optimized circuits, {sum(size for _, size, _ in entries) / 2**20:.1f} MB "
+              f"of {args.max_mb} MB in {args.cache_dir}")
+    else:
+        print(f"Evicted {len(cache.evict())} optimized circuits")
@@ -0,0 +1,429 @@
+"""
+Static cost model that sizes the SLURM requests of the experiment from the
+circuit and the history of earlier campaigns, instead of the hand-tuned wall
+times and memory in the orchestration scripts.
+
+Features are read from the QASM: qubits, gates, two-qubit gates and
+two-qubit depth. Each predictor is a linear model over a few products of
+them, fit by least squares to the task timings of earlier campaigns, which
+3_postprocess.py copies into GLOBAL_VARS["cost_history_dir"]:
+
+    state_prep_sec       First Shot Overall duration of job A (circuit cache misses)
+    state_mb             size of the state file (Write State)
+    measurement_sec      Subsequent Shots Overall duration of a static job B, from the shots it sampled
+    prep_mem_mb          peak RSS of job A        (needs TRACKER_SAMPLE_INTERVAL)
+    measurement_mem_mb   peak RSS of a job B      (needs TRACKER_SAMPLE_INTERVAL)
+
+A term that is a linear combination of the terms before it in the
+history (e.g. the qubits of a history of one circuit, which move with the
+constant) cannot be told apart from them; it is dropped and reported by
+the summary. Costs only grow with the features, so a term whose
+coefficient comes out negative is dropped too, and the model refit.
+
+A predictor is only used with at least MIN_EXTRA_SAMPLES samples more than
+its fitted terms and an R^2 of at least MIN_R_SQUARED; otherwise the
+orchestrators keep their defaults for what it would size. A fit predicts
+the mean, while stragglers run well past it, so requests are the
+prediction times the largest observed/predicted ratio in the history,
+plus a safety margin, rounded up to 5 minutes or 1 GB.
+
+Only the standard library is used, so the orchestrators can size their
+requests on the login node without the experiment environment.
+
+Usage:
+    python cost_model.py summary
+    python cost_model.py sbatch-args --stage measurement --shots 25000 --fallback-time 04:00:00
+"""
+import re
+import csv
+import sys
+import math
+import glob
+import argparse
+from pathlib import Path
+
+from shared import GLOBAL_VARS, get_paths
+
+TIMINGS_CSV = "task_timings_summary.csv"
+DECLARATIONS = {"OPENQASM", "include", "creg", "barrier", "measure"}
+REGISTER_PATTERN = re.compile(r"^qreg\s+(\w+)\s*\[\s*(\d+)\s*\]$")
+REFERENCE_PATTERN = re.compile(r"\b(\w+)\s*\[\s*(\d+)\s*\]")
+
+# Target: terms of its linear model, each a function of the features
+PREDICTORS = {
+    "state_prep_sec": {
+        "1": lambda f: 1.0,
+        "two_qubit_gates": lambda f: f["two_qubit_gates"],
+        "qubits*two_qubit_depth": lambda f: f["qubits"] * f["two_qubit_depth"],
+    },
+    "state_mb": {
+        "1": lambda f: 1.0,
+        "qubits": lambda f: f["qubits"],
+        "qubits*two_qubit_depth": lambda f: f["qubits"] * f["two_qubit_depth"],
+    },
+    "measurement_sec": {
+        # Loading the state, then sampling
+        "1": lambda f: 1.0,
+        "state_mb": lambda f: f["state_mb"],
+        "shots": lambda f: f["shots"],
+        "shots*qubits": lambda f: f["shots"] * f["qubits"],
+    },
+    "prep_mem_mb": {
+        "1": lambda f: 1.0,
+        "state_mb": lambda f: f["state_mb"],
+    },
+    "measurement_mem_mb": {
+        "1": lambda f: 1.0,
+        "state_mb": lambda f: f["state_mb"],
+    },
+}
+
+# Targets that size each stage: (wall time, memory)
+STAGE_TARGETS = {
+    "prep": ("state_prep_sec", "prep_mem_mb"),
+    "measurement": ("measurement_sec", "measurement_mem_mb"),
+}
+
+DEFAULT_MARGIN = 0.5
+WALL_TIME_STEP_SEC = 300
+# A predictor needs this many samples more than its fitted terms, and this R^2, to size requests
+MIN_EXTRA_SAMPLES = 3
+MIN_R_SQUARED = 0.8
+# Norm, relative to a column of ones, below which what is left of a scaled column is considered collinear
+COLLINEAR_TOLERANCE = 1e-6
+# Relative to the scaled normal equations; steadies nearly collinear terms (exactly collinear ones are dropped)
+RIDGE = 1e-6
+
+
+############## Features ##############
+def circuit_features(qasm_path: str) -> dict:
+    """
+    Returns:
+        dict: {"qubits", "gates", "two_qubit_gates", "two_qubit_depth"} of a QASM file
+    """
+    offsets = {}
+    qubits = 0
+    gates = 0
+    two_qubit_gates = 0
+    depth = {}
+
+    with open(qasm_path) as f:
+        code = "\n".join(line.partition("//")[0] for line in f)
+
+    for statement in (statement.strip() for statement in code.split(";")):
+        if not statement or statement.split()[0].split("(")[0] in DECLARATIONS:
+            continue
+        register = REGISTER_PATTERN.match(statement)
+        if register:
+            offsets[register.group(1)] = qubits
+            qubits += int(register.group(2))
+            continue
+
+        gates += 1
+        operands = {offsets[name] + int(index) for name, index in REFERENCE_PATTERN.findall(statement) if name in offsets}
+        if len(operands) == 2:
+            two_qubit_gates += 1
+            layer = max(depth.get(qubit, 0) for qubit in operands) + 1
+            for qubit in operands:
+                depth[qubit] = layer
+
+    return {
+        "qubits": qubits,
+        "gates": gates,
+        "two_qubit_gates": two_qubit_gates,
+        "two_qubit_depth": max(depth.values(), default=0),
+    }
+
+
+def find_circuit(name: str) -> Path:
+    """
+    Finds a circuit named in the history in this experiment's qasm directory
+    or a sibling experiment's, or returns None.
+    """
+    for qasm_dir in [GLOBAL_VARS["qasm_dir"]] + sorted(glob.glob("../*/qasm")):
+        path = Path(qasm_dir) / name
+        if path.exists():
+            return path
+    return None
+
+
+############## History ##############
+def history_files() -> list:
+    return sorted(glob.glob(str(Path(GLOBAL_VARS["cost_history_dir"]) / f"*{TIMINGS_CSV}")))
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def training_samples(paths: list) -> (dict, dict):
+    """
+    Turns task timing rows into (features, observed value) samples per
+    target. A job's circuit is taken from any of its rows that names one.
+
+    The shots of a measurement are those it sampled, without the shots a
+    resumed job kept from its earlier run. Pilot batches (rows with a
+    batch_id) do not load the state, so they are left out of
+    measurement_sec, which models static jobs. State preparations that
+    reused an optimized circuit (Optimization cache hit) are left out of
+    the prep targets.
+
+    Returns:
+        (dict, dict): ({target: [(features, value), ...]}, {circuit name: observed state size in MB})
+    """
+    jobs = {}
+    for path in paths:
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                # Job ids only identify a job within one campaign's CSV
+                jobs.setdefault((path, row["job_id"]), []).append(row)
+
+    features = {}
+    state_sizes = {}
+    job_circuits = {}
+    for job, rows in jobs.items():
+        circuit = next((row["circuit"] for row in rows if row.get("circuit")), None)
+        if circuit is None:
+            continue
+        if circuit not in features:
+            path = find_circuit(circuit)
+            features[circuit] = circuit_features(path) if path else None
+        if features[circuit] is None:
+            continue
+        job_circuits[job] = circuit
+        for row in rows:
+            if row["task_type"] == "Write State" and _number(row.get("state_bytes")):
+                state_sizes.setdefault(circuit, []).append(_number(row["state_bytes"]) / 2**20)
+
+    observed_state_mb = {circuit: sum(sizes) / len(sizes) for circuit, sizes in state_sizes.items()}
+    samples = {target: [] for target in PREDICTORS}
+    for circuit, sizes in state_sizes.items():
+        samples["state_mb"] += [(features[circuit], size) for size in sizes]
+
+    for job, circuit in job_circuits.items():
+        cache_hit = any(row["task_type"] == "Optimization" and row.get("cache") == "hit" for row in jobs[job])
+        for row in jobs[job]:
+            shots = _number(row.get("shots"))
+            if shots is not None:
+                shots -= _number(row.get("resumed_shots")) or 0
+            sample = {**features[circuit], "state_mb": observed_state_mb.get(circuit), "shots": shots}
+            duration, peak_rss = _number(row["duration_sec"]), _number(row.get("peak_rss_mb"))
+            if row["task_type"] == "First Shot Overall" and not cache_hit:
+                samples["state_prep_sec"].append((sample, duration))
+                if peak_rss is not None and sample["state_mb"] is not None:
+                    samples["prep_mem_mb"].append((sample, peak_rss))
+            elif row["task_type"] == "Subsequent Shots Overall" and sample["shots"] and sample["state_mb"] is not None:
+                if not row.get("batch_id"):
+                    samples["measurement_sec"].append((sample, duration))
+                # A pilot worker holds the loaded state during its batches, so their peak RSS still counts
+                if peak_rss is not None:
+                    samples["measurement_mem_mb"].append((sample, peak_rss))
+
+    return samples, observed_state_mb
+
+
+############## Fitting ##############
+def least_squares(rows: list, values: list) -> list:
+    """
+    Solves min |A x - b|^2 (plus a tiny ridge) through the normal equations,
+    with the columns of A scaled to unit maximum.
+
+    Returns:
+        list: x
+    """
+    columns = len(rows[0])
+    scales = [max(abs(row[j]) for row in rows) or 1.0 for j in range(columns)]
+    scaled = [[row[j] / scales[j] for j in range(columns)] for row in rows]
+
+    # Augmented [A^T A + ridge I | A^T b], solved by Gaussian elimination with partial pivoting
+    system = [[sum(row[i] * row[j] for row in scaled) + (RIDGE if i == j else 0.0) for j in range(columns)] +
+              [sum(row[i] * value for row, value in zip(scaled, values))] for i in range(columns)]
+    for pivot in range(columns):
+        best = max(range(pivot, columns), key=lambda i: abs(system[i][pivot]))
+        system[pivot], system[best] = system[best], system[pivot]
+        for i in range(pivot + 1, columns):
+            factor = system[i][pivot] / system[pivot][pivot]
+            system[i] = [a - factor * b for a, b in zip(system[i], system[pivot])]
+
+    solution = [0.0] * columns
+    for i in reversed(range(columns)):
+        solution[i] = (system[i][-1] - sum(system[i][j] * solution[j] for j in range(i + 1, columns))) / system[i][i]
+    return [x / scale for x, scale in zip(solution, scales)]
+
+
+def independent_terms(rows: list) -> list:
+    """
+    Gram-Schmidt over the scaled columns, in order: a column that is
+    (numerically) a linear combination of the columns kept before it adds
+    nothing the fit could tell apart, and is skipped.
+
+    Returns:
+        list: Indices of the linearly independent columns
+    """
+    kept = []
+    basis = []
+    for j in range(len(rows[0])):
+        scale = max(abs(row[j]) for row in rows) or 1.0
+        column = [row[j] / scale for row in rows]
+        for vector in basis:
+            projection = sum(x * y for x, y in zip(column, vector))
+            column = [x - projection * y for x, y in zip(column, vector)]
+        norm = math.sqrt(sum(x * x for x in column))
+        if norm > COLLINEAR_TOLERANCE * math.sqrt(len(rows)):
+            basis.append([x / norm for x in column])
+            kept.append(j)
+    return kept
+
+
+def fit(rows: list, values: list, kept: list = None) -> list:
+    """
+    Least squares over the kept terms (default: all), with the
+    coefficients of all terms but the constant (the first) kept
+    non-negative, by dropping the most negative term and refitting until
+    none is left.
+
+    Returns:
+        list: The coefficients, 0.0 for dropped terms
+    """
+    kept = list(range(len(rows[0]))) if kept is None else list(kept)
+    while True:
+        solution = least_squares([[row[j] for j in kept] for row in rows], values)
+        coefficients = [0.0] * len(rows[0])
+        for j, x in zip(kept, solution):
+            coefficients[j] = x
+        negative = min(kept[1:], key=lambda j: coefficients[j], default=None)
+        if negative is None or coefficients[negative] >= 0:
+            return coefficients
+        kept.remove(negative)
+
+
+class CostModel:
+    """
+    The fitted predictors. predict() returns None for a target that could
+    not be fit, and resources() also leaves unreliable() ones out, so
+    callers fall back to their defaults.
+    """
+
+    def __init__(self, paths: list = None):
+        self.paths = history_files() if paths is None else paths
+        samples, self.observed_state_mb = training_samples(self.paths)
+
+        self.coefficients = {}
+        self.samples = {}
+        self.r_squared = {}
+        self.collinear = {}
+        self.tail_ratio = {}
+        for target, terms in PREDICTORS.items():
+            self.samples[target] = len(samples[target])
+            if not samples[target]:
+                continue
+            rows = [[term(features) for term in terms.values()] for features, _ in samples[target]]
+            values = [value for _, value in samples[target]]
+            independent = independent_terms(rows)
+            self.collinear[target] = [name for j, name in enumerate(terms) if j not in independent]
+            if len(samples[target]) < len(independent):
+                continue
+            self.coefficients[target] = fit(rows, values, independent)
+
+            fitted = [sum(c * x for c, x in zip(self.coefficients[target], row)) for row in rows]
+            mean = sum(values) / len(values)
+            total = sum((value - mean) ** 2 for value in values)
+            residual = sum((value - fit) ** 2 for value, fit in zip(values, fitted))
+            self.r_squared[target] = 1 - residual / total if total else 1.0
+            # The slowest (or largest) sample relative to its prediction, e.g. a straggling shard
+            self.tail_ratio[target] = max([value / fit for value, fit in zip(values, fitted) if fit > 0] + [1.0])
+
+    def reliable(self, target: str) -> bool:
+        """
+        True when the target is fit from MIN_EXTRA_SAMPLES samples more than
+        its fitted terms and explains at least MIN_R_SQUARED of their variance.
+        """
+        if target not in self.coefficients:
+            return False
+        terms = sum(1 for c in self.coefficients[target] if c != 0.0)
+        return self.samples[target] >= terms + MIN_EXTRA_SAMPLES and self.r_squared[target] >= MIN_R_SQUARED
+
+    def predict(self, target: str, features: dict) -> float:
+        if target not in self.coefficients:
+            return None
+        terms = PREDICTORS[target].values()
+        return max(0.0, sum(c * term(features) for c, term in zip(self.coefficients[target], terms)))
+
+    def features(self, qasm_path: str, shots: int = 0) -> dict:
+        """
+        Features of a circuit for predict(), with the state size observed
+        for it in the history, else the predicted one (None if neither).
+        """
+        features = {**circuit_features(qasm_path), "shots": shots}
+        predicted_mb = self.predict("state_mb", features) if self.reliable("state_mb") else None
+        features["state_mb"] = self.observed_state_mb.get(Path(qasm_path).name, predicted_mb)
+        return features
+
+    def resources(self, stage: str, qasm_path: str, shots: int = 0, margin: float = DEFAULT_MARGIN) -> (str, str):
+        """
+        Sizes a job of a stage ("prep" or "measurement") for the circuit:
+        the prediction times the target's tail_ratio, plus the margin.
+
+        Returns:
+            (str, str): (--time as "HH:MM:SS", --mem as "NG"), None for a
+                request whose predictor is not reliable()
+        """
+        features = self.features(qasm_path, shots)
+        time_target, memory_target = STAGE_TARGETS[stage]
+
+        time_limit = memory = None
+        # The measurement time and both memories are modelled from the state size
+        if self.reliable(time_target) and (features["state_mb"] is not None or stage == "prep"):
+            seconds = self.predict(time_target, features) * self.tail_ratio[time_target]
+            time_limit = format_wall_time(seconds * (1 + margin))
+        if self.reliable(memory_target) and features["state_mb"] is not None:
+            megabytes = self.predict(memory_target, features) * self.tail_ratio[memory_target]
+            memory = f"{max(1, math.ceil(megabytes * (1 + margin) / 1024))}G"
+        return time_limit, memory
+
+
+def format_wall_time(seconds: float) -> str:
+    """
+    Rounds up to WALL_TIME_STEP_SEC (at least one step) as HH:MM:SS.
+    """
+    seconds = max(1, math.ceil(seconds / WALL_TIME_STEP_SEC)) * WALL_TIME_STEP_SEC
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Size SLURM requests from the circuit and earlier campaigns' task timings")
+    parser.add_argument("command", choices=["summary", "sbatch-args"],
+                        help="summary reports the fitted predictors; sbatch-args prints --time/--mem for a job "
+                             "(exit code 1 if neither can be predicted)")
+    parser.add_argument("--stage", choices=sorted(STAGE_TARGETS), default="measurement")
+    parser.add_argument("--shots", type=int, default=0, help="Shots of the measurement job")
+    parser.add_argument("--margin", type=float, default=DEFAULT_MARGIN, help="Requested = predicted x worst observed/predicted ratio x (1 + margin)")
+    parser.add_argument("--fallback-time", help="Wall time to print if it cannot be predicted, e.g. the orchestrator's default")
+    args = parser.parse_args()
+
+    model = CostModel()
+    qasm_path = get_paths()[0]
+    if args.command == "summary":
+        print(f"{len(model.paths)} timing files, circuit {Path(qasm_path).name}: {model.features(qasm_path)}")
+        for target, terms in PREDICTORS.items():
+            collinear = model.collinear.get(target)
+            note = f", collinear in the history: {', '.join(collinear)}" if collinear else ""
+            if target not in model.coefficients:
+                print(f"{target}: not fit ({model.samples[target]} samples{note})")
+                continue
+            formula = " + ".join(f"{c:.4g}*{name}" if name != "1" else f"{c:.4g}"
+                                 for c, name in zip(model.coefficients[target], terms))
+            status = "used" if model.reliable(target) else "not used, too few samples or too poor a fit"
+            print(f"{target} = {formula}  ({model.samples[target]} samples, R^2 {model.r_squared[target]:.3f}, "
+                  f"worst {model.tail_ratio[target]:.2f}x the prediction{note}; {status})")
+        sys.exit(0)
+
+    time_limit, memory = model.resources(args.stage, qasm_path, args.shots, args.margin)
+    time_limit = time_limit or args.fallback_time
+    if time_limit is None and memory is None:
+        sys.exit(1)
+    # The only output, spliced into the orchestrators' sbatch
+    print(" ".join(([f"--time={time_limit}"] if time_limit else []) + ([f"--mem={memory}"] if memory else [])))
@@ -0,0 +1,410 @@
+"""
+Single-qubit gate fusion over OpenQASM 2.0 text, before the circuit is
+handed to QuantumRingsLib. Every maximal run of single-qubit gates on a
+qubit (between the multi-qubit gates, measurements and barriers touching
+it) is multiplied into one 2x2 unitary and emitted as a single u3. Runs of
+one gate are kept as they are, and runs that multiply to the identity are
+dropped.
+
+The equivalence check multiplies out the dense unitary of a circuit, so it
+is only feasible for small circuits; use --check N to fuse the part of a
+large circuit that acts on its first N qubits and compare it against the
+original part.
+
+Usage:
+    python qasm_fusion.py qasm/circuit_n53_m20_s0_e0_pABCDCDAB.qasm -o fused.qasm --check 8
+"""
+import re
+import ast
+import sys
+import math
+import argparse
+import operator
+
+import numpy as np
+
+STATEMENT_PATTERN = re.compile(r"^([a-z][a-zA-Z0-9_]*)\s*(?:\((.*)\))?\s+(.+)$", re.DOTALL)
+QUBIT_PATTERN = re.compile(r"^(\w+)\s*\[\s*(\d+)\s*\]$")
+REGISTER_PATTERN = re.compile(r"^(qreg|creg)\s+(\w+)\s*\[\s*(\d+)\s*\]$")
+REFERENCE_PATTERN = re.compile(r"\b(\w+)\s*\[\s*(\d+)\s*\]")
+DECLARATIONS = {"OPENQASM", "include", "qreg", "creg"}
+
+# A fused run is dropped when it is the identity up to global phase within this tolerance
+IDENTITY_TOLERANCE = 1e-12
+
+
+############## Gates ##############
+def _u3(theta: float, phi: float, lam: float) -> np.ndarray:
+    cos, sin = math.cos(theta / 2), math.sin(theta / 2)
+    return np.array([[cos, -np.exp(1j * lam) * sin],
+                     [np.exp(1j * phi) * sin, np.exp(1j * (phi + lam)) * cos]])
+
+
+def _rx(theta: float) -> np.ndarray:
+    cos, sin = math.cos(theta / 2), math.sin(theta / 2)
+    return np.array([[cos, -1j * sin], [-1j * sin, cos]])
+
+
+def _ry(theta: float) -> np.ndarray:
+    cos, sin = math.cos(theta / 2), math.sin(theta / 2)
+    return np.array([[cos, -sin], [sin, cos]], dtype=complex)
+
+
+def _rz(phi: float) -> np.ndarray:
+    return np.diag([np.exp(-0.5j * phi), np.exp(0.5j * phi)])
+
+
+SX = np.array([[1 + 1j, 1 - 1j], [1 - 1j, 1 + 1j]]) / 2
+
+# Single-qubit gates of qelib1.inc: name -> (number of parameters, matrix function)
+SINGLE_QUBIT_GATES = {
+    "u3": (3, _u3),
+    "u": (3, _u3),
+    "u2": (2, lambda phi, lam: _u3(math.pi / 2, phi, lam)),
+    "u1": (1, lambda lam: np.diag([1, np.exp(1j * lam)])),
+    "p": (1, lambda lam: np.diag([1, np.exp(1j * lam)])),
+    "rx": (1, _rx),
+    "ry": (1, _ry),
+    "rz": (1, _rz),
+    "id": (0, lambda: np.eye(2, dtype=complex)),
+    "x": (0, lambda: np.array([[0, 1], [1, 0]], dtype=complex)),
+    "y": (0, lambda: np.array([[0, -1j], [1j, 0]])),
+    "z": (0, lambda: np.diag([1, -1]).astype(complex)),
+    "h": (0, lambda: np.array([[1, 1], [1, -1]], dtype=complex) / math.sqrt(2)),
+    "s": (0, lambda: np.diag([1, 1j])),
+    "sdg": (0, lambda: np.diag([1, -1j])),
+    "t": (0, lambda: np.diag([1, np.exp(0.25j * math.pi)])),
+    "tdg": (0, lambda: np.diag([1, np.exp(-0.25j * math.pi)])),
+    "sx": (0, lambda: SX),
+    "sxdg": (0, lambda: SX.conj().T),
+}
+
+# Two-qubit gates understood by the dense equivalence check (control first)
+TWO_QUBIT_GATES = {
+    "cx": np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], dtype=complex),
+    "cz": np.diag([1, 1, 1, -1]).astype(complex),
+    "swap": np.array([[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]], dtype=complex),
+}
+
+_ANGLE_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+def parse_angle(expression: str) -> float:
+    """
+    Evaluates a QASM parameter such as "pi*-0.25" or "-pi/2" (numbers, pi,
+    + - * / and parentheses).
+
+    Raises:
+        ValueError: For anything else
+    """
+    def evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return float(node.value)
+        if isinstance(node, ast.Name) and node.id == "pi":
+            return math.pi
+        if isinstance(node, ast.BinOp) and type(node.op) in _ANGLE_OPERATORS:
+            return _ANGLE_OPERATORS[type(node.op)](evaluate(node.left), evaluate(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _ANGLE_OPERATORS:
+            return _ANGLE_OPERATORS[type(node.op)](evaluate(node.operand))
+        raise ValueError(f"Unsupported QASM parameter: {expression}")
+
+    try:
+        return evaluate(ast.parse(expression.strip(), mode="eval"))
+    except SyntaxError as e:
+        raise ValueError(f"Unsupported QASM parameter: {expression}") from e
+
+
+def zyz_angles(unitary: np.ndarray) -> (float, float, float):
+    """
+    Decomposes a 2x2 unitary into u3(theta, phi, lam) = Rz(phi) Ry(theta)
+    Rz(lam), up to a global phase.
+
+    Returns:
+        (float, float, float): (theta, phi, lam)
+    """
+    theta = 2 * math.atan2(abs(unitary[1, 0]), abs(unitary[0, 0]))
+
+    # u3 = e^{ig} [[cos, -e^{i lam} sin], [e^{i phi} sin, e^{i(phi+lam)} cos]]: phases relative to one entry drop g
+    if abs(unitary[1, 0]) < IDENTITY_TOLERANCE:
+        phi, lam = 0.0, np.angle(unitary[1, 1]) - np.angle(unitary[0, 0])
+    elif abs(unitary[0, 0]) < IDENTITY_TOLERANCE:
+        phi, lam = 0.0, np.angle(-unitary[0, 1]) - np.angle(unitary[1, 0])
+    else:
+        phi = np.angle(unitary[1, 0]) - np.angle(unitary[0, 0])
+        lam = np.angle(-unitary[0, 1]) - np.angle(unitary[0, 0])
+
+    return theta, float(phi), float(lam)
+
+
+def is_identity(unitary: np.ndarray) -> bool:
+    # |tr(U)| = 2 exactly when U is the identity up to global phase
+    return abs(abs(np.trace(unitary)) - 2) < IDENTITY_TOLERANCE
+
+
+############## Parsing ##############
+def split_statements(line: str) -> (list, str):
+    """
+    Splits one line of QASM into its statements and trailing comment.
+
+    Returns:
+        (list, str): ([statement without ";", ...], comment or "")
+    """
+    code, _, comment = line.partition("//")
+    statements = [statement.strip() for statement in code.split(";")]
+    return [statement for statement in statements if statement], (f"//{comment}" if _ else "")
+
+
+def single_qubit_gate(statement: str):
+    """
+    Parses a fusible statement like "rz(pi*0.5) q[3]".
+
+    Returns:
+        tuple: (qubit as (register, index), 2x2 matrix), or None if the
+        statement is not a single-qubit gate on one indexed qubit
+    """
+    match = STATEMENT_PATTERN.match(statement)
+    if not match or match.group(1) not in SINGLE_QUBIT_GATES:
+        return None
+
+    name, parameters, operand = match.groups()
+    qubit = QUBIT_PATTERN.match(operand.strip())
+    if qubit is None:
+        # Applied to a whole register
+        return None
+
+    arity, matrix = SINGLE_QUBIT_GATES[name]
+    values = [value for value in (parameters or "").split(",") if value.strip()]
+    if len(values) != arity:
+        return None
+    try:
+        angles = [parse_angle(value) for value in values]
+    except ValueError:
+        return None
+
+    return (qubit.group(1), int(qubit.group(2))), matrix(*angles)
+
+
+def statement_name(statement: str) -> str:
+    return re.split(r"[\s(]", statement, maxsplit=1)[0]
+
+
+def qubit_references(statement: str) -> list:
+    return [(register, int(index)) for register, index in REFERENCE_PATTERN.findall(statement)]
+
+
+############## Fusion ##############
+def fuse_qasm(qasm: str) -> (str, dict):
+    """
+    Fuses every maximal run of single-qubit gates per qubit into one u3.
+    Pending runs are emitted right before the next statement that touches
+    their qubit (or at the end); single-qubit gates on different qubits
+    commute, so the circuit is unchanged.
+
+    Args:
+        qasm (str): OpenQASM 2.0 source
+
+    Returns:
+        (str, dict): The fused QASM and {"gates_before", "gates_after"}
+
+    Raises:
+        ValueError: If the source defines its own gates
+    """
+    output = []
+    # qubit -> [matrix of the run so far, original statements of the run]
+    pending = {}
+    registers = {}
+    gates_before = gates_after = 0
+
+    def flush(qubit):
+        nonlocal gates_after
+        matrix, statements = pending.pop(qubit)
+        if len(statements) == 1:
+            output.append(f"{statements[0]};")
+            gates_after += 1
+        elif not is_identity(matrix):
+            theta, phi, lam = zyz_angles(matrix)
+            output.append(f"u3({theta!r},{phi!r},{lam!r}) {qubit[0]}[{qubit[1]}];")
+            gates_after += 1
+
+    for line in qasm.splitlines():
+        statements, comment = split_statements(line)
+        if not statements:
+            output.append(line)
+            continue
+
+        for statement in statements:
+            name = statement_name(statement)
+            if name in ("gate", "opaque") or "{" in statement:
+                raise ValueError("Gate definitions are not supported by the fusion pass.")
+
+            if name in DECLARATIONS:
+                register = REGISTER_PATTERN.match(statement)
+                if register and register.group(1) == "qreg":
+                    registers[register.group(2)] = int(register.group(3))
+                output.append(f"{statement};")
+                continue
+
+            gate = single_qubit_gate(statement)
+            gates_before += name not in ("barrier", "measure", "reset")
+            if gate is not None:
+                qubit, matrix = gate
+                if qubit in pending:
+                    pending[qubit][0] = matrix @ pending[qubit][0]
+                    pending[qubit][1].append(statement)
+                else:
+                    pending[qubit] = [matrix, [statement]]
+                continue
+
+            # Anything else ends the runs on the qubits it touches (all of them if it names a whole register)
+            references = qubit_references(statement)
+            operands = statement.split(None, 1)[-1]
+            whole_register = any(register in operands.replace(" ", "").split(",")
+                                 for register in registers)
+            for qubit in list(pending):
+                if whole_register or qubit in references:
+                    flush(qubit)
+            output.append(f"{statement};")
+            gates_after += name not in ("barrier", "measure", "reset")
+
+        if comment:
+            output.append(comment)
+
+    for qubit in sorted(pending):
+        flush(qubit)
+
+    return "\n".join(output) + "\n", {"gates_before": gates_before, "gates_after": gates_after}
+
+
+def fuse_qasm_file(qasm_path: str, output_path: str) -> dict:
+    """
+    Writes the fused circuit of qasm_path to output_path.
+
+    Returns:
+        dict: {"gates_before", "gates_after"}
+    """
+    with open(qasm_path) as f:
+        fused, stats = fuse_qasm(f.read())
+    with open(output_path, "w") as f:
+        f.write(fused)
+    return stats
+
+
+############## Equivalence ##############
+def restrict(qasm: str, num_qubits: int) -> str:
+    """
+    Keeps the part of a single-register circuit that acts only on its first
+    num_qubits qubits, e.g. to check the fusion of a 53-qubit circuit.
+    """
+    output = []
+    for line in qasm.splitlines():
+        statements, _ = split_statements(line)
+        for statement in statements:
+            register = REGISTER_PATTERN.match(statement)
+            if register and register.group(1) == "qreg":
+                output.append(f"qreg {register.group(2)}[{min(num_qubits, int(register.group(3)))}];")
+            elif statement_name(statement) in DECLARATIONS or \
+                    all(index < num_qubits for _, index in qubit_references(statement)):
+                output.append(f"{statement};")
+    return "\n".join(output) + "\n"
+
+
+def circuit_unitary(qasm: str, max_qubits: int = 12) -> np.ndarray:
+    """
+    Multiplies out the dense unitary of a circuit (barriers are ignored).
+
+    Raises:
+        ValueError: For more than max_qubits qubits or gates it cannot simulate
+    """
+    offsets = {}
+    num_qubits = 0
+    gates = []
+    for line in qasm.splitlines():
+        for statement in split_statements(line)[0]:
+            register = REGISTER_PATTERN.match(statement)
+            if register:
+                if register.group(1) == "qreg":
+                    offsets[register.group(2)] = num_qubits
+                    num_qubits += int(register.group(3))
+            elif statement_name(statement) not in DECLARATIONS | {"barrier"}:
+                gates.append(statement)
+
+    if num_qubits > max_qubits:
+        raise ValueError(f"{num_qubits} qubits is too many for a dense unitary (max {max_qubits}).")
+
+    dim = 2 ** num_qubits
+    unitary = np.eye(dim, dtype=complex).reshape([2] * num_qubits + [dim])
+    for statement in gates:
+        gate = single_qubit_gate(statement)
+        if gate is not None:
+            (register, index), matrix = gate
+            axis = offsets[register] + index
+            unitary = np.moveaxis(np.tensordot(matrix, unitary, axes=([1], [axis])), 0, axis)
+            continue
+
+        name = statement_name(statement)
+        references = qubit_references(statement)
+        if name not in TWO_QUBIT_GATES or len(references) != 2:
+            raise ValueError(f"Cannot simulate: {statement}")
+        axes = [offsets[register] + index for register, index in references]
+        matrix = TWO_QUBIT_GATES[name].reshape(2, 2, 2, 2)
+        unitary = np.moveaxis(np.tensordot(matrix, unitary, axes=([2, 3], axes)), [0, 1], axes)
+
+    return unitary.reshape(dim, dim)
+
+
+def process_fidelity(qasm_a: str, qasm_b: str, max_qubits: int = 12) -> float:
+    """
+    |tr(A^dagger B)| / 2^n, which is 1 exactly when the two circuits are
+    equal up to a global phase.
+    """
+    unitary_a = circuit_unitary(qasm_a, max_qubits)
+    unitary_b = circuit_unitary(qasm_b, max_qubits)
+    return abs(np.vdot(unitary_a, unitary_b)) / unitary_a.shape[0]
+
+
+def check_fusion(qasm: str, num_qubits: int, atol: float = 1e-9) -> (bool, float):
+    """
+    Fuses the part of qasm acting on its first num_qubits qubits and
+    compares it against the unfused part.
+
+    Returns:
+        (bool, float): (equivalent within atol, process fidelity)
+    """
+    original = restrict(qasm, num_qubits)
+    fidelity = process_fidelity(original, fuse_qasm(original)[0], max_qubits=num_qubits)
+    return bool(abs(1 - fidelity) < atol), float(fidelity)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuse runs of single-qubit gates of a QASM circuit into u3 gates")
+    parser.add_argument("qasm", help="OpenQASM 2.0 source")
+    parser.add_argument("-o", "--output", help="Fused QASM (default: only report the gate counts)")
+    parser.add_argument("--check", type=int, metavar="N",
+                        help="Also check the fusion of the part acting on the first N qubits against a dense unitary")
+    args = parser.parse_args()
+
+    with open(args.qasm) as f:
+        source = f.read()
+    fused, stats = fuse_qasm(source)
+    print(f"Gates: {stats['gates_before']} -> {stats['gates_after']} "
+          f"({stats['gates_before'] / max(stats['gates_after'], 1):.2f}x fewer)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(fused)
+        print(f"Wrote {args.output}")
+
+    if args.check:
+        equivalent, fidelity = check_fusion(source, args.check)
+        print(f"Equivalence on the first {args.check} qubits: {'✅' if equivalent else '❌'} "
+              f"(process fidelity {fidelity:.15f})")
+        sys.exit(0 if equivalent else 1)
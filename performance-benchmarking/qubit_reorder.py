@@ -0,0 +1,239 @@
+"""
+Qubit reordering pass over OpenQASM 2.0 text. The two-qubit gates of a
+circuit define an interaction graph on its qubits; relabeling the qubits
+with a (reverse) Cuthill-McKee ordering of that graph keeps interacting
+qubits close together in the linear qubit order, which matters for
+MPS/tensor-style simulation. Every start node is tried and the ordering
+with the smallest bandwidth (then total span of the two-qubit gates) is
+kept, never worse than the original order, and then refined by pairwise
+swaps that lower the total span without widening the bandwidth.
+
+The permutation is recorded with the prepared state (see 1_prepare_state.py),
+and 2_n_measurements.py maps the sampled bitstrings back to the original
+qubits before writing them, so the amplitude files and XEB are unaffected.
+
+Usage:
+    python qubit_reorder.py qasm/circuit_n53_m20_s0_e0_pABCDCDAB.qasm -o reordered.qasm
+"""
+import re
+import ast
+import argparse
+from collections import Counter, deque
+
+from qasm_fusion import DECLARATIONS, REGISTER_PATTERN, split_statements, statement_name, qubit_references
+
+REFERENCE_PATTERN = re.compile(r"\b(\w+)(\s*\[\s*)(\d+)(\s*\])")
+QUBITS_COMMENT_PATTERN = re.compile(r"^//\s*Qubits:\s*(\[.*\])\s*$")
+
+
+############## Interaction graph ##############
+def interaction_graph(qasm: str) -> (int, Counter):
+    """
+    Returns:
+        (int, Counter): (number of qubits, {(a, b) with a < b: number of two-qubit gates on a and b})
+
+    Raises:
+        ValueError: If the circuit has more than one quantum register
+    """
+    registers = []
+    edges = Counter()
+    for line in qasm.splitlines():
+        for statement in split_statements(line)[0]:
+            register = REGISTER_PATTERN.match(statement)
+            if register:
+                if register.group(1) == "qreg":
+                    registers.append((register.group(2), int(register.group(3))))
+                continue
+            if statement_name(statement) in DECLARATIONS | {"barrier", "measure"}:
+                continue
+
+            qubits = [index for name, index in qubit_references(statement) if name == registers[0][0]]
+            if len(qubits) == 2 and qubits[0] != qubits[1]:
+                edges[tuple(sorted(qubits))] += 1
+
+    if len(registers) != 1:
+        raise ValueError("Qubit reordering supports circuits with exactly one quantum register.")
+    return registers[0][1], edges
+
+
+def span(edges: Counter, permutation: list) -> (int, int):
+    """
+    Returns:
+        (int, int): (bandwidth, total span of the two-qubit gates) under permutation
+    """
+    spans = [(abs(permutation[a] - permutation[b]), count) for (a, b), count in edges.items()]
+    return max((distance for distance, _ in spans), default=0), sum(distance * count for distance, count in spans)
+
+
+############## Ordering ##############
+def cuthill_mckee(num_qubits: int, edges: Counter) -> list:
+    """
+    Bandwidth-minimizing relabeling of the qubits.
+
+    Returns:
+        list: permutation[old index] = new index
+    """
+    neighbors = {qubit: set() for qubit in range(num_qubits)}
+    for a, b in edges:
+        neighbors[a].add(b)
+        neighbors[b].add(a)
+    degree = {qubit: len(adjacent) for qubit, adjacent in neighbors.items()}
+
+    def breadth_first(start: int) -> list:
+        order = []
+        visited = set()
+        # Disconnected qubits (and components) follow, lowest degree first
+        for root in [start] + sorted(range(num_qubits), key=lambda qubit: (degree[qubit], qubit)):
+            if root in visited:
+                continue
+            visited.add(root)
+            queue = deque([root])
+            while queue:
+                qubit = queue.popleft()
+                order.append(qubit)
+                for adjacent in sorted(neighbors[qubit] - visited, key=lambda qubit: (degree[qubit], qubit)):
+                    visited.add(adjacent)
+                    queue.append(adjacent)
+        return order
+
+    best = list(range(num_qubits))
+    best_score = span(edges, best)
+    for start in range(num_qubits):
+        order = breadth_first(start)
+        for candidate in (order, order[::-1]):
+            permutation = [0] * num_qubits
+            for position, qubit in enumerate(candidate):
+                permutation[qubit] = position
+            score = span(edges, permutation)
+            if score < best_score:
+                best, best_score = permutation, score
+
+    return best
+
+
+def refine(edges: Counter, permutation: list) -> list:
+    """
+    Swaps pairs of positions while that lowers (bandwidth, total span);
+    Cuthill-McKee only looks at the bandwidth.
+
+    Returns:
+        list: The refined permutation
+    """
+    permutation = list(permutation)
+    best_score = span(edges, permutation)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(permutation)):
+            for j in range(i + 1, len(permutation)):
+                permutation[i], permutation[j] = permutation[j], permutation[i]
+                score = span(edges, permutation)
+                if score < best_score:
+                    best_score, improved = score, True
+                else:
+                    permutation[i], permutation[j] = permutation[j], permutation[i]
+    return permutation
+
+
+def reorder_permutation(num_qubits: int, edges: Counter) -> list:
+    return refine(edges, cuthill_mckee(num_qubits, edges))
+
+
+############## Rewriting ##############
+def reorder_qasm(qasm: str, permutation: list) -> str:
+    """
+    Relabels every qubit q[i] as q[permutation[i]]. A Cirq "// Qubits: [...]"
+    header listing the grid coordinate of each qubit is permuted alongside.
+    """
+    register = None
+    output = []
+    for line in qasm.splitlines():
+        header = QUBITS_COMMENT_PATTERN.match(line.strip())
+        if header:
+            try:
+                coordinates = ast.literal_eval(header.group(1))
+            except (ValueError, SyntaxError):
+                coordinates = None
+            if coordinates is not None and len(coordinates) == len(permutation):
+                reordered = [None] * len(permutation)
+                for old, new in enumerate(permutation):
+                    reordered[new] = coordinates[old]
+                output.append(f"// Qubits: {reordered}")
+                continue
+
+        code, separator, comment = line.partition("//")
+        match = re.search(r"\bqreg\s+(\w+)", code)
+        if match:
+            register = match.group(1)
+        elif register is not None:
+            code = REFERENCE_PATTERN.sub(
+                lambda ref: f"{ref.group(1)}{ref.group(2)}{permutation[int(ref.group(3))]}{ref.group(4)}"
+                if ref.group(1) == register else ref.group(0), code)
+        output.append(code + separator + comment)
+
+    return "\n".join(output) + "\n"
+
+
+def plan_reordering(qasm: str) -> dict:
+    """
+    Returns:
+        dict: {"permutation", "bandwidth_before", "bandwidth_after", "span_before", "span_after"}
+    """
+    num_qubits, edges = interaction_graph(qasm)
+    permutation = reorder_permutation(num_qubits, edges)
+    bandwidth_before, span_before = span(edges, list(range(num_qubits)))
+    bandwidth_after, span_after = span(edges, permutation)
+
+    return {
+        "permutation": permutation,
+        "bandwidth_before": bandwidth_before,
+        "bandwidth_after": bandwidth_after,
+        "span_before": span_before,
+        "span_after": span_after,
+    }
+
+
+def reorder_qasm_file(qasm_path: str, output_path: str) -> dict:
+    """
+    Writes the reordered circuit of qasm_path to output_path.
+
+    Returns:
+        dict: The plan, see plan_reordering()
+    """
+    with open(qasm_path) as f:
+        qasm = f.read()
+
+    plan = plan_reordering(qasm)
+    with open(output_path, "w") as f:
+        f.write(reorder_qasm(qasm, plan["permutation"]))
+    return plan
+
+
+############## Bitstrings ##############
+def bitstring_positions(permutation: list) -> list:
+    """
+    Maps bitstrings sampled from the reordered circuit back to the original
+    qubits: original[k] = sampled[positions[k]]. Bitstrings are little-endian
+    like Qiskit's (the last character is qubit 0).
+    """
+    num_qubits = len(permutation)
+    return [num_qubits - 1 - permutation[num_qubits - 1 - k] for k in range(num_qubits)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relabel the qubits of a QASM circuit to minimize the span of its two-qubit gates")
+    parser.add_argument("qasm", help="OpenQASM 2.0 source")
+    parser.add_argument("-o", "--output", help="Reordered QASM (default: only report the bandwidth)")
+    args = parser.parse_args()
+
+    if args.output:
+        stats = reorder_qasm_file(args.qasm, args.output)
+    else:
+        with open(args.qasm) as f:
+            stats = plan_reordering(f.read())
+
+    print(f"Bandwidth: {stats['bandwidth_before']} -> {stats['bandwidth_after']}, "
+          f"total two-qubit gate span: {stats['span_before']} -> {stats['span_after']}")
+    print(f"Permutation (old -> new): {stats['permutation']}")
+    if args.output:
+        print(f"Wrote {args.output}")
@@ -6,6 +6,8 @@
 #SBATCH --cpus-per-task=8           # or as needed
 #SBATCH -p htc ## Partition
 #SBATCH -q public  ## QOS
+#SBATCH --requeue                   # preempted jobs are requeued and resume their amplitude file
+#SBATCH --open-mode=append
 
 # === Set up your environment (only if needed-- spawning seems to inherit this) ===
 # Load mamba module if not already loaded
@@ -18,7 +20,15 @@ if [[ "$CONDA_DEFAULT_ENV" != "quantumrings_gpu_exp" ]]; then
     source activate quantumrings_gpu_exp
 fi
 
+# Array tasks submitted by orchestrate.py look up their "TASK_ID JOB_INDEX SHOTS" line in the shot map
+if [[ -n "$SLURM_ARRAY_TASK_ID" && -n "$SHOT_MAP" ]]; then
+    read -r JOB_INDEX SHOTS < <(awk -v task="$SLURM_ARRAY_TASK_ID" '$1 == task {print $2, $3}' "$SHOT_MAP")
+    export JOB_INDEX SHOTS
+fi
+
 echo "Running measurement job index $JOB_INDEX with $SHOTS shots"
 
 # Run your Python script
-python 2_n_measurements.py --shots $SHOTS
+# Extra flags (e.g. --binary) can be passed with --export=ALL,MEASUREMENT_ARGS="..."
+# Pilot workers (MEASUREMENT_ARGS="--pilot") take their shots from the work queue instead of SHOTS
+python 2_n_measurements.py ${SHOTS:+--shots $SHOTS} $MEASUREMENT_ARGS
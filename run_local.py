@@ -0,0 +1,152 @@
+"""
+Runs one experiment's three stages on the local machine, without SLURM:
+1_prepare_state.py, then N concurrent 2_n_measurements.py processes, then
+3_postprocess.py. Each stage gets a synthesized SLURM_JOB_ID (and the
+measurement jobs their JOB_INDEX and SHOTS), and its output goes to
+logs/{stage}_{job_id}.out/.err, so the logs look like those of a cluster run.
+
+With --stub, the QuantumRingsLib imports resolve to the stub in stubs/,
+whose simulator is chosen with QR_STUB_SIMULATOR.
+
+The task timings, prepared states and optimized circuits of local runs
+go to a private cost history, state store and circuit cache under
+--local-dir instead of the shared ones: they never size the cluster's
+requests (see cost_model.py), and a state sampled by the stub is never
+restored by a cluster run.
+
+Usage:
+    python run_local.py performance-benchmarking --stub --jobs 8 --total-shots 20000 --workers 4
+    python run_local.py scalability-experiment --stub --shots-per-job 25000 10000 5000 2500
+    QUBITS=20 CYCLES=12 QR_STUB_SIMULATOR=statevector python run_local.py performance-benchmarking --stub
+"""
+import os
+import sys
+import time
+import shlex
+import socket
+import argparse
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = Path(__file__).resolve().parent
+STUBS_DIR = ROOT / "stubs"
+DEFAULT_LOCAL_DIR = ROOT / "local_runs"
+
+
+def run_stage(experiment_dir: Path, name: str, job_id: int, command: list, env: dict) -> int:
+    """
+    Runs one stage as its own process, the way its batch script would.
+
+    Returns:
+        int: The exit code of the stage
+    """
+    stage_env = {**env, "SLURM_JOB_ID": str(job_id)}
+    logs_dir = experiment_dir / "logs"
+
+    with open(logs_dir / f"{name}_{job_id}.out", "w") as out, open(logs_dir / f"{name}_{job_id}.err", "w") as err:
+        return subprocess.run([sys.executable] + command, cwd=experiment_dir, env=stage_env, stdout=out, stderr=err).returncode
+
+
+def shot_split(total_shots: int, job_count: int) -> list:
+    shots_per_job, remainder = divmod(total_shots, job_count)
+    return [shots_per_job + (1 if i < remainder else 0) for i in range(job_count)]
+
+
+def run_local(args) -> int:
+    experiment_dir = Path(args.experiment).resolve()
+    (experiment_dir / "logs").mkdir(exist_ok=True)
+    (experiment_dir / "state").mkdir(exist_ok=True)
+
+    env = dict(os.environ)
+    env.setdefault("SLURMD_NODENAME", socket.gethostname())
+    env.setdefault("SLURM_CPUS_PER_TASK", str(max(1, (os.cpu_count() or 1) // args.workers)))
+    if args.stub:
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(STUBS_DIR), env.get("PYTHONPATH")]))
+    # Overrides exported directories too: local timings must not train the cluster's cost model, and
+    # states and circuits of the stub (whose library version is "unknown") must not be restored on the cluster
+    local_dir = Path(args.local_dir).resolve()
+    env["COST_HISTORY_DIR"] = str(local_dir / "cost_history")
+    env["STATE_STORE_DIR"] = str(local_dir / "state_store")
+    env["CIRCUIT_CACHE_DIR"] = str(local_dir / "circuit_cache")
+
+    # QUBITS, CYCLES, CIRCUIT_SEED and PATTERN select another circuit than the shipped one
+    subprocess.run([sys.executable, "generate_rcs.py", "--if-missing"], cwd=experiment_dir, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    shots = args.shots_per_job or shot_split(args.total_shots, args.jobs)
+    measurement_args = shlex.split(args.measurement_args)
+    if args.queue_batch_shots:
+        subprocess.run([sys.executable, "work_queue.py", "populate", "--reset", "--total-shots", str(sum(shots)),
+                        "--batch-shots", str(args.queue_batch_shots)], cwd=experiment_dir, check=True)
+        measurement_args = ["--pilot"] + measurement_args
+
+    # Synthesized job ids: A, then one per measurement job, then C
+    jid_a = args.base_job_id
+    measurement_ids = [jid_a + 1 + index for index in range(len(shots))]
+    jid_c = jid_a + len(shots) + 1
+    timings = {}
+
+    print(f"=== Local run of {experiment_dir.name} ===")
+    started = time.perf_counter()
+    if run_stage(experiment_dir, "prepare_state", jid_a, ["1_prepare_state.py"], {**env, "PERFORMANCE": args.performance}):
+        print(f"❌ State preparation ({jid_a}) failed, see logs/prepare_state_{jid_a}.err")
+        return 1
+    timings["prepare_state"] = time.perf_counter() - started
+    print(f"✅ Job A (State Prep) {jid_a}: {timings['prepare_state']:.2f} s")
+
+    with open(experiment_dir / "logs" / "measurement_jobs.txt", "w") as f:
+        for index, (job_id, job_shots) in enumerate(zip(measurement_ids, shots)):
+            f.write(f"{index} {job_id} {0 if args.queue_batch_shots else job_shots}\n")
+
+    def measure(index: int) -> int:
+        command = ["2_n_measurements.py"] + ([] if args.queue_batch_shots else ["--shots", str(shots[index])]) + measurement_args
+        return run_stage(experiment_dir, "measurement", measurement_ids[index], command,
+                         {**env, "JOB_INDEX": str(index), "SHOTS": str(shots[index])})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        exit_codes = list(executor.map(measure, range(len(shots))))
+    timings["measurements"] = time.perf_counter() - started
+
+    failed = [job_id for job_id, code in zip(measurement_ids, exit_codes) if code]
+    print(f"✅ {len(shots) - len(failed)} of {len(shots)} measurement jobs with {args.workers} workers: {timings['measurements']:.2f} s")
+    if failed and not args.keep_going:
+        # Same as the afterok dependency of the postprocess job
+        print(f"❌ Measurement jobs {failed} failed; skipping postprocessing")
+        return 1
+
+    started = time.perf_counter()
+    code = run_stage(experiment_dir, "postprocess", jid_c, ["3_postprocess.py"] + shlex.split(args.postprocess_args), env)
+    timings["postprocess"] = time.perf_counter() - started
+    print(f"{'✅' if code == 0 else '❌'} Job C (Post-Process) {jid_c}: {timings['postprocess']:.2f} s, "
+          f"see logs/postprocess_{jid_c}.out")
+
+    return code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the three stages of one experiment locally, without SLURM")
+    parser.add_argument("experiment", help="Experiment directory, e.g. performance-benchmarking")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of measurement jobs")
+    parser.add_argument("--total-shots", type=int, default=10000, help="Total shots to divide among the measurement jobs")
+    parser.add_argument("--shots-per-job", type=int, nargs="+", help="Explicit shots per measurement job")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Measurement jobs running concurrently")
+    parser.add_argument("--performance", default="BalancedAccuracy", help="Performance setting (string)")
+    parser.add_argument("--measurement-args", default=os.getenv("MEASUREMENT_ARGS", ""),
+                        help="Extra flags for 2_n_measurements.py")
+    parser.add_argument("--postprocess-args", default=os.getenv("POSTPROCESS_ARGS", ""),
+                        help="Extra flags for 3_postprocess.py")
+    parser.add_argument("--queue-batch-shots", type=int,
+                        help="Run the measurement jobs as pilot workers on a queue of batches of this many shots")
+    parser.add_argument("--base-job-id", type=int, default=int(time.time()),
+                        help="First synthesized job id (default: the current Unix time)")
+    parser.add_argument("--stub", action="store_true", help="Use the stub QuantumRingsLib from stubs/")
+    parser.add_argument("--keep-going", action="store_true", help="Postprocess even if measurement jobs failed")
+    parser.add_argument("--local-dir", default=str(DEFAULT_LOCAL_DIR),
+                        help="Directory of the cost history, state store and circuit cache of local runs, "
+                             "kept apart from the cluster's")
+    args = parser.parse_args()
+
+    sys.exit(run_local(args))
@@ -2,44 +2,237 @@ from platform import python_version
 print("Python Version:", python_version())
 
 import os
+import sys
+from pathlib import Path
 
 from QuantumRingsLib import QuantumCircuit
 from QuantumRingsLib import QuantumRingsProvider
 from QuantumRingsLib import job_monitor
   
-from shared import GLOBAL_VARS, get_paths, get_provider
+from shared import GLOBAL_VARS, get_paths, get_provider, get_local_state_path, read_state_metadata
+from shared import SEED_DOMAIN_SHARD, SEED_DOMAIN_BATCH, derive_seed
 from job_tracker import JobTracker 
+from amplitudes import BINARY_AMPLITUDE_DTYPES, BINARY_SUFFIX, SIDECAR_SUFFIX, write_binary_amplitudes, write_sidecar
+from amplitudes import read_binary_header, recover_amplitude_file, append_amplitude_file, permute_amplitude_file
+from qubit_reorder import bitstring_positions
+from xeb_controller import early_stop_requested
+from work_queue import DEFAULT_QUEUE_DIR, WorkQueue, slurm_job_alive
+from straggler_monitor import Heartbeat, claim_shard, discard_job_output
 
 import argparse
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--shots", type=int, required=True)
+parser.add_argument("--shots", type=int)
+parser.add_argument("--binary", action="store_true",
+                    help="Sample to node-local scratch and store the amplitudes in the binary format "
+                         "(a requeued job only resumes from a finished binary file)")
+parser.add_argument("--binary-dtype", choices=BINARY_AMPLITUDE_DTYPES, default="complex64")
+parser.add_argument("--local-state-cache", action="store_true",
+                    help="Load the state from a verified node-local copy shared by all jobs on the node")
+parser.add_argument("--pilot", action="store_true",
+                    help="Load the state once, then sample shot batches from the work queue until it is empty")
+parser.add_argument("--queue-dir", default=str(DEFAULT_QUEUE_DIR))
+parser.add_argument("--speculation", action="store_true",
+                    help="Report progress heartbeats for straggler_monitor.py and keep the output only if this "
+                         "copy of shard JOB_INDEX finishes first")
 args = parser.parse_args()
 
+if not args.pilot and args.shots is None:
+    parser.error("--shots is required unless --pilot is given")
+if args.speculation and (args.pilot or os.getenv("JOB_INDEX") is None):
+    parser.error("--speculation needs the JOB_INDEX of a static shard and cannot be combined with --pilot")
+
 number_of_shots = args.shots
 
-tracker = JobTracker()
 
+def sample_shots(backend, qc1, shots: int, log_path: str, metadata: dict, seed_key: tuple, resume: bool = False,
+                 positions: list = None) -> str:
+    """
+    Samples shots from the loaded state into log_path (converted to the
+    binary format with --binary).
+
+    With resume, the valid lines an earlier run of this job (e.g. before a
+    preemption and requeue) left in log_path are kept, and only the
+    remaining shots are sampled into a new segment that is appended to it.
+
+    With --binary the text only lives on node-local scratch, which a
+    requeued job (usually on another node) does not find: it keeps a binary
+    file that was already complete, and otherwise samples all shots again.
+
+    With a master seed (MASTER_SEED), each segment is sampled with the seed
+    derived from seed_key and its segment number, so it can be re-run
+    bit-identically; otherwise the library's default seeding is used. The
+    segment number of a resumed job is its SLURM restart count, so every
+    resume samples with a new seed.
 
-with tracker.task("Subsequent Shots Overall", metadata={"shots": number_of_shots}):
+    Args:
+        metadata (dict): Metadata of the enclosing task; the shots kept from
+            an earlier run are recorded in it
+        seed_key (tuple): (domain, index) of this unit of work for derive_seed()
+        positions (list): Bitstring positions of a state prepared with
+            reordered qubits (see load_state); the sampled bitstrings are
+            mapped back to the original qubits before they reach log_path
 
-    qasm_path, log_path, state_path = get_paths(53)
-    provider = get_provider()
+    Returns:
+        str: Path of the amplitude file left in the logs directory
+    """
+    if args.binary:
+        # The text output only lives on node-local scratch; the shared logs get the binary file
+        binary_path = os.path.splitext(log_path)[0] + BINARY_SUFFIX
+        log_path = os.path.join(os.getenv("TMPDIR", "/tmp"), os.path.basename(log_path))
 
-    # Obtain the backend for CPU.
-    #                        ^^^
-    backend = provider.get_backend("scarlet_quantum_rings")
-    print(backend)
+        if resume and os.path.exists(binary_path) and read_binary_header(binary_path)["shots"] == shots:
+            print("An earlier run of this job already wrote all amplitudes.")
+            return binary_path
 
-    if os.path.exists(log_path):
+    kept_shots = 0
+    if resume and os.path.exists(log_path):
+        kept_shots = min(recover_amplitude_file(log_path), shots)
+        metadata["resumed_shots"] = kept_shots
+        print(f"Resuming with {kept_shots} shots kept from an earlier run of this job.")
+    elif os.path.exists(log_path):
         os.remove(log_path)
 
+    remaining_shots = shots - kept_shots
+    if remaining_shots > 0:
+        # A resumed job samples into its own segment file first, so a second interruption cannot tear the kept lines;
+        # so does a job with reordered qubits, so log_path never holds permuted bitstrings
+        # Kept lines came from an earlier run, so the restart count is at least 1 under SLURM
+        segment = max(GLOBAL_VARS["restart_count"], 1) if kept_shots else 0
+        separate_segment = kept_shots or positions is not None
+        segment_path = f"{log_path}.segment{segment}" if separate_segment else log_path
+        if separate_segment and os.path.exists(segment_path):
+            os.remove(segment_path)
+
+        if args.speculation:
+            heartbeat = Heartbeat(GLOBAL_VARS["logs_dir"], int(os.environ["JOB_INDEX"]), remaining_shots)
+            heartbeat.start()
+
+        run_options = {}
+        segment_metadata = {"segment": segment, "shots": remaining_shots}
+        if GLOBAL_VARS["master_seed"] is not None:
+            run_options["seed"] = derive_seed(GLOBAL_VARS["master_seed"], *seed_key, segment)
+            segment_metadata.update(master_seed=GLOBAL_VARS["master_seed"], seed_key=list(seed_key), seed=run_options["seed"])
+
+        with tracker.task("Subsequent Shots", metadata=segment_metadata):
+            job = backend.run(qc1, shots=remaining_shots, mode="async", quiet=True, generate_amplitude = True, file = segment_path, **run_options)
+            job_monitor(job, quiet=True)
+
+        if args.speculation:
+            heartbeat.stop()
+
+        if positions is not None:
+            with tracker.task("Unpermute Bitstrings", metadata={"segment": segment}):
+                permute_amplitude_file(segment_path, positions)
+
+        if separate_segment:
+            with tracker.task("Append Segment", metadata={"segment": segment}):
+                append_amplitude_file(segment_path, log_path)
+
+    if args.binary:
+        with tracker.task("Convert Amplitudes"):
+            write_binary_amplitudes(log_path, binary_path, job_id=GLOBAL_VARS["job_id"], amplitude_dtype=args.binary_dtype)
+            os.remove(log_path)
+        return binary_path
+
+    return log_path
+
+
+def load_state(state_path):
+    """
+    Returns:
+        (QuantumCircuit, list): The loaded state with all qubits measured, and
+            the bitstring positions for sample_shots() if the state was
+            prepared with reordered qubits (QASM_PASSES=reorder), else None
+    """
+    # Read from the shared state (or the store entry it links to), not the node-local copy
+    permutation = read_state_metadata(state_path).get("permutation")
+
+    if args.local_state_cache:
+        with tracker.task("Stage State"):
+            state_path = get_local_state_path(state_path)
+
     with tracker.task("Loading State"):
         qc1 =  QuantumCircuit(simulation_state_file = state_path)
         qc1.measure_all()
 
-    with tracker.task("Subsequent Shots"):
-        job = backend.run(qc1, shots=number_of_shots, mode="async", quiet=True, generate_amplitude = True, file = log_path)
-        job_monitor(job, quiet=True)
+    return qc1, bitstring_positions(permutation) if permutation else None
+
+
+# Skip the job entirely if the XEB controller already stopped the campaign
+if early_stop_requested(GLOBAL_VARS["logs_dir"]):
+    print("XEB target already met; skipping this measurement job.")
+    sys.exit(0)
+
+tracker = JobTracker()
+
+if args.pilot:
+    queue = WorkQueue(args.queue_dir, logs_dir=GLOBAL_VARS["logs_dir"])
+
+    with tracker.task("Pilot Overall"):
+
+        qasm_path, log_path, state_path = get_paths()
+        provider = get_provider()
+        backend = provider.get_backend("scarlet_quantum_rings")
+        print(backend)
+
+        qc1, positions = load_state(state_path)
+
+        # A requeued pilot keeps its job id; batches it held before the restart are sampled again
+        queue.requeue_orphans(is_alive=lambda worker: worker != GLOBAL_VARS["job_id"] and slurm_job_alive(worker))
+
+        while not early_stop_requested(GLOBAL_VARS["logs_dir"]):
+            batch = queue.claim(GLOBAL_VARS["job_id"])
+            if batch is None and queue.requeue_orphans():
+                # Batches of workers that died mid-batch are sampled again
+                continue
+            if batch is None:
+                break
+
+            # Each batch gets its own amplitude file and sidecar, named after this job
+            batch_log_path = f"{os.path.splitext(log_path)[0]}_{batch['batch_id']}.txt"
+            batch_metadata = {"shots": batch["shots"], "batch_id": batch["batch_id"], "circuit": Path(qasm_path).name}
+
+            with tracker.task("Subsequent Shots Overall", metadata=batch_metadata):
+                amplitude_path = sample_shots(backend, qc1, batch["shots"], batch_log_path, batch_metadata,
+                                              seed_key=(SEED_DOMAIN_BATCH, batch["index"]), positions=positions)
+
+            with tracker.task("Write XEB Sidecar", metadata={"batch_id": batch["batch_id"]}):
+                sidecar_path = Path(tracker.json_file).with_name(f"{GLOBAL_VARS['job_id']}_{batch['batch_id']}{SIDECAR_SUFFIX}")
+                write_sidecar(amplitude_path, sidecar_path, job_id=GLOBAL_VARS["job_id"])
+
+            if not queue.complete(batch):
+                print(f"Batch {batch['batch_id']} was requeued while this worker sampled it; its output was orphaned.")
+
+else:
+    measurement_metadata = {"shots": number_of_shots}
+    with tracker.task("Subsequent Shots Overall", metadata=measurement_metadata):
+
+        qasm_path, log_path, state_path = get_paths()
+        measurement_metadata["circuit"] = Path(qasm_path).name
+        provider = get_provider()
+
+        # Obtain the backend for CPU.
+        #                        ^^^
+        backend = provider.get_backend("scarlet_quantum_rings")
+        print(backend)
+
+        qc1, positions = load_state(state_path)
+        amplitude_path = sample_shots(backend, qc1, number_of_shots, log_path, measurement_metadata,
+                                      seed_key=(SEED_DOMAIN_SHARD, int(os.getenv("JOB_INDEX", 0))), resume=True,
+                                      positions=positions)
+
+        # Only the first copy of a shard to finish keeps its output, so no shot is counted twice
+        keep_output = True
+        if args.speculation:
+            with tracker.task("Claim Shard"):
+                keep_output = claim_shard(GLOBAL_VARS["logs_dir"], int(os.environ["JOB_INDEX"]), GLOBAL_VARS["job_id"])
+                if not keep_output:
+                    print("Another copy of this shard finished first; discarding this output.")
+                    discard_job_output(GLOBAL_VARS["logs_dir"], GLOBAL_VARS["job_id"])
+
+    if keep_output:
+        with tracker.task("Write XEB Sidecar"):
+            write_sidecar(amplitude_path, Path(tracker.json_file).with_suffix(SIDECAR_SUFFIX), job_id=GLOBAL_VARS["job_id"])
 
 tracker.write_json()
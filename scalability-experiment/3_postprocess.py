@@ -1,13 +1,26 @@
 import sys
 import json
 import csv
+import shutil
+import argparse
 from pathlib import Path
 from shared import GLOBAL_VARS
-from datetime import datetime, timedelta
+from amplitudes import DEFAULT_CHUNK_LINES, find_amplitude_files, reduce_amplitude_files, f_xeb_from_partial
+from amplitudes import process_amplitude_files_packed, f_xeb_packed, unpack_bitstring
+from amplitudes import find_sidecars, reduce_sidecars, f_xeb_variance_from_partial
+from amplitudes import default_worker_count, reduce_amplitude_files_parallel, process_amplitude_files_packed_parallel, write_combined_file
+from incremental import CHECKPOINT_FILE, load_checkpoint, save_checkpoint, ingest_new_jobs, throughput_estimate
+from xeb_controller import read_early_stop
+from job_tracker import JobTracker, EVENT_LOG_SUFFIX, RESOURCE_FIELDS
+from work_queue import DEFAULT_QUEUE_DIR, MANIFEST_FILE, WorkQueue, makespan_estimate
+from straggler_monitor import discard_losers
+from datetime import datetime, timedelta, timezone
 
 LOGS_DIR = Path(GLOBAL_VARS["logs_dir"])
 CSV_OUTPUT = LOGS_DIR / "task_timings_summary.csv"
 AMPLITUDE_OUTPUT = LOGS_DIR / "qr_amplitudes_combined.txt"
+CHECKPOINT_OUTPUT = LOGS_DIR / CHECKPOINT_FILE
+TRACE_OUTPUT = LOGS_DIR / "trace.json"
 
 # Redirect print output to a file as well as stdout
 class Logger(object):
@@ -26,41 +39,153 @@ class Logger(object):
 # Start logging
 sys.stdout = Logger("logs/postprocess_output.txt")
 
-def collect_timings_to_csv():
+def job_timing_rows(data) -> list:
+    job_id = data.get("slurm", {}).get("job_id", "unknown")
+    task_id = data.get("slurm", {}).get("task_id", "unknown")
+
+    rows = []
+    for task in data.get("tasks", []):
+        # Cut short by SIGTERM or an error: its duration would skew the timings and cost_model.py
+        if task.get("interrupted"):
+            continue
+        resources = task.get("resources", {})
+        rows.append({
+            "job_id": job_id,
+            "task_id": task_id,
+            "task_type": task["task_type"],
+            "start": task["start"],
+            "end": task["end"],
+            "duration_sec": task["duration_sec"],
+            "shots": task.get("metadata", {}).get("shots", None),  # New: pull shots if present
+            # Shots a resumed job kept from its earlier run, and the queue batch of a pilot worker
+            "resumed_shots": task.get("metadata", {}).get("resumed_shots"),
+            "batch_id": task.get("metadata", {}).get("batch_id"),
+            # "hit" or "miss" for the cached stages of state preparation, to compare cold and warm runs
+            "cache": task.get("metadata", {}).get("cache"),
+            # Features and targets of cost_model.py
+            "circuit": task.get("metadata", {}).get("circuit"),
+            "state_bytes": task.get("metadata", {}).get("state_bytes"),
+            **{field: resources.get(field) for field in RESOURCE_FIELDS}
+        })
+    return rows
+
+def write_timings_csv(rows):
+    # Sort rows by start time (converted to datetime for proper sort)
+    rows.sort(key=lambda row: datetime.fromisoformat(row["start"].replace("Z", "")))
+
+    with open(CSV_OUTPUT, "w", newline="") as csvfile:
+        fieldnames = ["job_id", "task_id", "task_type", "start", "end", "duration_sec", "shots", "resumed_shots", "batch_id", "cache", "circuit", "state_bytes"] + RESOURCE_FIELDS
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print(f"✅ Wrote summary CSV to {CSV_OUTPUT}")
+    archive_timings_csv(rows)
+
+def archive_timings_csv(rows):
+    """
+    Copies the CSV into the cost history that cost_model.py fits its
+    predictors to, named after the campaign's first task so that running
+    the postprocessing again replaces the copy instead of adding one.
+    """
+    if not rows:
+        return
+    history_dir = Path(GLOBAL_VARS["cost_history_dir"])
+    history_dir.mkdir(parents=True, exist_ok=True)
+    # Job ids are only unique within a cluster
+    first_start = datetime.fromisoformat(rows[0]["start"].replace("Z", "")).strftime("%Y%m%dT%H%M%S")
+    archive_path = history_dir / f"{Path.cwd().name}_{rows[0]['job_id']}_{first_start}_{CSV_OUTPUT.name}"
+    shutil.copyfile(CSV_OUTPUT, archive_path)
+
+def load_job_records() -> list:
     json_files = sorted(LOGS_DIR.glob("*.json"))
+
+    # Jobs run with TRACKER_EVENT_LOG=1 that were killed before writing their JSON only have an event log
+    json_stems = {json_file.stem for json_file in json_files}
+    event_files = [event_file for event_file in sorted(LOGS_DIR.glob(f"*{EVENT_LOG_SUFFIX}"))
+                   if event_file.name[:-len(EVENT_LOG_SUFFIX)] not in json_stems]
     
-    rows = []
+    records = []
 
     for json_file in json_files:
         try:
             with open(json_file) as f:
-                data = json.load(f)
-                job_id = data.get("slurm", {}).get("job_id", "unknown")
-                task_id = data.get("slurm", {}).get("task_id", "unknown")
-                for task in data.get("tasks", []):
-                    rows.append({
-                        "job_id": job_id,
-                        "task_id": task_id,
-                        "task_type": task["task_type"],
-                        "start": task["start"],
-                        "end": task["end"],
-                        "duration_sec": task["duration_sec"],
-                        "shots": task.get("metadata", {}).get("shots", None)  # New: pull shots if present
-
-                    })
+                records.append(json.load(f))
         except Exception as e:
             print(f"⚠️ Skipping {json_file} due to error: {e}")
 
-    # Sort rows by start time (converted to datetime for proper sort)
-    rows.sort(key=lambda row: datetime.fromisoformat(row["start"].replace("Z", "")))
+    for event_file in event_files:
+        try:
+            records.append(JobTracker.read_event_log(event_file))
+        except Exception as e:
+            print(f"⚠️ Skipping {event_file} due to error: {e}")
 
-    with open(CSV_OUTPUT, "w", newline="") as csvfile:
-        fieldnames = ["job_id", "task_id", "task_type", "start", "end", "duration_sec", "shots"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
+    return records
 
-    print(f"✅ Wrote summary CSV to {CSV_OUTPUT}")
+def collect_timings_to_csv():
+    rows = []
+
+    for data in load_job_records():
+        try:
+            rows.extend(job_timing_rows(data))
+        except Exception as e:
+            print(f"⚠️ Skipping job {data.get('slurm', {}).get('job_id')} due to error: {e}")
+
+    write_timings_csv(rows)
+
+def _epoch_us(timestamp: str) -> float:
+    return datetime.fromisoformat(timestamp.replace("Z", "")).replace(tzinfo=timezone.utc).timestamp() * 1e6
+
+def export_chrome_trace(output_path):
+    """
+    Merge every job's task spans into one Chrome trace-event JSON that can be
+    opened in Perfetto or chrome://tracing: one process per node and one
+    track per SLURM job, with nested tasks drawn inside their parent.
+    """
+    events = []
+    node_pids = {}
+    job_tids = {}
+
+    for data in load_job_records():
+        tasks = [task for task in data.get("tasks", []) if task.get("end")]
+        if not tasks:
+            continue
+
+        slurm = data.get("slurm", {})
+        node = slurm.get("node") or "unknown"
+        job_id = slurm.get("job_id") or "unknown"
+
+        if node not in node_pids:
+            node_pids[node] = len(node_pids) + 1
+            events.append({"ph": "M", "name": "process_name", "pid": node_pids[node], "tid": 0,
+                           "args": {"name": node}})
+        pid = node_pids[node]
+
+        if (pid, job_id) not in job_tids:
+            job_tids[(pid, job_id)] = len(job_tids) + 1
+            events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": job_tids[(pid, job_id)],
+                           "args": {"name": f"job {job_id}" + (f" [{slurm['task_id']}]" if slurm.get("task_id") else "")}})
+        tid = job_tids[(pid, job_id)]
+
+        for task in tasks:
+            start_us = _epoch_us(task["start"])
+            args = {key: task[key] for key in ("span_id", "parent_id", "metadata", "resources") if task.get(key) is not None}
+            args["job_id"] = job_id
+            events.append({
+                "ph": "X",
+                "name": task["task_type"],
+                "cat": "task",
+                "pid": pid,
+                "tid": tid,
+                "ts": start_us,
+                "dur": _epoch_us(task["end"]) - start_us,
+                "args": args,
+            })
+
+    with open(output_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    print(f"✅ Wrote Chrome trace with {len(job_tids)} job tracks on {len(node_pids)} nodes to {output_path}")
 
 def combine_amplitude_logs():
     combined_lines = []
@@ -149,6 +274,72 @@ def analyze_and_print(csv_path):
         print(f"📄 Exported updated shots vs jobs table to shots_vs_jobs_summary.csv")
 
 
+def summarize_resources(csv_path):
+    """
+    Aggregate the per-task resource samples (JobTracker with TRACKER_SAMPLE_INTERVAL)
+    into min/max/avg per task type and export them to resource_summary.csv.
+    """
+
+    import pandas as pd
+
+    df = pd.read_csv(csv_path).dropna(subset=["peak_rss_mb"])
+    if df.empty:
+        return
+
+    summary = df.groupby("task_type")[RESOURCE_FIELDS].agg(["min", "max", "mean"]).round(1)
+    summary.columns = [f"{field} {stat.replace('mean', 'avg')}" for field, stat in summary.columns]
+
+    print("\n🧰 Resource usage per task type (avg)")
+    for task_type, row in summary.iterrows():
+        print(f"   ↳ {task_type}: peak RSS {row['peak_rss_mb avg']:.1f} MB, CPU {row['cpu_util_pct avg']:.1f}%, "
+              f"read {row['read_bytes avg']:.0f} B, write {row['write_bytes avg']:.0f} B, "
+              f"ctx switches {row['ctx_switches avg']:.0f}")
+
+    summary.to_csv("logs/resource_summary.csv")
+    print(f"📄 Exported resource usage summary to resource_summary.csv")
+
+
+def summarize_queue(queue_dir):
+    """
+    Report how the work-queue batches were spread over the pilot workers,
+    whether every enqueued shot was sampled exactly once, and the makespan
+    against a static equal split. Exports logs/queue_summary.csv.
+    """
+
+    # WorkQueue() creates the queue directories, which a run without a queue must not leave behind
+    if not (Path(queue_dir) / MANIFEST_FILE).exists():
+        return
+    queue = WorkQueue(queue_dir, logs_dir=LOGS_DIR)
+    if queue.manifest() is None:
+        return
+
+    workers = queue.worker_summary()
+    accounting = queue.accounting()
+
+    print("\n📦 Work queue")
+    for worker in workers:
+        print(f"   ↳ job {worker['worker']}: {worker['batches']} batches, {worker['shots']} shots, "
+              f"{format_duration(worker['busy_sec'])} busy ({worker['shots_per_sec']:.2f} shots/sec)")
+
+    if accounting["missing_batches"] or accounting["mismatched_batches"]:
+        print(f"⚠️ {accounting['done_shots']} of {accounting['total_shots']} shots done; "
+              f"missing batches: {accounting['missing_batches']}, "
+              f"batches without exactly one matching sidecar: {accounting['mismatched_batches']}")
+    else:
+        print(f"✅ All {accounting['total_shots']} shots sampled exactly once")
+
+    dynamic, static = makespan_estimate(workers)
+    if static > 0:
+        print(f"⏱️ Makespan: {format_duration(dynamic)} vs. {format_duration(static)} estimated for a static split "
+              f"({100 * (1 - dynamic / static):.1f}% reduction)")
+
+    with open(LOGS_DIR / "queue_summary.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["worker", "batches", "shots", "busy_sec", "shots_per_sec"])
+        writer.writeheader()
+        writer.writerows(workers)
+    print(f"📄 Exported work queue summary to queue_summary.csv")
+
+
 def process_amplitude_file (filename) -> (dict, dict, int) :
     input_file = open(filename, 'r')
     
@@ -188,14 +379,146 @@ def f_xeb(counts, probs, n) ->float :
     
     return calc_f_xeb
 
-if __name__ == "__main__":
-    collect_timings_to_csv()
-    combine_amplitude_logs()
+def verify_packed(files, keys, counts, probs, n):
+    """
+    Checks the --packed result against process_amplitude_file() and f_xeb()
+    run on the same files: the same bitstrings in first-occurrence order,
+    with equal counts, and bit-identical probabilities and f_xeb.
+    """
+    measfreq, measampl = {}, {}
+    for file in files:
+        freq, ampl, _ = process_amplitude_file(file)
+        for key, count in freq.items():
+            if key not in measfreq:
+                measfreq[key] = 0
+                measampl[key] = ampl[key]
+            measfreq[key] += count
+
+    bitstrings = [unpack_bitstring(key, n) for key in keys]
+    if bitstrings != list(measfreq):
+        raise ValueError("--packed counted other bitstrings, or in another order, than process_amplitude_file().")
+    for bitstring, count, prob in zip(bitstrings, counts.tolist(), probs.tolist()):
+        if count != measfreq[bitstring] or prob != measampl[bitstring]:
+            raise ValueError(f"--packed disagrees with process_amplitude_file() on {bitstring}: count {count} vs "
+                             f"{measfreq[bitstring]}, probability {prob!r} vs {measampl[bitstring]!r}.")
+    if f_xeb_packed(counts, probs, n) != f_xeb(measfreq, measampl, n):
+        raise ValueError("--packed f_xeb differs from f_xeb() of the same counts.")
+
+    print(f"✅ --packed matches process_amplitude_file() on {len(bitstrings)} distinct bitstrings")
 
-    wordfreq, wordampl, numberofqubits = process_amplitude_file(AMPLITUDE_OUTPUT)
-    qr_xeb = f_xeb(wordfreq, wordampl, numberofqubits)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stream", action="store_true",
+                        help="Reduce the per-job amplitude files in chunks without building the combined file in memory")
+    parser.add_argument("--packed", action="store_true",
+                        help="Count shots with integer-encoded bitstrings and vectorized unique-counting")
+    parser.add_argument("--chunk-lines", type=int, default=DEFAULT_CHUNK_LINES,
+                        help="Lines parsed per chunk in --stream and --packed modes")
+    parser.add_argument("--write-combined", action="store_true",
+                        help="Also write qr_amplitudes_combined.txt in --stream and --packed modes")
+    parser.add_argument("--binary", action="store_true",
+                        help="Read the binary amplitude files written by 2_n_measurements.py --binary")
+    parser.add_argument("--from-sidecars", action="store_true",
+                        help="Compute f_xeb and its variance from the per-job .xeb sidecars only")
+    parser.add_argument("--verify-sidecars", action="store_true",
+                        help="Check each amplitude file against the checksum in its sidecar")
+    parser.add_argument("--verify-packed", action="store_true",
+                        help="Check the --packed counts, probabilities and f_xeb against the dict-based reduction of the same files")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only ingest jobs finished since the last run, using a persistent checkpoint")
+    parser.add_argument("--chrome-trace", action="store_true",
+                        help="Also export all job spans as a Chrome trace-event JSON (logs/trace.json) for Perfetto")
+    parser.add_argument("--workers", type=int, default=default_worker_count(),
+                        help="Worker processes for --stream and --packed modes (default: SLURM_CPUS_PER_TASK)")
+    parser.add_argument("--queue-dir", default=str(DEFAULT_QUEUE_DIR),
+                        help="Work queue of the pilot workers to report on, if any")
+    args = parser.parse_args()
+
+    if args.binary and not (args.stream or args.packed):
+        parser.error("--binary requires --stream or --packed")
+    if args.binary and args.write_combined:
+        parser.error("--write-combined is only supported for text amplitude files")
+    if args.verify_packed and (args.binary or not args.packed):
+        parser.error("--verify-packed requires --packed with text amplitude files")
+
+    combined_path = AMPLITUDE_OUTPUT if args.write_combined else None
+    qr_xeb_variance = None
+
+    # Safety net for the straggler monitor: drop the output of every copy of a shard that finished second,
+    # before any amplitude file is read
+    discarded = discard_losers(LOGS_DIR)
+    if discarded:
+        print(f"🗑️ Discarded the output of {len(discarded)} speculative shard copies that did not finish first: {discarded}")
+
+    if args.incremental:
+        checkpoint = load_checkpoint(CHECKPOINT_OUTPUT)
+        new_jobs = ingest_new_jobs(LOGS_DIR, checkpoint, job_timing_rows, chunk_lines=args.chunk_lines)
+        save_checkpoint(checkpoint, CHECKPOINT_OUTPUT)
+        write_timings_csv(checkpoint["rows"])
+
+        partial = checkpoint["partial"]
+        print(f"✅ Ingested {len(new_jobs)} new jobs ({len(checkpoint['ingested_jobs'])} total, {partial['shots']} shots)")
+        print(f"🚀 Sampling throughput: {throughput_estimate(checkpoint['rows'], partial['shots']):.2f} shots/sec")
+    else:
+        collect_timings_to_csv()
+
+    if args.chrome_trace:
+        export_chrome_trace(TRACE_OUTPUT)
+
+    if args.incremental:
+        # Nothing to estimate until the first measurement job has finished
+        qr_xeb = f_xeb_from_partial(partial) if partial["shots"] else float("nan")
+        if partial["shots"] > 1:
+            qr_xeb_variance = f_xeb_variance_from_partial(partial)
+    elif args.from_sidecars:
+        sidecars = find_sidecars(LOGS_DIR)
+        partial = reduce_sidecars(sidecars, verify=args.verify_sidecars)
+        print(f"✅ Reduced {partial['shots']} shots from {len(sidecars)} sidecars")
+        qr_xeb = f_xeb_from_partial(partial)
+        qr_xeb_variance = f_xeb_variance_from_partial(partial)
+    elif args.stream and args.workers > 1:
+        files = find_amplitude_files(LOGS_DIR, binary=args.binary)
+        partial = reduce_amplitude_files_parallel(files, workers=args.workers, chunk_lines=args.chunk_lines)
+        if combined_path:
+            write_combined_file(files, combined_path)
+        print(f"✅ Streamed {partial['shots']} shots from {len(files)} files with {args.workers} workers")
+        qr_xeb = f_xeb_from_partial(partial)
+        qr_xeb_variance = f_xeb_variance_from_partial(partial)
+    elif args.stream:
+        files = find_amplitude_files(LOGS_DIR, binary=args.binary)
+        partial = reduce_amplitude_files(files, chunk_lines=args.chunk_lines, combined_path=combined_path)
+        print(f"✅ Streamed {partial['shots']} shots from {len(files)} files")
+        qr_xeb = f_xeb_from_partial(partial)
+        qr_xeb_variance = f_xeb_variance_from_partial(partial)
+    elif args.packed:
+        files = find_amplitude_files(LOGS_DIR, binary=args.binary)
+        if args.workers > 1:
+            keys, counts, probs, numberofqubits = process_amplitude_files_packed_parallel(files, workers=args.workers, chunk_lines=args.chunk_lines)
+            if combined_path:
+                write_combined_file(files, combined_path)
+        else:
+            keys, counts, probs, numberofqubits = process_amplitude_files_packed(files, chunk_lines=args.chunk_lines, combined_path=combined_path)
+        print(f"✅ Counted {len(keys)} distinct bitstrings from {len(files)} files")
+        if args.verify_packed:
+            verify_packed(files, keys, counts, probs, numberofqubits)
+        qr_xeb = f_xeb_packed(counts, probs, numberofqubits)
+    else:
+        combine_amplitude_logs()
+
+        wordfreq, wordampl, numberofqubits = process_amplitude_file(AMPLITUDE_OUTPUT)
+        qr_xeb = f_xeb(wordfreq, wordampl, numberofqubits)
     print("QuantumRings f_xeb: ", qr_xeb, flush=True); 
+    if qr_xeb_variance is not None:
+        print("QuantumRings f_xeb variance: ", qr_xeb_variance, flush=True)
+
+    early_stop = read_early_stop(LOGS_DIR)
+    if early_stop:
+        print(f"🛑 Sampling stopped early at {early_stop['timestamp']} after {early_stop['shots']} shots "
+              f"({early_stop['jobs_ingested']} jobs): f_xeb {early_stop['f_xeb']:.6f} ± {early_stop['std_error']:.6f} "
+              f"(std error), {len(early_stop['remaining_jobs'])} jobs stopped", flush=True)
 
     analyze_and_print(CSV_OUTPUT)
+    summarize_resources(CSV_OUTPUT)
+    summarize_queue(args.queue_dir)
 
 
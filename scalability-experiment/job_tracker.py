@@ -1,12 +1,118 @@
 import os
 import json
 import time
+import atexit
+import signal
+import threading
 from pathlib import Path
 from datetime import datetime
 from platform import python_version
 
 from shared import GLOBAL_VARS
 
+EVENT_LOG_SUFFIX = ".events.jsonl"
+RESOURCE_FIELDS = ["peak_rss_mb", "cpu_util_pct", "read_bytes", "write_bytes", "ctx_switches"]
+
+
+############## Resource sampling ##############
+def _read_proc_status(path: str) -> dict:
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            values[key] = value.split()[0] if value.split() else ""
+    return values
+
+
+def read_proc_counters() -> dict:
+    """
+    Reads the cumulative resource counters of this process from /proc/self:
+    CPU time of all threads (and waited-for children), resident set size,
+    storage I/O bytes and context switches summed over all threads.
+    """
+    with open("/proc/self/stat") as f:
+        # Fields after the ")" closing the command name; utime..cstime are fields 14-17
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_sec = sum(int(value) for value in fields[11:15]) / os.sysconf("SC_CLK_TCK")
+
+    rss_kb = int(_read_proc_status("/proc/self/status").get("VmRSS", 0))
+
+    ctx_switches = 0
+    for task_dir in Path("/proc/self/task").iterdir():
+        try:
+            status = _read_proc_status(task_dir / "status")
+        except OSError:
+            # The thread exited while we were reading
+            continue
+        ctx_switches += int(status.get("voluntary_ctxt_switches", 0)) + int(status.get("nonvoluntary_ctxt_switches", 0))
+
+    try:
+        io = _read_proc_status("/proc/self/io")
+    except OSError:
+        io = {}
+
+    return {
+        "cpu_sec": cpu_sec,
+        "rss_kb": rss_kb,
+        "read_bytes": int(io.get("read_bytes", 0)),
+        "write_bytes": int(io.get("write_bytes", 0)),
+        "ctx_switches": ctx_switches,
+    }
+
+
+def allocated_cores() -> int:
+    return int(os.getenv("SLURM_CPUS_PER_TASK", 0)) or len(os.sched_getaffinity(0))
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Background thread that samples the resident set size every interval
+    seconds, so each open task gets its peak RSS. The cumulative counters
+    (CPU time, I/O bytes, context switches) are read when a task starts and
+    finishes.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="JobTrackerResourceSampler", daemon=True)
+        self.interval = interval
+        self.cores = allocated_cores()
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            rss_kb = read_proc_counters()["rss_kb"]
+            with self._lock:
+                for state in self._active.values():
+                    state["peak_rss_kb"] = max(state["peak_rss_kb"], rss_kb)
+
+    def stop(self):
+        self._stopped.set()
+
+    def begin(self, task: "JobTracker.Task"):
+        counters = read_proc_counters()
+        with self._lock:
+            self._active[task] = {"start": counters, "peak_rss_kb": counters["rss_kb"]}
+
+    def end(self, task: "JobTracker.Task") -> dict:
+        counters = read_proc_counters()
+        with self._lock:
+            state = self._active.pop(task)
+
+        start = state["start"]
+        wall = task.end_time - task.start_time
+        cpu_sec = counters["cpu_sec"] - start["cpu_sec"]
+
+        return {
+            "peak_rss_mb": round(max(state["peak_rss_kb"], counters["rss_kb"]) / 1024, 1),
+            "cpu_util_pct": round(100 * cpu_sec / (wall * self.cores), 1) if wall > 0 else None,
+            "cores": self.cores,
+            "read_bytes": counters["read_bytes"] - start["read_bytes"],
+            "write_bytes": counters["write_bytes"] - start["write_bytes"],
+            "ctx_switches": counters["ctx_switches"] - start["ctx_switches"],
+        }
+
 class JobTracker:
     class Task:
         def __init__(self, task_type: str, tracker: "JobTracker", metadata: dict = None):
@@ -14,22 +120,38 @@ class JobTracker:
             self.tracker = tracker
             self.start_time = None
             self.end_time = None
-            self.metadata = metadata or {}
+            self.metadata = metadata if metadata is not None else {}
+            self.resources = None
+            self.span_id = None
+            self.parent_id = None
+            # Name of the exception that ended the task (e.g. SystemExit on SIGTERM), None if it ran to the end
+            self.exception = None
 
         def __enter__(self):
             self.start_time = time.time()
+            self.tracker._open_span(self)
+            if self.tracker.sampler:
+                self.tracker.sampler.begin(self)
             self.tracker._write_log(f"START {self.task_type}")
-            self.tracker.write_json()
+            self.tracker._checkpoint()
             print(f"Starting task '{self.task_type}'")
             return self
 
         def __exit__(self, exc_type, exc_val, exc_tb):
             self.finish()
+            if exc_type is not None:
+                self.exception = exc_type.__name__
+            self.tracker._close_span(self)
+            if self.tracker.sampler:
+                self.resources = self.tracker.sampler.end(self)
             self.tracker.tasks.append(self)
             duration = self.to_dict()["duration_sec"]
-            self.tracker._write_log(f"FINISH {self.task_type}", {"duration": duration})
-            self.tracker.write_json()
-            print(f"Finished task '{self.task_type}' in {duration:.4f} seconds.")
+            self.tracker._write_log(f"FINISH {self.task_type}", {"duration": duration}, task=self)
+            self.tracker._checkpoint()
+            if self.exception:
+                print(f"Interrupted task '{self.task_type}' by {self.exception} after {duration:.4f} seconds.")
+            else:
+                print(f"Finished task '{self.task_type}' in {duration:.4f} seconds.")
 
         def finish(self):
             self.end_time = time.time()
@@ -40,34 +162,105 @@ class JobTracker:
                 "start": datetime.utcfromtimestamp(self.start_time).isoformat() + "Z",
                 "end": datetime.utcfromtimestamp(self.end_time).isoformat() + "Z" if self.end_time else None,
                 "duration_sec": round(self.end_time - self.start_time, 4) if self.end_time else None,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
             }
+            if self.exception:
+                # Cut short, so its duration and outputs are partial
+                base["interrupted"] = True
+                base["exception"] = self.exception
             if self.metadata:
                 base["metadata"] = self.metadata
+            if self.resources:
+                base["resources"] = self.resources
             return base
 
 
-    def __init__(self, log_file_path: Path = None, json_file_path: Path = None):
+    def __init__(self, log_file_path: Path = None, json_file_path: Path = None, event_log: bool = None,
+                 flush_every: int = None, fsync: bool = None, sample_interval: float = None):
+        """
+        Args:
+            log_file_path (Path): Text log, defaults to logs/{job_id}.log
+            json_file_path (Path): Consolidated JSON, defaults to logs/{job_id}.json
+            event_log (bool): Append JSON-lines events to logs/{job_id}.events.jsonl through
+                one open handle, and only write the consolidated JSON at exit.
+                Defaults to the TRACKER_EVENT_LOG environment variable.
+            flush_every (int): Flush the event log every N events (0 = only at exit).
+                Defaults to TRACKER_FLUSH_EVERY, or 1.
+            fsync (bool): fsync the event log on every flush. Defaults to TRACKER_FSYNC.
+            sample_interval (float): Seconds between resource samples (peak RSS, CPU
+                utilization, I/O bytes, context switches per task); 0 disables sampling.
+                Defaults to TRACKER_SAMPLE_INTERVAL, or 0.
+        """
         job_id = GLOBAL_VARS["job_id"]
         log_dir = Path(GLOBAL_VARS["logs_dir"])
 
         self.tasks = []
 
+        # Tasks currently open, innermost last; used to link child spans to their parent
+        self._span_stack = []
+        self._next_span_id = 1
+
         self.log_file = log_file_path or (log_dir / f"{job_id}.log")
         self.json_file = json_file_path or (log_dir / f"{job_id}.json")
+        self.event_file = Path(self.json_file).with_suffix(EVENT_LOG_SUFFIX)
 
+        # The job id the log files are named after, ARRAYID_TASKID for array tasks
         self.slurm = {
-            "job_id": os.getenv("SLURM_JOB_ID"),
-            "task_id": os.getenv("SLURM_ARRAY_TASK_ID"),
-            "node": os.getenv("SLURMD_NODENAME"),
+            "job_id": job_id,
+            "task_id": GLOBAL_VARS["task_id"],
+            "node": GLOBAL_VARS["node"],
         }
 
-        self._write_log("START")
+        self.event_log = event_log if event_log is not None else os.getenv("TRACKER_EVENT_LOG", "0") == "1"
+        self.flush_every = flush_every if flush_every is not None else int(os.getenv("TRACKER_FLUSH_EVERY", 1))
+        self.fsync = fsync if fsync is not None else os.getenv("TRACKER_FSYNC", "0") == "1"
+
+        sample_interval = sample_interval if sample_interval is not None else float(os.getenv("TRACKER_SAMPLE_INTERVAL", 0))
+        self.sampler = ResourceSampler(sample_interval) if sample_interval > 0 else None
+        if self.sampler:
+            self.sampler.start()
+
+        self._event_handle = None
+        self._pending_events = 0
+        self._json_current = False
+
+        if self.event_log:
+            self._event_handle = open(self.event_file, "a")
+            self._install_exit_handlers()
+            self._write_log("START", {"slurm": self.slurm, "python_version": python_version()})
+        else:
+            self._write_log("START")
 
     def task(self, task_type: str, metadata: dict = None):
         return self.Task(task_type, tracker=self, metadata=metadata)
 
-    def _write_log(self, event_type: str, extra: dict = None):
+    def _open_span(self, task: "JobTracker.Task"):
+        task.span_id = self._next_span_id
+        task.parent_id = self._span_stack[-1].span_id if self._span_stack else None
+        self._next_span_id += 1
+        self._span_stack.append(task)
+
+    def _close_span(self, task: "JobTracker.Task"):
+        if task in self._span_stack:
+            self._span_stack.remove(task)
+
+    def _write_log(self, event_type: str, extra: dict = None, task: "JobTracker.Task" = None):
         timestamp = datetime.utcnow().isoformat() + "Z"
+        self._json_current = False
+
+        if self.event_log:
+            if self._event_handle is None:
+                self._event_handle = open(self.event_file, "a")
+            event = {"timestamp": timestamp, "event": event_type, **(extra or {})}
+            if task:
+                event["task"] = task.to_dict()
+            self._event_handle.write(json.dumps(event) + "\n")
+            self._pending_events += 1
+            if self.flush_every and self._pending_events >= self.flush_every:
+                self._flush()
+            return
+
         message = f"[{timestamp}] {event_type}"
         if extra:
             message += f" | {json.dumps(extra)}"
@@ -75,6 +268,69 @@ class JobTracker:
         with open(self.log_file, "a") as f:
             f.write(message + "\n")
 
+    def _flush(self):
+        self._event_handle.flush()
+        if self.fsync:
+            os.fsync(self._event_handle.fileno())
+        self._pending_events = 0
+
+    def _checkpoint(self):
+        # In event-log mode the consolidated JSON is only written at exit
+        if not self.event_log:
+            self.write_json()
+
+    def _install_exit_handlers(self):
+        atexit.register(self.close)
+
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def on_sigterm(signum, frame):
+            # Unwind the open tasks so they are recorded as interrupted; the atexit hook then writes the JSON
+            if callable(previous):
+                previous(signum, frame)
+            raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, on_sigterm)
+
+    def close(self):
+        """
+        Writes the consolidated JSON (if anything changed since the last
+        write) and closes the event log. Safe to call more than once.
+        """
+        if self._event_handle is None:
+            return
+
+        if not self._json_current:
+            self.write_json()
+        self._flush()
+        self._event_handle.close()
+        self._event_handle = None
+
+    @staticmethod
+    def read_event_log(event_file) -> dict:
+        """
+        Rebuilds the consolidated JSON record from a JSON-lines event log, e.g.
+        for a job that was killed before it could write its JSON.
+        """
+        record = {"timestamp": None, "slurm": {}, "python_version": None, "tasks": []}
+
+        with open(event_file) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Torn trailing line of a killed job
+                    continue
+
+                record["timestamp"] = event["timestamp"]
+                if "slurm" in event:
+                    record["slurm"] = event["slurm"]
+                    record["python_version"] = event.get("python_version")
+                if "task" in event:
+                    record["tasks"].append(event["task"])
+
+        return record
+
     def write_json(self):
         record = {
             "timestamp": datetime.utcnow().isoformat() + "Z",
@@ -84,3 +340,4 @@ class JobTracker:
         }
         with open(self.json_file, "w") as f:
             json.dump(record, f, indent=2)
+        self._json_current = True
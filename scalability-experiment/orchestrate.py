@@ -0,0 +1,274 @@
+import os
+import sys
+import time
+import shlex
+import shutil
+import argparse
+import subprocess
+from pathlib import Path
+
+from shared import GLOBAL_VARS, get_paths, select_circuit
+from state_store import lookup, restore, follow, announce
+from generate_rcs import circuit_path, generate_rcs
+from cost_model import CostModel
+
+# Only the standard library is used here, so the orchestrator runs on the
+# login node without the experiment environment.
+LOGS_DIR = Path("./logs/")
+MEASUREMENT_JOBS_FILE = "measurement_jobs.txt"
+SPECULATIVE_JOBS_FILE = "speculative_jobs.txt"
+
+# Default MaxArraySize of SLURM is 1001, i.e. task ids 0..1000
+DEFAULT_MAX_ARRAY_SIZE = 1000
+
+
+############## Submission ##############
+def sbatch(sbatch_command: list, script: str, time_limit: str, dependency: str = None, array: str = None,
+           exports: dict = None, mem: str = None) -> str:
+    """
+    Submits one batch script and returns its job id.
+
+    Args:
+        sbatch_command (list): The sbatch executable (and leading arguments), e.g. ["sbatch"]
+        script (str): Batch script to submit
+        time_limit (str): --time of the job
+        dependency (str): --dependency of the job, if any
+        array (str): --array index range, if any
+        exports (dict): Variables passed in addition to the submitting environment
+        mem (str): --mem of the job, if not the batch script's
+
+    Returns:
+        str: The job id (the array job id for an array)
+    """
+    command = sbatch_command + ["--parsable", f"--time={time_limit}"]
+    if dependency:
+        command.append(f"--dependency={dependency}")
+    if array:
+        command.append(f"--array={array}")
+    if mem:
+        command.append(f"--mem={mem}")
+
+    export = ["ALL"] + [f"{key}={value}" for key, value in (exports or {}).items()]
+    command += [f"--export={','.join(export)}", script]
+
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    # --parsable prints "jobid" or "jobid;cluster"
+    return result.stdout.strip().split(";")[0]
+
+
+def shot_split(total_shots: int, job_count: int) -> list:
+    """
+    Splits total_shots over job_count jobs; the first jobs take one extra
+    shot each, so no shot is dropped.
+    """
+    shots_per_job, remainder = divmod(total_shots, job_count)
+    return [shots_per_job + (1 if i < remainder else 0) for i in range(job_count)]
+
+
+def array_groups(shots: list, resources: list, max_array_size: int) -> list:
+    """
+    Groups the measurement jobs into job arrays: jobs with the same
+    (wall time, memory) share an array (an array has a single --time and
+    --mem), split further at max_array_size tasks.
+
+    Returns:
+        list: [((wall_time, mem), [(job_index, shots), ...]), ...]
+    """
+    by_resources = {}
+    for index, (job_shots, job_resources) in enumerate(zip(shots, resources)):
+        by_resources.setdefault(job_resources, []).append((index, job_shots))
+
+    groups = []
+    for job_resources, jobs in by_resources.items():
+        for start in range(0, len(jobs), max_array_size):
+            groups.append((job_resources, jobs[start:start + max_array_size]))
+    return groups
+
+
+def size_jobs(qasm_path: str, state_prep_wall_time: str, shots: list, wall_times: list) -> ((str, str), list):
+    """
+    Sizes job A and the measurement jobs with the cost model; the given
+    wall times (and the batch scripts' --mem) stay for whatever it cannot
+    predict yet.
+
+    Returns:
+        ((str, str), list): ((wall_time, mem) of job A, [(wall_time, mem) per measurement job])
+    """
+    model = CostModel()
+    prep_time, prep_mem = model.resources("prep", qasm_path)
+
+    predictions = {}
+    resources = []
+    for job_shots, wall_time in zip(shots, wall_times):
+        if job_shots not in predictions:
+            predictions[job_shots] = model.resources("measurement", qasm_path, job_shots)
+        time_limit, mem = predictions[job_shots]
+        resources.append((time_limit or wall_time, mem))
+    return (prep_time or state_prep_wall_time, prep_mem), resources
+
+
+def write_shot_map(path: Path, jobs: list):
+    """
+    Writes the "TASK_ID JOB_INDEX SHOTS" lines read by run_n_measurements.sh.
+    """
+    with open(path, "w") as f:
+        for task_id, (index, job_shots) in enumerate(jobs):
+            f.write(f"{task_id} {index} {job_shots}\n")
+
+
+############## Orchestration ##############
+def orchestrate(args) -> dict:
+    sbatch_command = shlex.split(args.sbatch)
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+
+    print("=== Quantum Job Orchestration ===")
+    circuit = (args.qubits, args.cycles, args.circuit_seed, args.pattern)
+    if not select_circuit(*circuit).exists():
+        path = circuit_path(*circuit)
+        path.write_text(generate_rcs(*circuit))
+        print(f"Generated circuit {path}")
+    qasm_path, _, state_path = get_paths(*circuit)
+
+    if args.shots_per_job:
+        shots = args.shots_per_job
+        wall_times = args.wall_times or [args.wall_time] * len(shots)
+        if len(wall_times) != len(shots):
+            raise ValueError("--wall-times needs one wall time per --shots-per-job entry.")
+    else:
+        shots = shot_split(args.total_shots, args.job_count)
+        wall_times = [args.wall_time] * len(shots)
+
+    if args.no_cost_model:
+        prep_resources = (args.state_prep_wall_time, None)
+        measurement_resources = [(wall_time, None) for wall_time in wall_times]
+    else:
+        # Wall time and memory predicted from the circuit and earlier campaigns (see cost_model.py)
+        prep_resources, measurement_resources = size_jobs(qasm_path, args.state_prep_wall_time, shots, wall_times)
+        print(f"Sized job A: --time={prep_resources[0]} --mem={prep_resources[1] or 'default'}")
+    # Speculative copies of any shard get the resources of the largest one
+    speculation_time, speculation_mem = measurement_resources[shots.index(max(shots))]
+
+    # Every job reads the circuit parameters from the submitting environment (sbatch --export=ALL)
+    os.environ.update(QUBITS=str(args.qubits), CYCLES=str(args.cycles),
+                      CIRCUIT_SEED=str(args.circuit_seed), PATTERN=args.pattern)
+    stored = lookup(qasm_path, GLOBAL_VARS["performance"])
+    if stored is not None:
+        jid_a = None
+        restore(stored, state_path)
+        print(f"Skipped job A (State Prep): state {stored['key'][:12]} restored from the state store")
+    else:
+        # Another experiment's job A may already be preparing the same state
+        jid_a = follow(qasm_path, state_path, GLOBAL_VARS["performance"])
+        if jid_a is not None:
+            print(f"Skipped job A (State Prep): waiting for job {jid_a}, which prepares the same state")
+        else:
+            jid_a = sbatch(sbatch_command, "run_prepare_state.sh", prep_resources[0],
+                           exports={"PERFORMANCE": args.performance}, mem=prep_resources[1])
+            announce(jid_a, qasm_path, GLOBAL_VARS["performance"])
+            print(f"Submitted job A (State Prep): {jid_a}")
+    state_dependency = f"afterok:{jid_a}" if jid_a else None
+
+    measurement_exports = {}
+    measurement_args = os.getenv("MEASUREMENT_ARGS", "")
+
+    if args.queue_batch_shots:
+        # Every shot goes into the queue; the array tasks run as pilot workers
+        subprocess.run([sys.executable, "work_queue.py", "populate", "--reset",
+                        "--total-shots", str(sum(shots)), "--batch-shots", str(args.queue_batch_shots)], check=True)
+        measurement_args = f"--pilot {measurement_args}".strip()
+        shots = [0] * len(shots)
+
+    if args.speculation_args:
+        # Shard markers and copies of a previous campaign would decide this one's winners
+        shutil.rmtree(LOGS_DIR / "shards", ignore_errors=True)
+        (LOGS_DIR / SPECULATIVE_JOBS_FILE).write_text("")
+        measurement_args = f"{measurement_args} --speculation".strip()
+
+    if measurement_args:
+        measurement_exports["MEASUREMENT_ARGS"] = measurement_args
+
+    # Record "JOB_INDEX JOB_ID SHOTS" for each measurement job; array tasks are named ARRAYID_TASKID
+    measurement_jobs = []
+    array_ids = []
+    for group, ((wall_time, mem), jobs) in enumerate(array_groups(shots, measurement_resources, args.max_array_size)):
+        shot_map = LOGS_DIR / f"shot_map_{group}.txt"
+        write_shot_map(shot_map, jobs)
+
+        array_id = sbatch(sbatch_command, "run_n_measurements.sh", wall_time,
+                          dependency=state_dependency, array=f"0-{len(jobs) - 1}",
+                          exports={**measurement_exports, "SHOT_MAP": shot_map}, mem=mem)
+        array_ids.append(array_id)
+        measurement_jobs += [(index, f"{array_id}_{task_id}", job_shots) for task_id, (index, job_shots) in enumerate(jobs)]
+        print(f"Submitted job array B: {array_id} ({len(jobs)} tasks, {sum(job_shots for _, job_shots in jobs)} shots, "
+              f"wall time {wall_time}{f', memory {mem}' if mem else ''})")
+
+    with open(LOGS_DIR / MEASUREMENT_JOBS_FILE, "w") as f:
+        for index, job_id, job_shots in sorted(measurement_jobs):
+            f.write(f"{index} {job_id} {job_shots}\n")
+
+    postprocess_dependency = "afterok"
+    postprocess_jobs = list(array_ids)
+    if args.xeb_controller_args:
+        jid_x = sbatch(sbatch_command, "run_xeb_controller.sh", args.wall_time, dependency=state_dependency,
+                       exports={"XEB_CONTROLLER_ARGS": args.xeb_controller_args})
+        print(f"Submitted XEB controller: {jid_x} ({args.xeb_controller_args})")
+        # Cancelled measurement jobs must not block post-processing
+        postprocess_dependency = "afterany"
+
+    if args.speculation_args:
+        speculation_args = f"{args.speculation_args} --wall-time {speculation_time}"
+        if speculation_mem:
+            speculation_args += f" --mem {speculation_mem}"
+        jid_s = sbatch(sbatch_command, "run_straggler_monitor.sh", args.wall_time, dependency=state_dependency,
+                       exports={**measurement_exports, "SPECULATION_ARGS": speculation_args})
+        print(f"Submitted straggler monitor: {jid_s} ({args.speculation_args})")
+        # The copy of a shard that finishes second is cancelled, which must not block post-processing
+        postprocess_dependency = "afterany"
+        # The monitor discards the losing copies' output and a speculative copy may be the one to finish a shard
+        postprocess_jobs.append(jid_s)
+
+    # A dependency on an array job waits for all of its tasks
+    jid_c = sbatch(sbatch_command, "run_postprocess.sh", "00:10:00",
+                   dependency=f"{postprocess_dependency}:{':'.join(postprocess_jobs)}")
+    print(f"Submitted job C (Post-Process): {jid_c}")
+
+    elapsed = time.perf_counter() - started
+    print(f"⏱️ Submitted {len(measurement_jobs)} measurement jobs in {len(array_ids)} arrays in {elapsed:.2f} seconds")
+
+    return {"state_prep": jid_a, "arrays": array_ids, "postprocess": jid_c}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit the experiment with job arrays instead of one sbatch per measurement job")
+    parser.add_argument("--job-count", type=int, default=100, help="Number of B jobs")
+    parser.add_argument("--total-shots", type=int, default=2500000, help="Total shots to divide among B jobs")
+    parser.add_argument("--wall-time", default="04:00:00", help="Wall time for B jobs, unless the cost model predicts it")
+    parser.add_argument("--shots-per-job", type=int, nargs="+",
+                        help="Explicit shots per B job (e.g. the scalability sizes), instead of --job-count/--total-shots")
+    parser.add_argument("--wall-times", nargs="+", help="Wall time per --shots-per-job entry, unless the cost model predicts it")
+    parser.add_argument("--state-prep-wall-time", default="00:30:00",
+                        help="Wall time for state preparation (job A), unless the cost model predicts it")
+    parser.add_argument("--no-cost-model", action="store_true",
+                        help="Always request the wall times above and the batch scripts' --mem instead of sizing the jobs with cost_model.py")
+    parser.add_argument("--performance", default="BalancedAccuracy", help="Performance setting (string)")
+    parser.add_argument("--qubits", type=int, default=GLOBAL_VARS["qubits"], help="Qubits of the circuit (QUBITS)")
+    parser.add_argument("--cycles", type=int, default=GLOBAL_VARS["cycles"], help="Cycles of the circuit (CYCLES)")
+    parser.add_argument("--circuit-seed", type=int, default=GLOBAL_VARS["circuit_seed"], help="Circuit seed (CIRCUIT_SEED)")
+    parser.add_argument("--pattern", default=GLOBAL_VARS["pattern"], help="Coupler pattern of the circuit (PATTERN)")
+    parser.add_argument("--max-array-size", type=int, default=DEFAULT_MAX_ARRAY_SIZE,
+                        help="Maximum tasks per job array (the cluster's MaxArraySize)")
+    parser.add_argument("--queue-batch-shots", type=int,
+                        help="Run the B jobs as pilot workers on a shared queue of batches of this many shots")
+    parser.add_argument("--xeb-controller-args", default=os.getenv("XEB_CONTROLLER_ARGS", ""),
+                        help='e.g. "--half-width 0.0005" to stop once f_xeb has converged')
+    parser.add_argument("--speculation-args", default=os.getenv("SPECULATION_ARGS", ""),
+                        help='e.g. "--slow-ratio 2" to re-run straggling B jobs speculatively')
+    parser.add_argument("--sbatch", default="sbatch",
+                        help='sbatch command, e.g. "python ../fake_sbatch.py" to test without SLURM')
+    args = parser.parse_args()
+
+    if args.queue_batch_shots and args.speculation_args:
+        parser.error("--queue-batch-shots and --speculation-args cannot be combined; the queue already balances the load")
+
+    orchestrate(args)
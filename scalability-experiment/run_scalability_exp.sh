@@ -3,42 +3,89 @@
 # === Configuration ===
 STATE_PREP_WALL_TIME=${4:-00:30:00}       # Wall time for state preparation (job A)
 STATE_PREP_PERFORMANCE=${5:-BalancedAccuracy}  # Performance setting (string)
+export QASM_PASSES=${QASM_PASSES:-}  # e.g. "fuse,reorder" to fuse single-qubit gates and reorder qubits before state preparation
+export MASTER_SEED=${MASTER_SEED:-}  # e.g. 1234 for reproducible per-shard sampling seeds
+# Circuit (default: the experiment's shipped circuit); missing circuits are generated with generate_rcs.py
+export QUBITS=${QUBITS:-}  # e.g. 20 for a scaling sweep over the qubit count
+export CYCLES=${CYCLES:-}  # e.g. 12 for a scaling sweep over the depth
+export CIRCUIT_SEED=${CIRCUIT_SEED:-}
+export PATTERN=${PATTERN:-}  # e.g. ABCDCDAB or EFGH
+export GENERATED_CIRCUIT=${GENERATED_CIRCUIT:-}  # 1 to run the generated circuit even where a shipped one has the same parameters
 # Example: array of shot counts per job (can be dynamically generated)
 SHOTS_PER_JOB_ARRAY=(25000 10000 5000 2500)  # Replace this with your actual logic
 CPU_WALL_TIME_ARRAY=("04:00:00" "02:00:00" "01:00:00" "01:00:00")
+COST_MODEL=${COST_MODEL:-1}  # 0 to always request the wall times above and the job scripts' #SBATCH --mem
 
 echo "=== Quantum Job Orchestration ==="
+python generate_rcs.py --if-missing || exit 1
+
+# Wall time and memory predicted from the circuit and earlier campaigns (see cost_model.py);
+# the wall times above are the fallback while there is no history to predict from
+prep_resources="--time=$STATE_PREP_WALL_TIME"
+measurement_resources=()
+for ((i = 0; i < ${#SHOTS_PER_JOB_ARRAY[@]}; i++)); do
+  measurement_resources[$i]="--time=${CPU_WALL_TIME_ARRAY[$i]}"
+done
+if [[ "$COST_MODEL" == 1 ]]; then
+  prep_resources=$(python cost_model.py sbatch-args --stage prep \
+    --fallback-time $STATE_PREP_WALL_TIME) || prep_resources="--time=$STATE_PREP_WALL_TIME"
+  for ((i = 0; i < ${#SHOTS_PER_JOB_ARRAY[@]}; i++)); do
+    measurement_resources[$i]=$(python cost_model.py sbatch-args --stage measurement \
+      --shots ${SHOTS_PER_JOB_ARRAY[$i]} \
+      --fallback-time ${CPU_WALL_TIME_ARRAY[$i]}) || measurement_resources[$i]="--time=${CPU_WALL_TIME_ARRAY[$i]}"
+  done
+fi
+
 echo "State Prep:"
-echo "  - Wall Time: $STATE_PREP_WALL_TIME"
+echo "  - Resources: $prep_resources"
 echo "  - Performance: $STATE_PREP_PERFORMANCE"
+if [[ -n "$QASM_PASSES" ]]; then
+  echo "  - QASM Passes: $QASM_PASSES"
+fi
 echo "Measurements:"
+if [[ -n "$MASTER_SEED" ]]; then
+  echo "  - Master Seed: $MASTER_SEED"
+fi
 echo "  - Shots: $SHOTS_PER_JOB_ARRAY"
-echo "  - Wall Times: $CPU_WALL_TIME_ARRAY"
+echo "  - Resources: ${measurement_resources[*]}"
 echo ""
 
-# === Submit State Preparation ===
-jid_a=$(sbatch --parsable \
-  --time=$STATE_PREP_WALL_TIME \
-  --export=ALL,PERFORMANCE="$STATE_PREP_PERFORMANCE" \
-  run_prepare_state.sh)
+# === Submit State Preparation (skipped if the state store already holds the state) ===
+jid_a=""
+if python state_store.py restore; then
+  echo "Skipped job A (State Prep): state restored from the state store"
+elif jid_a=$(python state_store.py follow); then
+  # e.g. run_all.sh: another experiment's job A is already preparing the same state
+  echo "Skipped job A (State Prep): waiting for job $jid_a, which prepares the same state"
+else
+  jid_a=$(sbatch --parsable \
+    $prep_resources \
+    --export=ALL,PERFORMANCE="$STATE_PREP_PERFORMANCE" \
+    run_prepare_state.sh)
+  python state_store.py announce $jid_a
 
-echo "Submitted job A (State Prep): $jid_a"
+  echo "Submitted job A (State Prep): $jid_a"
+fi
 echo ""
 
 
 MEASUREMENT_JOB_COUNT=${#SHOTS_PER_JOB_ARRAY[@]}
 
+# Record "JOB_INDEX JOB_ID SHOTS" for each measurement job
+: > logs/measurement_jobs.txt
+
 for ((i = 0; i < MEASUREMENT_JOB_COUNT; i++)); do
   shots=${SHOTS_PER_JOB_ARRAY[$i]}
-  walltime=${CPU_WALL_TIME_ARRAY[$i]}
+  resources=${measurement_resources[$i]}
 
   jid_b=$(sbatch --parsable \
-    --dependency=afterok:$jid_a \
-    --time=$walltime \
+    ${jid_a:+--dependency=afterok:$jid_a} \
+    $resources \
     --export=ALL,SHOTS=$shots,JOB_INDEX=$i \
     run_n_measurements.sh)
 
   echo "Submitted job $i: $jid_b (Shots: $shots)"
+  echo "$i $jid_b $shots" >> logs/measurement_jobs.txt
   b_job_ids+="$jid_b:"
 done
 
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+from shared import GLOBAL_VARS, STATE_METADATA_SUFFIX, get_paths
+from work_queue import slurm_job_alive
+
+# Only the standard library is used here, so the orchestration scripts can
+# look the state up from the login node without the experiment environment.
+STATE_FILE = "state.bin"
+MANIFEST_FILE = "manifest.json"
+PENDING_SUFFIX = ".pending"
+
+
+############## Keys ##############
+def _file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def library_version() -> str:
+    """
+    Version of QuantumRingsLib that prepares the state: QR_LIB_VERSION if
+    set, else the installed distribution's version, else "unknown". Read from
+    the package metadata, so the library is not imported.
+    """
+    if os.getenv("QR_LIB_VERSION"):
+        return os.environ["QR_LIB_VERSION"]
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+    except ImportError:
+        return "unknown"
+    try:
+        return version("QuantumRingsLib")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def store_key(qasm_path: str, performance: str = None, lib_version: str = None) -> dict:
+    """
+    Content address of a state: the SHA-256 of the QASM text, the library
+    version, the performance setting and the QASM passes applied before
+    optimization. The same circuit prepared by any experiment maps to the
+    same entry, whatever its file name or directory.
+
+    Args:
+        qasm_path (str): Circuit the state is prepared from
+        performance (str): Performance setting of backend.run (None = library default)
+        lib_version (str): Defaults to library_version()
+
+    Returns:
+        dict: {"key", "qasm_sha256", "lib_version", "performance", "qasm_passes"}
+    """
+    components = {
+        "qasm_sha256": _file_sha256(qasm_path),
+        "lib_version": lib_version or library_version(),
+        "performance": performance or "default",
+        "qasm_passes": GLOBAL_VARS["qasm_passes"],
+    }
+    key = hashlib.sha256(json.dumps(components, sort_keys=True).encode()).hexdigest()
+    return {"key": key, **components}
+
+
+def entry_dir(key: str, store_dir: str = None) -> Path:
+    return Path(store_dir or GLOBAL_VARS["state_store_dir"]) / key
+
+
+def pending_path(key: str, store_dir: str = None) -> Path:
+    return Path(store_dir or GLOBAL_VARS["state_store_dir"]) / f"{key}{PENDING_SUFFIX}"
+
+
+############## Store ##############
+def lookup(qasm_path: str, performance: str = None, store_dir: str = None, verify: bool = False) -> dict:
+    """
+    Finds the stored state of a circuit.
+
+    Args:
+        qasm_path (str): Circuit the state is prepared from
+        performance (str): Performance setting of backend.run
+        store_dir (str): Defaults to GLOBAL_VARS["state_store_dir"]
+        verify (bool): Also re-hash the stored file against its manifest (reads the whole state)
+
+    Returns:
+        dict: The entry's manifest (with "path" set to the stored state file), or None on a miss
+    """
+    key = store_key(qasm_path, performance)
+    entry = entry_dir(key["key"], store_dir)
+    manifest_path = entry / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    state_path = entry / STATE_FILE
+    if not state_path.exists() or state_path.stat().st_size != manifest["size"]:
+        return None
+    if verify and _file_sha256(state_path) != manifest["sha256"]:
+        return None
+
+    return {**manifest, "path": str(state_path.resolve())}
+
+
+def publish(state_path: str, qasm_path: str, performance: str = None, store_dir: str = None) -> dict:
+    """
+    Adds a freshly prepared state to the store. The entry is assembled in a
+    temporary directory and renamed into place, so readers never see a
+    partial entry; if another job published the same key first, its entry
+    is kept.
+
+    Args:
+        state_path (str): State file written by SaveSystemStateToDiskFile
+        qasm_path (str): Circuit the state was prepared from
+        performance (str): Performance setting of backend.run
+        store_dir (str): Defaults to GLOBAL_VARS["state_store_dir"]
+
+    Returns:
+        dict: The manifest of the entry
+    """
+    key = store_key(qasm_path, performance)
+    entry = entry_dir(key["key"], store_dir)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_entry = entry.parent / f".tmp.{key['key']}.{os.getpid()}"
+    tmp_entry.mkdir()
+    try:
+        # Hard link when the store is on the same file system, copy otherwise
+        try:
+            os.link(state_path, tmp_entry / STATE_FILE)
+        except OSError:
+            shutil.copyfile(state_path, tmp_entry / STATE_FILE)
+
+        # How the state was prepared, read by the measurement jobs through the symlink (see read_state_metadata)
+        metadata_path = Path(f"{state_path}{STATE_METADATA_SUFFIX}")
+        if metadata_path.exists():
+            shutil.copyfile(metadata_path, tmp_entry / f"{STATE_FILE}{STATE_METADATA_SUFFIX}")
+
+        # write_state_checksum() has usually hashed the state already
+        checksum_path = Path(f"{state_path}.sha256")
+        sha256 = checksum_path.read_text().strip() if checksum_path.exists() else _file_sha256(state_path)
+
+        manifest = {
+            **key,
+            "qasm_file": Path(qasm_path).name,
+            "sha256": sha256,
+            "size": os.path.getsize(tmp_entry / STATE_FILE),
+            "state_metadata": metadata_path.exists(),
+            "job_id": GLOBAL_VARS["job_id"],
+            "experiment": Path.cwd().name,
+            "created": datetime.utcnow().isoformat() + "Z",
+        }
+        with open(tmp_entry / MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Published concurrently (e.g. by another experiment's job A)
+            with open(entry / MANIFEST_FILE) as f:
+                manifest = json.load(f)
+        return manifest
+    finally:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        pending_path(key["key"], store_dir).unlink(missing_ok=True)
+
+
+def announce(job_id: str, qasm_path: str, performance: str = None, store_dir: str = None):
+    """
+    Records that job_id (a submitted job A) will publish the state of this
+    circuit, so orchestrators submitting the same circuit meanwhile can wait
+    for it instead of preparing the state again (see follow()).
+    """
+    key = store_key(qasm_path, performance)
+    path = pending_path(key["key"], store_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f"{job_id}\n")
+
+
+def follow(qasm_path: str, state_path: str, performance: str = None, store_dir: str = None) -> str:
+    """
+    Finds a job A that is still queued or running and will publish the state
+    of this circuit, and points state_path at the file it will publish.
+    Without <state_path>.sha256, node-local copies are checked against
+    their own hash (see get_local_state_path).
+
+    Returns:
+        str: The job id to depend on, or None if no such job is alive
+    """
+    key = store_key(qasm_path, performance)
+    path = pending_path(key["key"], store_dir)
+    if not path.exists():
+        return None
+
+    job_id = path.read_text().strip()
+    if not slurm_job_alive(job_id):
+        return None
+
+    Path(state_path).parent.mkdir(parents=True, exist_ok=True)
+    Path(f"{state_path}.sha256").unlink(missing_ok=True)
+    Path(f"{state_path}{STATE_METADATA_SUFFIX}").unlink(missing_ok=True)
+    tmp_link = f"{state_path}.tmp.{os.getpid()}"
+    os.symlink((entry_dir(key["key"], store_dir) / STATE_FILE).resolve(), tmp_link)
+    os.replace(tmp_link, state_path)
+    return job_id
+
+
+def restore(manifest: dict, state_path: str):
+    """
+    Points state_path at a stored state with a symlink (replaced atomically)
+    and writes its <state_path>.sha256, so the measurement jobs use it as if
+    job A had just written it.
+
+    Args:
+        manifest (dict): Entry returned by lookup()
+        state_path (str): State path of this experiment (see get_paths)
+    """
+    Path(state_path).parent.mkdir(parents=True, exist_ok=True)
+    # The stored state's own metadata is read through the symlink
+    Path(f"{state_path}{STATE_METADATA_SUFFIX}").unlink(missing_ok=True)
+
+    tmp_link = f"{state_path}.tmp.{os.getpid()}"
+    os.symlink(manifest["path"], tmp_link)
+    os.replace(tmp_link, state_path)
+
+    with open(f"{state_path}.sha256", "w") as f:
+        f.write(manifest["sha256"] + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up or restore the prepared state from the shared state store")
+    parser.add_argument("command", choices=["lookup", "restore", "follow", "announce"],
+                        help="lookup only reports; restore also links the state into ./state/; "
+                             "follow links the state a running job A will publish and prints its job id; "
+                             "announce records JOB_ID as the job A that will publish the state")
+    parser.add_argument("job_id", nargs="?", help="Job id of job A (announce)")
+    parser.add_argument("--qubits", type=int, default=GLOBAL_VARS["qubits"])
+    parser.add_argument("--cycles", type=int, default=GLOBAL_VARS["cycles"])
+    parser.add_argument("--store-dir", default=GLOBAL_VARS["state_store_dir"])
+    parser.add_argument("--verify", action="store_true", help="Re-hash the stored state before using it")
+    args = parser.parse_args()
+
+    qasm_path, _, state_path = get_paths(args.qubits, args.cycles)
+    if args.command == "announce":
+        if not args.job_id:
+            parser.error("announce needs the JOB_ID of job A")
+        announce(args.job_id, qasm_path, GLOBAL_VARS["performance"], args.store_dir)
+        sys.exit(0)
+    if args.command == "follow":
+        job_id = follow(qasm_path, state_path, GLOBAL_VARS["performance"], args.store_dir)
+        if job_id is None:
+            sys.exit(1)
+        # The only output, for the orchestrators' --dependency
+        print(job_id)
+        sys.exit(0)
+
+    manifest = lookup(qasm_path, GLOBAL_VARS["performance"], args.store_dir, verify=args.verify)
+    if manifest is None:
+        print(f"No stored state for {qasm_path} in {args.store_dir}")
+        sys.exit(1)
+
+    if args.command == "restore":
+        restore(manifest, state_path)
+    print(f"Stored state {manifest['key'][:12]} (prepared by job {manifest['job_id']} of {manifest['experiment']}, "
+          f"{manifest['created']}) -> {state_path}")
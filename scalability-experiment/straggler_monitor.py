@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import argparse
+import threading
+import statistics
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+from shared import GLOBAL_VARS, get_paths
+from cost_model import CostModel
+from xeb_controller import read_measurement_jobs, cancel_jobs
+
+LOGS_DIR = Path(GLOBAL_VARS["logs_dir"])
+SHARDS_DIR = "shards"
+SPECULATIVE_JOBS_FILE = "speculative_jobs.txt"
+DISCARDED_SUFFIX = ".discarded"
+
+
+############## Shard bookkeeping ##############
+def shards_dir(logs_dir) -> Path:
+    return Path(logs_dir) / SHARDS_DIR
+
+
+def heartbeat_path(logs_dir, job_id) -> Path:
+    return shards_dir(logs_dir) / f"heartbeat_{job_id}.json"
+
+
+def marker_path(logs_dir, shard_index) -> Path:
+    return shards_dir(logs_dir) / f"shard_{shard_index}.done"
+
+
+def claim_shard(logs_dir, shard_index, job_id) -> bool:
+    """
+    Claims the shard for job_id by creating its marker with O_EXCL, which
+    succeeds for exactly one of the copies of a shard.
+
+    Returns:
+        bool: True if this job finished the shard first
+    """
+    shards_dir(logs_dir).mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(marker_path(logs_dir, shard_index), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    with os.fdopen(fd, "w") as f:
+        json.dump({"job_id": str(job_id), "timestamp": datetime.utcnow().isoformat() + "Z"}, f)
+    return True
+
+
+def shard_winner(logs_dir, shard_index) -> str:
+    """
+    Returns the job id that claimed the shard, or None while it is unfinished.
+    """
+    path = marker_path(logs_dir, shard_index)
+    if not path.exists():
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)["job_id"]
+    except (OSError, ValueError):
+        # Marker created but not written yet
+        return None
+
+
+def discard_job_output(logs_dir, job_id) -> list:
+    """
+    Renames a losing copy's amplitude files and sidecar with a .discarded
+    suffix, so the amplitude and sidecar globs (and combine_amplitude_logs)
+    no longer see its shots.
+
+    Returns:
+        list: The renamed files
+    """
+    logs_dir = Path(logs_dir)
+    outputs = list(logs_dir.glob(f"qr_amplitudes_circuit_*_{job_id}.*")) + list(logs_dir.glob(f"{job_id}.xeb"))
+
+    discarded = []
+    for output in outputs:
+        if output.name.endswith(DISCARDED_SUFFIX):
+            continue
+        os.replace(output, output.with_name(output.name + DISCARDED_SUFFIX))
+        discarded.append(output)
+    return discarded
+
+
+def read_speculative_jobs(logs_dir) -> dict:
+    """
+    Returns the speculative copies launched so far, one "JOB_INDEX JOB_ID" line per copy.
+
+    Returns:
+        dict: {shard index: [job_id, ...]}
+    """
+    jobs_file = Path(logs_dir) / SPECULATIVE_JOBS_FILE
+    if not jobs_file.exists():
+        return {}
+
+    speculative = {}
+    with open(jobs_file) as f:
+        for line in f:
+            items = line.split()
+            if len(items) == 2:
+                speculative.setdefault(int(items[0]), []).append(items[1])
+    return speculative
+
+
+def discard_losers(logs_dir) -> list:
+    """
+    Discards the output of every copy of a finished shard other than the
+    one that claimed it.
+
+    Returns:
+        list: The job ids whose output was discarded
+    """
+    speculative = read_speculative_jobs(logs_dir)
+    losers = []
+
+    for job in read_measurement_jobs(logs_dir):
+        copies = [job["job_id"]] + speculative.get(job["index"], [])
+        winner = shard_winner(logs_dir, job["index"])
+        if winner is None or len(copies) == 1:
+            continue
+        for job_id in copies:
+            if job_id != winner and discard_job_output(logs_dir, job_id):
+                losers.append(job_id)
+
+    return losers
+
+
+############## Heartbeat ##############
+class Heartbeat(threading.Thread):
+    """
+    Refreshes logs/shards/heartbeat_{job_id}.json every interval seconds
+    while a measurement job samples, and adds finished_at once it is done.
+    backend.run only writes the amplitude file at the end, so a heartbeat
+    tells that the job is alive, not how far it got; the monitor judges
+    progress by the time elapsed against expected_duration().
+    """
+
+    def __init__(self, logs_dir, shard_index: int, shots: int, interval: float = 30.0):
+        super().__init__(daemon=True)
+        self.path = heartbeat_path(logs_dir, GLOBAL_VARS["job_id"])
+        self.interval = interval
+        self.record = {
+            "job_id": GLOBAL_VARS["job_id"],
+            "shard": shard_index,
+            "shots": shots,
+            "node": os.getenv("SLURMD_NODENAME"),
+            "started_at": time.time(),
+        }
+        self._stop_event = threading.Event()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.beat()
+
+    def beat(self):
+        self.record["timestamp"] = time.time()
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(self.record, f)
+        os.replace(tmp_path, self.path)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.record["finished_at"] = time.time()
+        self.beat()
+
+
+def read_heartbeats(logs_dir) -> dict:
+    heartbeats = {}
+    for path in shards_dir(logs_dir).glob("heartbeat_*.json"):
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        heartbeats[record["job_id"]] = record
+    return heartbeats
+
+
+def seconds_per_shot(heartbeats: dict) -> float:
+    """
+    Median sampling time per shot of the shards that finished, None until one has.
+    """
+    durations = [(heartbeat["finished_at"] - heartbeat["started_at"]) / heartbeat["shots"]
+                 for heartbeat in heartbeats.values() if "finished_at" in heartbeat and heartbeat["shots"]]
+    return statistics.median(durations) if durations else None
+
+
+def expected_duration(heartbeat: dict, per_shot: float, model: CostModel = None, qasm_path=None) -> float:
+    """
+    How long a shard should sample: its shots at the median time per shot
+    of the finished shards or, until one has finished, the measurement time
+    the cost model predicts for them.
+
+    Returns:
+        float: Seconds, or None without finished shards and a reliable model
+    """
+    if per_shot is not None:
+        return per_shot * heartbeat["shots"]
+    if model is None or not model.reliable("measurement_sec"):
+        return None
+    features = model.features(qasm_path, heartbeat["shots"])
+    if features["state_mb"] is None:
+        return None
+    return model.predict("measurement_sec", features)
+
+
+############## Monitor ##############
+def launch_duplicate(job: dict, heartbeat: dict, args) -> str:
+    """
+    Submits a speculative copy of a measurement shard, away from the node
+    the straggler runs on.
+
+    Returns:
+        str: The SLURM job id of the copy
+    """
+    measurement_args = os.getenv("MEASUREMENT_ARGS", "")
+    if "--speculation" not in measurement_args.split():
+        measurement_args = f"{measurement_args} --speculation".strip()
+    command = ["sbatch", "--parsable", f"--time={args.wall_time}",
+               f"--export=ALL,SHOTS={job['shots']},JOB_INDEX={job['index']},MEASUREMENT_ARGS={measurement_args}"]
+    if args.mem:
+        command.append(f"--mem={args.mem}")
+    if heartbeat.get("node"):
+        command.append(f"--exclude={heartbeat['node']}")
+    command.append("run_n_measurements.sh")
+
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    job_id = result.stdout.strip().split(";")[0]
+
+    with open(LOGS_DIR / SPECULATIVE_JOBS_FILE, "a") as f:
+        f.write(f"{job['index']} {job_id}\n")
+    return job_id
+
+
+def run_monitor(args):
+    resolved = set()
+    model = CostModel()
+    qasm_path = get_paths()[0] if model.reliable("measurement_sec") else None
+
+    while True:
+        now = time.time()
+        jobs = read_measurement_jobs(LOGS_DIR)
+        speculative = read_speculative_jobs(LOGS_DIR)
+        heartbeats = read_heartbeats(LOGS_DIR)
+
+        # Keep the first copy of each finished shard, stop and discard the others
+        unfinished = []
+        for job in jobs:
+            copies = [job["job_id"]] + speculative.get(job["index"], [])
+            winner = shard_winner(LOGS_DIR, job["index"])
+            if winner is None:
+                unfinished.append(job)
+                continue
+            losers = [job_id for job_id in copies if job_id != winner and job_id not in resolved]
+            if losers:
+                cancel_jobs(losers, cancel_running=True)
+                for job_id in losers:
+                    discard_job_output(LOGS_DIR, job_id)
+                resolved.update(losers)
+                print(f"[{datetime.utcnow().isoformat()}Z] shard {job['index']}: kept {winner}, discarded {losers}", flush=True)
+
+        if jobs and not unfinished:
+            print("All shards finished.", flush=True)
+            return
+
+        per_shot = seconds_per_shot(heartbeats)
+
+        launched = sum(len(copies) for copies in speculative.values())
+        for job in unfinished:
+            heartbeat = heartbeats.get(job["job_id"])
+            if heartbeat is None or job["index"] in speculative or launched >= args.max_speculative:
+                continue
+            elapsed = now - heartbeat["started_at"]
+            if elapsed < args.min_elapsed or "finished_at" in heartbeat:
+                continue
+
+            # A job refreshes its heartbeat while it runs, so an old one means it died or its node hangs
+            silent = now - heartbeat["timestamp"] > args.stall_timeout
+            expected = expected_duration(heartbeat, per_shot, model, qasm_path)
+            slow = expected is not None and elapsed > args.slow_ratio * expected
+            if silent or slow:
+                copy_id = launch_duplicate(job, heartbeat, args)
+                launched += 1
+                if silent:
+                    reason = f"no heartbeat for {now - heartbeat['timestamp']:.0f} s"
+                else:
+                    reason = f"running {elapsed:.0f} s, expected {expected:.0f} s"
+                print(f"[{datetime.utcnow().isoformat()}Z] shard {job['index']} ({job['job_id']} on "
+                      f"{heartbeat.get('node')}) is behind ({reason}); launched copy {copy_id}", flush=True)
+
+        time.sleep(args.poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Launch speculative copies of straggling measurement shards")
+    parser.add_argument("--slow-ratio", type=float, default=2.0,
+                        help="A shard is behind when it has run this many times its expected duration (the median "
+                             "time per shot of the finished shards, else the cost model's prediction)")
+    parser.add_argument("--stall-timeout", type=float, default=600.0,
+                        help="A shard is behind when its heartbeat, refreshed every 30 s while its job runs, "
+                             "is older than this many seconds")
+    parser.add_argument("--min-elapsed", type=float, default=300.0,
+                        help="Seconds a shard must have run before it can be judged")
+    parser.add_argument("--max-speculative", type=int, default=10,
+                        help="Maximum number of speculative copies to launch")
+    parser.add_argument("--wall-time", default="04:00:00",
+                        help="Wall time of the speculative copies, the same as the measurement jobs'")
+    parser.add_argument("--mem", help="Memory of the speculative copies, if not run_n_measurements.sh's --mem")
+    parser.add_argument("--poll-interval", type=float, default=60.0, help="Seconds between checks")
+    args = parser.parse_args()
+
+    run_monitor(args)
@@ -0,0 +1,339 @@
+import os
+import json
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+# Only the standard library is used here, so the orchestration scripts can
+# fill the queue from the login node without the experiment environment.
+DEFAULT_LOGS_DIR = Path("./logs/")
+DEFAULT_QUEUE_DIR = DEFAULT_LOGS_DIR / "queue"
+BATCH_SUFFIX = ".json"
+MANIFEST_FILE = "queue.json"
+ORPHANED_SUFFIX = ".orphaned"
+# squeue fails with this error for jobs it no longer knows about
+UNKNOWN_JOB_ERROR = "Invalid job id"
+# States of jobs that ended; squeue still lists them for a few minutes
+FINISHED_JOB_STATES = {"BOOT_FAIL", "CANCELLED", "COMPLETED", "DEADLINE", "FAILED", "NODE_FAIL", "OUT_OF_MEMORY",
+                       "PREEMPTED", "TIMEOUT"}
+
+
+def _timestamp() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _parse_timestamp(timestamp: str) -> datetime:
+    return datetime.fromisoformat(timestamp.replace("Z", ""))
+
+
+def slurm_job_alive(job_id: str) -> bool:
+    """
+    False only once SLURM reports the job gone: squeue rejects its id, or
+    lists it in a finished state. Anything else, e.g. squeue missing
+    (outside the cluster) or failing because slurmctld does not respond,
+    says nothing about the job, so it is assumed alive and nothing is
+    requeued by mistake.
+    """
+    try:
+        result = subprocess.run(["squeue", "-h", "-j", str(job_id), "-o", "%T"],
+                                capture_output=True, text=True, check=False)
+    except FileNotFoundError:
+        return True
+    if result.returncode != 0:
+        return UNKNOWN_JOB_ERROR not in result.stderr
+    states = set(result.stdout.split())
+    return not states or not states <= FINISHED_JOB_STATES
+
+
+class WorkQueue:
+    """
+    Shot batches on the shared filesystem, one JSON file per batch in
+    pending/, claimed/ or done/. A batch is claimed by renaming it from
+    pending/ to claimed/, under a name that carries the worker id; rename
+    is atomic within one filesystem, so exactly one worker wins each batch,
+    every claim names its owner from the start and no lock server is
+    needed.
+    """
+
+    def __init__(self, root=DEFAULT_QUEUE_DIR, logs_dir=DEFAULT_LOGS_DIR):
+        self.root = Path(root)
+        self.logs_dir = Path(logs_dir)
+        self.pending = self.root / "pending"
+        self.claimed = self.root / "claimed"
+        self.done = self.root / "done"
+        self.manifest_file = self.root / MANIFEST_FILE
+
+        for directory in (self.pending, self.claimed, self.done):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def populate(self, total_shots: int, batch_shots: int, reset: bool = False) -> list:
+        """
+        Splits total_shots into batches of batch_shots (the last batch takes
+        the remainder, so no shot is dropped) and enqueues them.
+
+        Args:
+            total_shots (int): Shots of the whole campaign
+            batch_shots (int): Shots per claimable batch
+            reset (bool): Discard the batches of a previous campaign first
+
+        Returns:
+            list: The enqueued batches
+        """
+        existing = [path for directory in (self.pending, self.claimed, self.done)
+                    for path in directory.glob(f"*{BATCH_SUFFIX}")]
+        if existing and not reset:
+            raise FileExistsError(f"Queue {self.root} already holds {len(existing)} batches; use reset to start over.")
+        for path in existing:
+            path.unlink()
+
+        batches = []
+        for index, start in enumerate(range(0, total_shots, batch_shots)):
+            batch = {
+                "batch_id": f"b{index:05d}",
+                "index": index,
+                "shots": min(batch_shots, total_shots - start),
+            }
+            self._write(self.pending / f"{batch['batch_id']}{BATCH_SUFFIX}", batch)
+            batches.append(batch)
+
+        self._write(self.manifest_file, {
+            "total_shots": total_shots,
+            "batch_shots": batch_shots,
+            "batches": len(batches),
+            "created_at": _timestamp(),
+        })
+        return batches
+
+    def claim(self, worker_id: str) -> dict:
+        """
+        Claims the next pending batch for worker_id.
+
+        Returns:
+            dict: The claimed batch, or None once the queue is empty
+        """
+        for pending_path in sorted(self.pending.glob(f"*{BATCH_SUFFIX}")):
+            claimed_path = self._claimed_path(pending_path.stem, worker_id)
+            try:
+                os.rename(pending_path, claimed_path)
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+
+            with open(claimed_path) as f:
+                batch = json.load(f)
+            batch["worker"] = worker_id
+            batch["claimed_at"] = _timestamp()
+            self._write(claimed_path, batch)
+            return batch
+
+        return None
+
+    def complete(self, batch: dict) -> bool:
+        """
+        Moves a claimed batch to done/. Call only after the batch's amplitude
+        file and sidecar are written; a batch that never reaches done/ is
+        sampled again.
+
+        If the worker no longer holds the claim (it was taken for dead and
+        the batch requeued, maybe to another worker), the batch is left
+        alone and the worker's output for it is orphaned instead, so its
+        shots are only counted from the worker that holds the batch.
+
+        Returns:
+            bool: True if the batch was moved to done/
+        """
+        claimed_path = self._claimed_path(batch["batch_id"], batch["worker"])
+        # Take the claim over by rename first, so it cannot be requeued while done_at is written
+        completing_path = claimed_path.with_name(f"{claimed_path.name}.complete.{os.getpid()}")
+        try:
+            os.rename(claimed_path, completing_path)
+        except FileNotFoundError:
+            self.orphan_output(batch["worker"], batch["batch_id"])
+            return False
+
+        batch["done_at"] = _timestamp()
+        self._write(completing_path, batch)
+        os.replace(completing_path, self.done / f"{batch['batch_id']}{BATCH_SUFFIX}")
+        return True
+
+    def orphan_output(self, worker: str, batch_id: str) -> list:
+        """
+        Renames the output a worker wrote for a batch with an .orphaned
+        suffix, so it no longer matches the amplitude and sidecar globs.
+
+        Returns:
+            list: The renamed files
+        """
+        tag = f"{worker}_{batch_id}"
+        orphaned = []
+        for output in list(self.logs_dir.glob(f"*_{tag}.*")) + list(self.logs_dir.glob(f"{tag}.*")):
+            if not output.name.endswith(ORPHANED_SUFFIX):
+                os.replace(output, output.with_name(output.name + ORPHANED_SUFFIX))
+                orphaned.append(output)
+        return orphaned
+
+    def requeue_orphans(self, is_alive=slurm_job_alive) -> list:
+        """
+        Returns the claimed batches of workers that are gone (e.g. killed at
+        their wall time) to pending/. Whatever output the dead worker left for
+        such a batch is renamed with an .orphaned suffix, so it no longer
+        matches the amplitude and sidecar globs and its shots are only
+        counted once, from the worker that re-runs the batch.
+
+        Returns:
+            list: The requeued batches
+        """
+        requeued = []
+        alive = {}
+
+        for claimed_path in sorted(self.claimed.glob(f"*{BATCH_SUFFIX}")):
+            # The owner comes from the name, so a worker that died before writing its claim is requeued too
+            batch_id, _, worker = claimed_path.stem.partition(".")
+            if worker not in alive:
+                alive[worker] = is_alive(worker)
+            if alive[worker]:
+                continue
+
+            # Take the batch over by rename first, so only one caller requeues it
+            requeue_path = claimed_path.with_name(f"{claimed_path.name}.requeue.{os.getpid()}")
+            try:
+                os.rename(claimed_path, requeue_path)
+            except FileNotFoundError:
+                continue
+            with open(requeue_path) as f:
+                batch = json.load(f)
+
+            self.orphan_output(worker, batch_id)
+
+            history = batch.get("orphaned_by", []) + [worker]
+            batch = {"batch_id": batch_id, "index": batch["index"], "shots": batch["shots"], "orphaned_by": history}
+            self._write(requeue_path, batch)
+            os.rename(requeue_path, self.pending / f"{batch_id}{BATCH_SUFFIX}")
+            requeued.append(batch)
+
+        return requeued
+
+    def counts(self) -> dict:
+        return {
+            "pending": len(list(self.pending.glob(f"*{BATCH_SUFFIX}"))),
+            "claimed": len(list(self.claimed.glob(f"*{BATCH_SUFFIX}"))),
+            "done": len(list(self.done.glob(f"*{BATCH_SUFFIX}"))),
+        }
+
+    def manifest(self) -> dict:
+        if not self.manifest_file.exists():
+            return None
+        with open(self.manifest_file) as f:
+            return json.load(f)
+
+    def done_batches(self) -> list:
+        batches = []
+        for path in sorted(self.done.glob(f"*{BATCH_SUFFIX}")):
+            with open(path) as f:
+                batches.append(json.load(f))
+        return batches
+
+    def accounting(self) -> dict:
+        """
+        Checks that every enqueued shot was sampled exactly once: every batch
+        of the manifest is in done/, and each one has exactly one sidecar
+        recording its number of shots.
+
+        Returns:
+            dict: {"total_shots", "done_shots", "missing_batches", "mismatched_batches"}
+        """
+        manifest = self.manifest() or {"total_shots": 0, "batches": 0}
+        done = {batch["batch_id"]: batch for batch in self.done_batches()}
+
+        missing = [f"b{index:05d}" for index in range(manifest["batches"]) if f"b{index:05d}" not in done]
+        mismatched = []
+        for batch_id, batch in done.items():
+            sidecars = list(self.logs_dir.glob(f"*_{batch_id}.xeb"))
+            if len(sidecars) != 1:
+                mismatched.append(batch_id)
+                continue
+            with open(sidecars[0]) as f:
+                if json.load(f)["shots"] != batch["shots"]:
+                    mismatched.append(batch_id)
+
+        return {
+            "total_shots": manifest["total_shots"],
+            "done_shots": sum(batch["shots"] for batch in done.values()),
+            "missing_batches": missing,
+            "mismatched_batches": mismatched,
+        }
+
+    def worker_summary(self) -> list:
+        """
+        Per-worker share of the done batches.
+
+        Returns:
+            list: [{"worker", "batches", "shots", "busy_sec", "shots_per_sec"}, ...]
+        """
+        workers = {}
+        for batch in self.done_batches():
+            busy = (_parse_timestamp(batch["done_at"]) - _parse_timestamp(batch["claimed_at"])).total_seconds()
+            summary = workers.setdefault(batch["worker"], {"worker": batch["worker"], "batches": 0, "shots": 0, "busy_sec": 0.0})
+            summary["batches"] += 1
+            summary["shots"] += batch["shots"]
+            summary["busy_sec"] += busy
+
+        for summary in workers.values():
+            summary["shots_per_sec"] = summary["shots"] / summary["busy_sec"] if summary["busy_sec"] > 0 else 0.0
+        return sorted(workers.values(), key=lambda summary: summary["worker"])
+
+    def _claimed_path(self, batch_id: str, worker: str) -> Path:
+        return self.claimed / f"{batch_id}.{worker}{BATCH_SUFFIX}"
+
+    @staticmethod
+    def _write(path: Path, batch: dict):
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(batch, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def makespan_estimate(workers: list) -> (float, float):
+    """
+    Compares the measured makespan of the dynamic queue (the busiest
+    worker's time) with the makespan a static equal split would have had,
+    given each worker's measured throughput.
+
+    Returns:
+        (float, float): (dynamic makespan, static makespan) in seconds
+    """
+    rates = [worker["shots_per_sec"] for worker in workers if worker["shots_per_sec"] > 0]
+    if not rates:
+        return 0.0, 0.0
+
+    total_shots = sum(worker["shots"] for worker in workers)
+    static_share = total_shots / len(workers)
+    dynamic = max(worker["busy_sec"] for worker in workers)
+    static = max(static_share / rate for rate in rates)
+    return dynamic, static
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the shot-batch queue read by pilot measurement workers")
+    parser.add_argument("--queue-dir", default=str(DEFAULT_QUEUE_DIR))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    populate_parser = subparsers.add_parser("populate", help="Enqueue shot batches")
+    populate_parser.add_argument("--total-shots", type=int, required=True)
+    populate_parser.add_argument("--batch-shots", type=int, required=True)
+    populate_parser.add_argument("--reset", action="store_true",
+                                 help="Discard the batches of a previous campaign")
+
+    subparsers.add_parser("status", help="Print the number of pending, claimed and done batches")
+    subparsers.add_parser("requeue", help="Return batches claimed by workers that are no longer running")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue_dir)
+    if args.command == "populate":
+        batches = queue.populate(args.total_shots, args.batch_shots, reset=args.reset)
+        print(f"Enqueued {len(batches)} batches ({args.total_shots} shots) in {args.queue_dir}")
+    elif args.command == "requeue":
+        print(f"Requeued {len(queue.requeue_orphans())} orphaned batches")
+    else:
+        print(queue.counts())
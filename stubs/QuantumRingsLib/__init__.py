@@ -0,0 +1,211 @@
+"""
+Stub of the QuantumRingsLib API used by the experiment scripts, so the
+pipeline can run without the Quantum Rings SDK, a license or a GPU (see
+run_local.py). It mirrors only what 1_prepare_state.py and
+2_n_measurements.py call: provider and backends, QASM loading, saving and
+loading the simulation state, and sampling shots into an amplitude file
+with one "bitstring real imag" line per shot.
+
+The simulator behind the stub is chosen with QR_STUB_SIMULATOR, either a
+name from SIMULATORS or "module:Class". A simulator implements:
+
+    from_qasm(qasm: str) -> simulator        (classmethod)
+    from_arrays(arrays: dict) -> simulator   (classmethod)
+    to_arrays() -> dict of NumPy arrays      (stored in the state file)
+    sample(shots: int, seed) -> (list of bitstrings, complex ndarray of amplitudes)
+
+"random" (the default) costs O(shots) for any qubit count; "statevector"
+(see stubs/statevector.py) simulates the circuit exactly, for circuits of
+up to about 30 qubits.
+
+QR_STUB_SECONDS_PER_SHOT adds an artificial sampling cost per shot.
+"""
+import io
+import os
+import hashlib
+import re
+import time
+import importlib
+from collections import Counter
+
+import numpy as np
+
+from statevector import StatevectorSimulator
+
+QREG_PATTERN = re.compile(r"qreg\s+\w+\[(\d+)\];")
+GATE_PATTERN = re.compile(r"^\s*([a-z][a-z0-9_]*)\b", re.MULTILINE)
+NON_GATE_STATEMENTS = {"include", "qreg", "creg", "barrier", "measure", "gate", "opaque"}
+
+
+############## Simulators ##############
+def _splitmix64(keys: np.ndarray) -> np.ndarray:
+    z = keys + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class RandomAmplitudeSimulator:
+    """
+    Draws uniformly random bitstrings, each with a fixed pseudo-random
+    complex Gaussian amplitude derived from a hash of the bitstring, i.e.
+    a Porter-Thomas-like state without simulating the circuit. Costs O(shots)
+    for any number of qubits up to 64.
+    """
+
+    def __init__(self, num_qubits: int, state_seed: int = 0):
+        if num_qubits > 64:
+            raise ValueError("The random stub simulator supports at most 64 qubits.")
+        self.num_qubits = num_qubits
+        self.state_seed = state_seed
+
+    @classmethod
+    def from_qasm(cls, qasm: str):
+        # The same circuit always gets the same amplitudes
+        return cls(num_qubits(qasm), state_seed=int.from_bytes(hashlib.sha256(qasm.encode()).digest()[:8], "little"))
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        return cls(int(arrays["num_qubits"]), int(arrays["state_seed"]))
+
+    def to_arrays(self) -> dict:
+        return {"num_qubits": np.array(self.num_qubits), "state_seed": np.array(self.state_seed)}
+
+    def amplitudes(self, keys: np.ndarray) -> np.ndarray:
+        with np.errstate(over="ignore"):
+            hashed = _splitmix64(keys ^ np.uint64(self.state_seed))
+            second = _splitmix64(hashed)
+        u1 = ((hashed >> np.uint64(11)).astype(np.float64) + 1) / 2 ** 53
+        u2 = (second >> np.uint64(11)).astype(np.float64) / 2 ** 53
+
+        # Box-Muller: a complex Gaussian with E|a|^2 = 2^-n
+        radius = np.sqrt(-np.log(u1) / 2 ** self.num_qubits)
+        return radius * np.exp(2j * np.pi * u2)
+
+    def sample(self, shots: int, seed=None):
+        rng = np.random.default_rng(seed)
+        bits = rng.integers(0, 2, size=(shots, self.num_qubits), dtype=np.uint8)
+
+        keys = np.zeros(shots, dtype=np.uint64)
+        for column in range(self.num_qubits):
+            keys = (keys << np.uint64(1)) | bits[:, column].astype(np.uint64)
+
+        bitstrings = ["".join(row) for row in np.where(bits == 1, "1", "0")]
+        return bitstrings, self.amplitudes(keys)
+
+
+SIMULATORS = {
+    "random": RandomAmplitudeSimulator,
+    "statevector": StatevectorSimulator,
+}
+
+
+def simulator_class(name: str = None):
+    """
+    Resolves a simulator name from SIMULATORS or a "module:Class" path.
+    """
+    name = name or os.getenv("QR_STUB_SIMULATOR", "random")
+    if name in SIMULATORS:
+        return SIMULATORS[name]
+
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def num_qubits(qasm: str) -> int:
+    return sum(int(size) for size in QREG_PATTERN.findall(qasm))
+
+
+############## Circuits ##############
+class QuantumCircuit:
+    def __init__(self, qasm: str = None, simulation_state_file: str = None):
+        self._qasm = qasm
+        self.simulator = None
+        self.measured = False
+
+        if simulation_state_file is not None:
+            with open(simulation_state_file, "rb") as f:
+                arrays = dict(np.load(io.BytesIO(f.read()), allow_pickle=False))
+            self.simulator = simulator_class(str(arrays.pop("simulator"))).from_arrays(arrays)
+
+    @classmethod
+    def from_qasm_file(cls, qasm_path):
+        with open(qasm_path) as f:
+            return cls(qasm=f.read())
+
+    def qasm(self) -> str:
+        return self._qasm
+
+    def count_ops(self) -> dict:
+        return dict(Counter(gate for gate in GATE_PATTERN.findall(self._qasm or "") if gate not in NON_GATE_STATEMENTS and gate != "openqasm"))
+
+    def measure_all(self):
+        self.measured = True
+
+
+def OptimizeQuantumCircuit(qc: QuantumCircuit):
+    return qc
+
+
+############## Execution ##############
+class Result:
+    def __init__(self, simulator_name: str, simulator):
+        self.simulator_name = simulator_name
+        self.simulator = simulator
+
+    def SaveSystemStateToDiskFile(self, state_path):
+        buffer = io.BytesIO()
+        np.savez(buffer, simulator=np.array(self.simulator_name), **self.simulator.to_arrays())
+        with open(state_path, "wb") as f:
+            f.write(buffer.getvalue())
+
+
+class Job:
+    def __init__(self, result: Result):
+        self._result = result
+
+    def result(self) -> Result:
+        return self._result
+
+    def status(self) -> str:
+        return "JOB_DONE"
+
+
+class Backend:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return f"<StubBackend {self.name} ({os.getenv('QR_STUB_SIMULATOR', 'random')})>"
+
+    def run(self, qc: QuantumCircuit, shots: int = 1, mode: str = "sync", quiet: bool = True,
+            generate_amplitude: bool = False, file: str = None, seed=None, performance: str = None, **kwargs) -> Job:
+        simulator_name = os.getenv("QR_STUB_SIMULATOR", "random")
+        simulator = qc.simulator or simulator_class(simulator_name).from_qasm(qc.qasm())
+
+        bitstrings, amplitudes = simulator.sample(shots, seed)
+        if generate_amplitude and file is not None:
+            with open(file, "w") as f:
+                for bitstring, amplitude in zip(bitstrings, amplitudes):
+                    f.write(f"{bitstring} {amplitude.real:.10e} {amplitude.imag:.10e}\n")
+
+        time.sleep(float(os.getenv("QR_STUB_SECONDS_PER_SHOT", 0)) * shots)
+        return Job(Result(simulator_name, simulator))
+
+
+class QuantumRingsProvider:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def backends(self) -> list:
+        return [Backend("scarlet_quantum_rings"), Backend("amber_quantum_rings")]
+
+    def active_account(self) -> dict:
+        return {"name": "local-stub", "backends": ["scarlet_quantum_rings", "amber_quantum_rings"]}
+
+    def get_backend(self, name: str) -> Backend:
+        return Backend(name)
+
+
+def job_monitor(job: Job, quiet: bool = True):
+    return job
@@ -0,0 +1,367 @@
+"""
+Reference statevector simulator in NumPy, for circuits small enough to hold
+the full state (about 30 qubits: 2^30 complex64 amplitudes are 8 GiB). It
+executes the gate set of the RCS circuits in this repo (u2, u3, rx, ry, rz,
+sx, sxdg, s and cx, plus a few other standard qelib1 gates) in place on the
+state, viewed as a tensor with one axis of size 2 per gate qubit. Large
+states are split into chunks that a thread pool updates concurrently (NumPy
+releases the GIL for the arithmetic).
+
+Registered as "statevector" in the stub QuantumRingsLib, so run_local.py
+--stub with QR_STUB_SIMULATOR=statevector runs the whole pipeline on real
+amplitudes. QR_STUB_THREADS sets the number of threads (default: all CPUs)
+and QR_STUB_PRECISION=single halves the memory of the state.
+
+Bitstrings are little-endian like Qiskit's: the last character is qubit 0.
+
+Usage:
+    python stubs/statevector.py circuit.qasm --shots 10000 -o amplitudes.txt
+"""
+import os
+import re
+import ast
+import math
+import time
+import argparse
+import operator
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+STATEMENT_PATTERN = re.compile(r"^([a-zA-Z][a-zA-Z0-9_]*)\s*(?:\((.*)\))?\s*(.*)$", re.DOTALL)
+REGISTER_PATTERN = re.compile(r"^qreg\s+(\w+)\s*\[\s*(\d+)\s*\]$")
+QUBIT_PATTERN = re.compile(r"^(\w+)\s*\[\s*(\d+)\s*\]$")
+IGNORED_STATEMENTS = {"OPENQASM", "include", "creg", "barrier", "measure"}
+
+# States smaller than this are updated on the calling thread
+CHUNK_THRESHOLD = 1 << 18
+# Sampling works on blocks of amplitudes, so no cumulative sum of the whole state is held
+SAMPLE_BLOCK = 1 << 20
+PRECISIONS = {"double": np.complex128, "single": np.complex64}
+
+_ANGLE_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+############## Gates ##############
+def _u3(theta: float, phi: float, lam: float) -> np.ndarray:
+    cos, sin = math.cos(theta / 2), math.sin(theta / 2)
+    return np.array([[cos, -np.exp(1j * lam) * sin],
+                     [np.exp(1j * phi) * sin, np.exp(1j * (phi + lam)) * cos]])
+
+
+def _diagonal(phase: float) -> np.ndarray:
+    return np.diag([1, np.exp(1j * phase)])
+
+
+SX = np.array([[1 + 1j, 1 - 1j], [1 - 1j, 1 + 1j]]) / 2
+
+SINGLE_QUBIT_GATES = {
+    "u3": _u3,
+    "u": _u3,
+    "u2": lambda phi, lam: _u3(math.pi / 2, phi, lam),
+    "u1": _diagonal,
+    "p": _diagonal,
+    "rx": lambda theta: np.array([[math.cos(theta / 2), -1j * math.sin(theta / 2)],
+                                  [-1j * math.sin(theta / 2), math.cos(theta / 2)]]),
+    "ry": lambda theta: np.array([[math.cos(theta / 2), -math.sin(theta / 2)],
+                                  [math.sin(theta / 2), math.cos(theta / 2)]]),
+    "rz": lambda lam: np.diag([np.exp(-0.5j * lam), np.exp(0.5j * lam)]),
+    "sx": lambda: SX,
+    "sxdg": lambda: SX.conj().T,
+    "s": lambda: _diagonal(math.pi / 2),
+    "sdg": lambda: _diagonal(-math.pi / 2),
+    "t": lambda: _diagonal(math.pi / 4),
+    "tdg": lambda: _diagonal(-math.pi / 4),
+    "x": lambda: np.array([[0, 1], [1, 0]]),
+    "y": lambda: np.array([[0, -1j], [1j, 0]]),
+    "z": lambda: np.diag([1, -1]),
+    "h": lambda: np.array([[1, 1], [1, -1]]) / math.sqrt(2),
+    "id": lambda: np.eye(2),
+}
+
+TWO_QUBIT_GATES = {"cx", "cz"}
+
+
+def parse_angle(expression: str) -> float:
+    """
+    Evaluates a QASM parameter such as "pi*-0.25" or "-pi/2".
+
+    Raises:
+        ValueError: For anything but numbers, pi, + - * / and parentheses
+    """
+    def evaluate(node):
+        if isinstance(node, ast.Expression):
+            return evaluate(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return float(node.value)
+        if isinstance(node, ast.Name) and node.id == "pi":
+            return math.pi
+        if isinstance(node, ast.BinOp) and type(node.op) in _ANGLE_OPERATORS:
+            return _ANGLE_OPERATORS[type(node.op)](evaluate(node.left), evaluate(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _ANGLE_OPERATORS:
+            return _ANGLE_OPERATORS[type(node.op)](evaluate(node.operand))
+        raise ValueError(f"Unsupported QASM parameter: {expression}")
+
+    try:
+        return evaluate(ast.parse(expression.strip(), mode="eval"))
+    except SyntaxError as e:
+        raise ValueError(f"Unsupported QASM parameter: {expression}") from e
+
+
+def parse_qasm(qasm: str) -> (int, list):
+    """
+    Parses OpenQASM 2.0 text into a gate list. Quantum registers are laid
+    out one after another, the first starting at qubit 0.
+
+    Returns:
+        (int, list): (number of qubits, [(name, 2x2 matrix or None, [qubit, ...]), ...])
+
+    Raises:
+        ValueError: For gate definitions and gates outside the supported set
+    """
+    offsets = {}
+    num_qubits = 0
+    gates = []
+
+    code = "\n".join(line.partition("//")[0] for line in qasm.splitlines())
+    for statement in (statement.strip() for statement in code.split(";")):
+        if not statement:
+            continue
+        register = REGISTER_PATTERN.match(statement)
+        if register:
+            offsets[register.group(1)] = num_qubits
+            num_qubits += int(register.group(2))
+            continue
+
+        name, parameters, operands = STATEMENT_PATTERN.match(statement).groups()
+        if name in IGNORED_STATEMENTS:
+            continue
+        if name not in SINGLE_QUBIT_GATES and name not in TWO_QUBIT_GATES:
+            raise ValueError(f"Unsupported QASM statement: {statement}")
+
+        qubits = []
+        for operand in operands.split(","):
+            qubit = QUBIT_PATTERN.match(operand.strip())
+            if not qubit or qubit.group(1) not in offsets:
+                raise ValueError(f"Only indexed qubits of declared registers are supported: {statement}")
+            qubits.append(offsets[qubit.group(1)] + int(qubit.group(2)))
+
+        if name in TWO_QUBIT_GATES:
+            if len(qubits) != 2 or qubits[0] == qubits[1] or parameters:
+                raise ValueError(f"Malformed two-qubit gate: {statement}")
+            gates.append((name, None, qubits))
+        else:
+            angles = [parse_angle(parameter) for parameter in parameters.split(",")] if parameters else []
+            if len(qubits) != 1:
+                raise ValueError(f"Malformed single-qubit gate: {statement}")
+            gates.append((name, np.asarray(SINGLE_QUBIT_GATES[name](*angles), dtype=complex), qubits))
+
+    return num_qubits, gates
+
+
+############## Simulator ##############
+class StatevectorSimulator:
+    """
+    Holds the full state of num_qubits qubits, amplitude of basis state k at
+    state[k] with qubit q as bit q of k.
+    """
+
+    def __init__(self, num_qubits: int, state: np.ndarray = None, threads: int = None, precision: str = None):
+        precision = precision or os.getenv("QR_STUB_PRECISION", "double")
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, expected one of {sorted(PRECISIONS)}.")
+
+        self.num_qubits = num_qubits
+        self.threads = threads or int(os.getenv("QR_STUB_THREADS", 0)) or os.cpu_count() or 1
+        if state is None:
+            state = np.zeros(1 << num_qubits, dtype=PRECISIONS[precision])
+            state[0] = 1
+        self.state = state
+
+    @classmethod
+    def from_qasm(cls, qasm: str, **kwargs):
+        num_qubits, gates = parse_qasm(qasm)
+        simulator = cls(num_qubits, **kwargs)
+        simulator.run(gates)
+        return simulator
+
+    @classmethod
+    def from_arrays(cls, arrays: dict):
+        return cls(int(arrays["num_qubits"]), state=arrays["state"])
+
+    def to_arrays(self) -> dict:
+        return {"num_qubits": np.array(self.num_qubits), "state": self.state}
+
+    ############## Gate application ##############
+    def _view(self, *qubits) -> np.ndarray:
+        """
+        The state as a tensor with one axis of size 2 per qubit in qubits,
+        ordered from the highest qubit to the lowest, and an axis for each
+        run of other qubits between them (of size 1 if empty).
+        """
+        shape = []
+        upper = self.num_qubits
+        for qubit in sorted(qubits, reverse=True):
+            shape += [1 << (upper - qubit - 1), 2]
+            upper = qubit
+        shape.append(1 << upper)
+        return self.state.reshape(shape)
+
+    def _chunked(self, view: np.ndarray, update):
+        """
+        Calls update on slices of view along its first axis (or last, if
+        the first is too short) from the thread pool; update must only
+        touch its slice.
+        """
+        if self.threads == 1 or self.state.size < CHUNK_THRESHOLD:
+            update(view)
+            return
+
+        axis = 0 if view.shape[0] >= self.threads else view.ndim - 1
+        bounds = np.linspace(0, view.shape[axis], min(self.threads, view.shape[axis]) + 1, dtype=int)
+        index = [slice(None)] * view.ndim
+        chunks = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            index[axis] = slice(start, stop)
+            chunks.append(view[tuple(index)])
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            list(pool.map(update, chunks))
+
+    def apply_single(self, matrix: np.ndarray, qubit: int):
+        matrix = matrix.astype(self.state.dtype)
+        (m00, m01), (m10, m11) = matrix
+
+        def update(view):
+            zero, one = view[:, 0], view[:, 1]
+            if m01 == 0 and m10 == 0:
+                if m00 != 1:
+                    zero *= m00
+                one *= m11
+                return
+            # One temporary of a quarter of the chunk
+            new_zero = m00 * zero
+            new_zero += m01 * one
+            one *= m11
+            one += m10 * zero
+            zero[...] = new_zero
+
+        self._chunked(self._view(qubit), update)
+
+    def apply_cx(self, control: int, target: int):
+        # Swap the target's 0 and 1 halves where the control is 1
+        if control > target:
+            index_zero, index_one = (slice(None), 1, slice(None), 0), (slice(None), 1, slice(None), 1)
+        else:
+            index_zero, index_one = (slice(None), 0, slice(None), 1), (slice(None), 1, slice(None), 1)
+
+        def update(view):
+            zero, one = view[index_zero], view[index_one]
+            kept = zero.copy()
+            zero[...] = one
+            one[...] = kept
+
+        self._chunked(self._view(control, target), update)
+
+    def apply_cz(self, a: int, b: int):
+        self._chunked(self._view(a, b), lambda view: view[:, 1, :, 1].__imul__(-1))
+
+    def run(self, gates: list):
+        """
+        Applies the gates of parse_qasm() in order. Consecutive single-qubit
+        gates on a qubit are multiplied into one matrix first, so each run
+        of them costs one pass over the state.
+        """
+        pending = {}
+        for name, matrix, qubits in gates:
+            if matrix is not None:
+                pending[qubits[0]] = matrix @ pending[qubits[0]] if qubits[0] in pending else matrix
+                continue
+
+            for qubit in qubits:
+                if qubit in pending:
+                    self.apply_single(pending.pop(qubit), qubit)
+            if name == "cx":
+                self.apply_cx(*qubits)
+            else:
+                self.apply_cz(*qubits)
+
+        for qubit, matrix in pending.items():
+            self.apply_single(matrix, qubit)
+
+    ############## Sampling ##############
+    def probabilities(self, start: int = 0, stop: int = None) -> np.ndarray:
+        block = self.state[start:stop]
+        return block.real.astype(np.float64) ** 2 + block.imag.astype(np.float64) ** 2
+
+    def sample(self, shots: int, seed=None):
+        """
+        Draws shots basis states from |state|^2, a block of SAMPLE_BLOCK
+        amplitudes at a time.
+
+        Returns:
+            (list, np.ndarray): (bitstrings, their complex amplitudes)
+        """
+        rng = np.random.default_rng(seed)
+        starts = np.arange(0, self.state.size, SAMPLE_BLOCK)
+        block_totals = np.cumsum([self.probabilities(start, start + SAMPLE_BLOCK).sum() for start in starts])
+
+        # Unnormalized states from accumulated rounding are sampled relative to their norm
+        draws = rng.random(shots) * block_totals[-1]
+        blocks = np.minimum(np.searchsorted(block_totals, draws, side="right"), len(starts) - 1)
+
+        indices = np.empty(shots, dtype=np.int64)
+        for block in np.unique(blocks):
+            selected = blocks == block
+            offset = block_totals[block - 1] if block else 0.0
+            cumulative = np.cumsum(self.probabilities(starts[block], starts[block] + SAMPLE_BLOCK))
+            within = np.searchsorted(cumulative, draws[selected] - offset, side="right")
+            indices[selected] = starts[block] + np.minimum(within, cumulative.size - 1)
+
+        bitstrings = [format(index, f"0{self.num_qubits}b") for index in indices]
+        return bitstrings, self.state[indices].astype(np.complex128)
+
+    def linear_xeb(self, bitstrings: list) -> float:
+        """
+        Linear cross-entropy benchmarking fidelity 2^n <p(x)> - 1 of sampled
+        bitstrings against this state's ideal probabilities.
+        """
+        indices = np.array([int(bitstring, 2) for bitstring in bitstrings], dtype=np.int64)
+        return float((1 << self.num_qubits) * np.mean(np.abs(self.state[indices]) ** 2) - 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a small QASM circuit with the reference statevector simulator")
+    parser.add_argument("qasm", help="OpenQASM 2.0 circuit")
+    parser.add_argument("--shots", type=int, default=0, help="Shots to sample (0: only simulate)")
+    parser.add_argument("--seed", type=int, help="Sampling seed")
+    parser.add_argument("--threads", type=int, help="Default: QR_STUB_THREADS or all CPUs")
+    parser.add_argument("--precision", choices=sorted(PRECISIONS), help="Default: QR_STUB_PRECISION or double")
+    parser.add_argument("-o", "--output", help="Amplitude file (\"bitstring real imag\" per shot)")
+    args = parser.parse_args()
+
+    with open(args.qasm) as f:
+        num_qubits, gates = parse_qasm(f.read())
+
+    start = time.perf_counter()
+    simulator = StatevectorSimulator(num_qubits, threads=args.threads, precision=args.precision)
+    simulator.run(gates)
+    elapsed = time.perf_counter() - start
+    norm = float(np.sqrt(simulator.probabilities().sum()))
+    print(f"{num_qubits} qubits, {len(gates)} gates in {elapsed:.2f} s on {simulator.threads} threads "
+          f"({len(gates) / elapsed:.0f} gates/s), norm {norm:.12f}")
+
+    if args.shots:
+        bitstrings, amplitudes = simulator.sample(args.shots, args.seed)
+        print(f"Linear XEB of {args.shots} sampled shots: {simulator.linear_xeb(bitstrings):.4f}")
+        if args.output:
+            with open(args.output, "w") as f:
+                for bitstring, amplitude in zip(bitstrings, amplitudes):
+                    f.write(f"{bitstring} {amplitude.real:.10e} {amplitude.imag:.10e}\n")
+            print(f"Wrote {args.output}")